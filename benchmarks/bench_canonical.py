@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Benchmark of the url canonicalization of core/spiders/canonical.py : urls per second canonicalized from absolute
+# urls, links of a page resolved in a batch against the page url (cold, and warm once the cache holds the links of
+# the navigation shared by the pages of a site), and fingerprints, against the former _process_extracted_path of
+# mini_spider.py and urljoin.
+#
+# Usage :
+#
+#     python benchmarks/bench_canonical.py [--urls 200000] [--links-per-page 100]
+
+import os
+import sys
+import time
+import argparse
+from urllib.parse import urlparse, urljoin, parse_qsl, urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.spiders.canonical import canonicalize, resolve_all, url_fingerprint
+
+
+def make_url(i):
+    return "HTTP://www.Site%d.com:80/articles/./%d/index.html?ref=home&page=%d#comments" % (i % 5000, i, i % 97)
+
+
+def make_links(page, n_links):
+    """
+    :return: List<str>, links of a page, a mix of relative, absolute path, scheme relative and absolute links, half of
+    them shared by every page as a navigation bar
+    """
+    links = []
+    for j in range(n_links):
+        k = j if j % 2 else page * n_links + j
+        links.append(("../tag/%d?p=%d" % (k, j), "/post/%d.html" % k, "//cdn.site.com/img/%d.jpg" % k,
+                      "http://www.site.com/a/%d#x" % k)[j % 4])
+    return links
+
+
+def legacy(scheme, hostname, path):
+    # _process_extracted_path of mini_spider.py before canonicalization
+    parsed = urlparse(path)
+    _hostname = hostname
+    _scheme = scheme
+    if parsed.hostname is not None and parsed.hostname != "":
+        _hostname = parsed.hostname
+    if parsed.scheme is not None and parsed.scheme != "":
+        _scheme = parsed.scheme
+    kw = dict(parse_qsl(parsed.query))
+    parsed_path = parsed.path if len(kw) == 0 else "{}?{}".format(parsed.path, urlencode(kw))
+    return "%s://%s/%s" % (_scheme, _hostname, parsed_path[1:])
+
+
+def rate(n, fn):
+    start = time.perf_counter()
+    fn()
+    return n / (time.perf_counter() - start)
+
+
+def main(raw_args):
+    parser = argparse.ArgumentParser(description="url canonicalization benchmark")
+    parser.add_argument('--urls', type=int, default=200000)
+    parser.add_argument('--links-per-page', type=int, default=100)
+    args = parser.parse_args(raw_args)
+
+    urls = [make_url(i) for i in range(args.urls)]
+    n_pages = max(1, args.urls // args.links_per_page)
+    pages = [("http://www.site.com/blog/%d/index.html" % page, make_links(page, args.links_per_page))
+             for page in range(n_pages)]
+    n_links = n_pages * args.links_per_page
+
+    def _resolve_pages():
+        for base, links in pages:
+            resolve_all(base, links)
+
+    results = []
+    canonicalize.cache_clear()
+    results.append(("canonicalize", rate(len(urls), lambda: [canonicalize(url) for url in urls])))
+    results.append(("url_fingerprint", rate(len(urls), lambda: [url_fingerprint(url) for url in urls])))
+    canonicalize.cache_clear()
+    results.append(("resolve_all, cold", rate(n_links, _resolve_pages)))
+    results.append(("resolve_all, warm", rate(n_links, _resolve_pages)))
+    results.append(("urljoin", rate(n_links, lambda: [urljoin(base, link) for base, links in pages for link in links])))
+    results.append(("legacy", rate(n_links, lambda: [legacy("http", "www.site.com", link)
+                                                     for _, links in pages for link in links])))
+    for name, urls_per_second in results:
+        print("{:<18} : {:>10.0f} urls/s".format(name, urls_per_second))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
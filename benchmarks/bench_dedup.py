@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Benchmark of the url dedup stores of core/spiders/dedup.py against the former set of url strings : memory per
+# million urls (strings included for the set, they are kept alive by it) and lookups per second of seen and unseen
+# urls, plus the false positive rate of the Bloom filter.
+#
+# Usage :
+#
+#     python benchmarks/bench_dedup.py [--urls 1000000] [--lookups 200000]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import itertools
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.spiders.dedup import FingerprintSet, ScalableBloomFilter, MmapFingerprintSet
+
+
+def make_url(i):
+    return "http://www.site%d.com/articles/%d/index.html?page=%d&ref=home" % (i % 5000, i, i % 97)
+
+
+def build(factory, n_urls):
+    """
+    :return: Tuple(Object, float), store, seconds spent
+    """
+    start = time.perf_counter()
+    store = factory()
+    for i in range(n_urls):
+        store.add(make_url(i))
+    return store, time.perf_counter() - start
+
+
+def footprint(factory, n_urls):
+    """
+    :return: int, bytes held by the store once filled, traced for the set since the strings are kept by it
+    """
+    if factory is set:
+        tracemalloc.start()
+        store = set(make_url(i) for i in range(n_urls))
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del store
+        return size
+    store, _ = build(factory, n_urls)
+    # the mmap table lives in the page cache, not in the python heap
+    size = store.nbytes()
+    if hasattr(store, "close"):
+        store.close()
+    return size
+
+
+def lookups(store, urls):
+    start = time.perf_counter()
+    found = 0
+    for url in urls:
+        if url in store:
+            found += 1
+    return len(urls) / (time.perf_counter() - start), found
+
+
+def main(raw_args):
+    parser = argparse.ArgumentParser(description="url dedup stores benchmark")
+    parser.add_argument('--urls', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--error-rate', type=float, default=0.001)
+    args = parser.parse_args(raw_args)
+
+    seen = [make_url(i) for i in range(0, args.urls, max(1, args.urls // args.lookups))][:args.lookups]
+    unseen = [make_url(args.urls + i) for i in range(args.lookups)]
+    dirname = tempfile.mkdtemp()
+    # a new file for every build, a reopened one would hold the urls already
+    files = itertools.count()
+    stores = [
+        ("set of strings", set),
+        ("fingerprint table", lambda: FingerprintSet(capacity=args.urls)),
+        ("scalable bloom", lambda: ScalableBloomFilter(capacity=args.urls // 4, error_rate=args.error_rate)),
+        ("mmap table", lambda: MmapFingerprintSet(os.path.join(dirname, "seen-%d.fp" % next(files)),
+                                                      capacity=args.urls)),
+    ]
+    try:
+        for name, factory in stores:
+            size = footprint(factory, args.urls)
+            store, elapsed = build(factory, args.urls)
+            hits_rate, hits = lookups(store, seen)
+            misses_rate, false_positives = lookups(store, unseen)
+            assert hits == len(seen)
+            print("{:<18} : {:>7.1f} MB per million urls, {:>9.0f} adds/s, {:>9.0f} hits/s, {:>9.0f} misses/s, "
+                  "false positives {:.4%}".format(name, size / 2 ** 20 * 1e6 / args.urls, args.urls / elapsed,
+                                                  hits_rate, misses_rate, false_positives / len(unseen)))
+            if hasattr(store, "close"):
+                store.close()
+            del store
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Benchmark of task switching in SimpleEventLoop :
+#
+#     recursive : futures are not bound to a loop, set_ret executes Task._step synchronously (the original design)
+#     ready queue : futures schedule their Handles with loop.call_soon and the loop drains the queue once per iteration
+#
+# A relay of N tasks is built, each task waits on its own future and resolves the future of its successor. The
+# recursive design resumes the whole relay inside a single set_ret call, hence the stack grows with N.
+#
+# Usage :
+#
+#     python benchmarks/bench_event_loop.py [--tasks 500] [--rounds 200]
+
+import os
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.downloader.handlers.async_socket_http11 import Future, Task, SimpleEventLoop
+
+
+class Stats:
+
+    def __init__(self, measure_depth=False):
+        self.switches = 0
+        self.peak_depth = 0
+        # walking the stack is O(depth), it is done in a separate pass to keep the timing fair
+        self.measure_depth = measure_depth
+
+    def record(self):
+        self.switches += 1
+        if not self.measure_depth:
+            return
+        depth = 0
+        frame = sys._getframe()
+        while frame is not None:
+            depth += 1
+            frame = frame.f_back
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+
+
+def relay(n_tasks, n_rounds, loop=None, measure_depth=False):
+    """
+    :param n_tasks: int, number of tasks in the relay
+    :param n_rounds: int, number of times the baton goes through the relay
+    :param loop: SimpleEventLoop or None, None runs the recursive design
+    :param measure_depth: bool, record the peak stack depth
+    :return: (Stats, float), statistics and elapsed seconds
+    """
+    stats = Stats(measure_depth)
+    # futures[r][i] is the baton handed to task i in round r, the last task of a round resolves finished[r]
+    futures = [[Future(loop=loop) for _ in range(n_tasks)] for _ in range(n_rounds)]
+    finished = [Future(loop=loop) for _ in range(n_rounds)]
+
+    def runner(i):
+        for r in range(n_rounds):
+            yield from futures[r][i]
+            stats.record()
+            if i + 1 < n_tasks:
+                futures[r][i + 1].set_ret(None)
+            else:
+                finished[r].set_ret(None)
+
+    start = time.perf_counter()
+    if loop is None:
+        tasks = [Task(runner(i)) for i in range(n_tasks)]
+        for r in range(n_rounds):
+            # the whole relay completes inside this call
+            futures[r][0].set_ret(None)
+    else:
+        def routine():
+            tasks = [Task(runner(i), loop=loop) for i in range(n_tasks)]
+            for r in range(n_rounds):
+                futures[r][0].set_ret(None)
+                yield from finished[r]
+        loop.run_until_complete(routine())
+    elapsed = time.perf_counter() - start
+    return stats, elapsed
+
+
+def main(raw_args):
+    parser = argparse.ArgumentParser(description="task switching benchmark")
+    parser.add_argument('--tasks', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args(raw_args)
+
+    # the recursive design needs a deep enough stack to complete at all
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), args.tasks * 8 + 1000))
+
+    for name, make_loop in (("recursive", lambda: None), ("ready queue", SimpleEventLoop)):
+        try:
+            stats, elapsed = relay(args.tasks, args.rounds, loop=make_loop())
+            depth_stats, _ = relay(args.tasks, 1, loop=make_loop(), measure_depth=True)
+        except RecursionError:
+            print("{:<12} : stack overflow".format(name))
+            continue
+        print("{:<12} : {:>10.0f} switches/sec, peak stack depth {:>7d} frames".format(
+            name, stats.switches / elapsed, depth_stats.peak_depth))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Benchmark of the frontier of core/spiders/scheduler.py with the crawl strategies of core/spiders/frontier.py : jobs
+# put then got per second as the frontier grows, the cost of an operation grows with log n, i.e. barely. Jobs are
+# offered as the spiders do, with --maxsize the jobs beyond it wait in the overflow of the frontier.
+#
+# Usage :
+#
+#     python benchmarks/bench_frontier.py [--sizes 10000,100000,1000000] [--hosts 1000] [--maxsize 0]
+
+import os
+import re
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.downloader.handlers.async_socket_http11 import SimpleEventLoop
+from core.spiders.scheduler import HostScheduler
+from core.spiders.frontier import RoundRobinStrategy, BreadthFirstStrategy, DepthFirstStrategy, BestFirstStrategy
+
+
+def make_job(i, n_hosts):
+    ext = ".jpg" if i % 7 == 0 else ".html"
+    return "http://www.site%d.com/articles/%d%s" % (i % n_hosts, i, ext), 3, i % 13
+
+
+def run(strategy, jobs, maxsize=0):
+    """
+    :return: Tuple(float, float), puts and gets per second
+    """
+    loop = SimpleEventLoop()
+    q = HostScheduler(maxsize=maxsize, loop=loop, strategy=strategy)
+    start = time.perf_counter()
+    for job in jobs:
+        q.offer(job)
+    puts = len(jobs) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(len(jobs)):
+        q.task_done(q.get_nowait())
+    gets = len(jobs) / (time.perf_counter() - start)
+    q.close()
+    loop.close()
+    return puts, gets
+
+
+def main(raw_args):
+    parser = argparse.ArgumentParser(description="crawl frontier benchmark")
+    parser.add_argument('--sizes', default="10000,100000,1000000")
+    parser.add_argument('--hosts', type=int, default=1000)
+    parser.add_argument('--maxsize', type=int, default=0)
+    args = parser.parse_args(raw_args)
+
+    strategies = [
+        ("round_robin", RoundRobinStrategy),
+        ("bfs", BreadthFirstStrategy),
+        ("dfs", DepthFirstStrategy),
+        ("best_first", lambda: BestFirstStrategy(media_types=[".jpg"], target=re.compile(r"\.html$"))),
+    ]
+    for size in map(int, args.sizes.split(",")):
+        jobs = [make_job(i, args.hosts) for i in range(size)]
+        for name, factory in strategies:
+            puts, gets = run(factory(), jobs, args.maxsize)
+            print("{:>8} jobs, {:<12} : {:>9.0f} puts/s, {:>9.0f} gets/s".format(size, name, puts, gets))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Benchmark of response parsing on multi-MB bodies delivered in socket sized reads : the former async_download
+# accumulated the reads and re-parsed the whole buffer with http.client.HTTPResponse after each one (quadratic), while
+# core/downloader/http_parser.py consumes every read once.
+#
+# Usage :
+#
+#     python benchmarks/bench_http_parser.py [--sizes 1,4,16] [--read-size 8192] [--legacy-max 8]
+
+import io
+import os
+import sys
+import time
+import argparse
+from http.client import HTTPResponse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.downloader.http_parser import ResponseParser
+
+MB = 1024 * 1024
+
+
+def make_message(size, chunked):
+    body = os.urandom(size)
+    if not chunked:
+        return b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (size, body), body
+    pieces = [b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"]
+    for i in range(0, size, 16384):
+        piece = body[i:i + 16384]
+        pieces.append(b"%x\r\n%s\r\n" % (len(piece), piece))
+    pieces.append(b"0\r\n\r\n")
+    return b"".join(pieces), body
+
+
+class _FakeSocket:
+
+    def __init__(self, data):
+        self._fp = io.BytesIO(data)
+
+    def makefile(self, *args, **kwargs):
+        return self._fp
+
+
+def legacy_parse(message, read_size):
+    """
+    The former async_download loop : accumulate, then parse everything read so far after every read
+    """
+    buf = b""
+    content_length = -1
+    for i in range(0, len(message), read_size):
+        buf += message[i:i + read_size]
+        response = HTTPResponse(_FakeSocket(buf))
+        response.begin()
+        if content_length == -1:
+            content_length = int(response.getheader("Content-Length"))
+        response.chunked = False
+        try:
+            if len(response.read()) >= content_length:
+                break
+        except Exception:
+            pass
+    return response
+
+
+def incremental_parse(message, read_size):
+    parser = ResponseParser()
+    view = memoryview(message)
+    for i in range(0, len(message), read_size):
+        parser.feed(view[i:i + read_size])
+    assert parser.complete
+    return parser
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    ret = func(*args)
+    return time.perf_counter() - start, ret
+
+
+def main(raw_args):
+    parser = argparse.ArgumentParser(description="HTTP/1.1 response parser benchmark")
+    parser.add_argument('--sizes', default="1,4,16")
+    parser.add_argument('--read-size', type=int, default=8192)
+    parser.add_argument('--legacy-max', type=int, default=8, help="largest body (MB) parsed the former way")
+    args = parser.parse_args(raw_args)
+
+    for size in [int(n) for n in args.sizes.split(",")]:
+        for chunked in (False, True):
+            message, body = make_message(size * MB, chunked)
+            elapsed, ret = timed(incremental_parse, message, args.read_size)
+            assert bytes(ret.body) == body
+            line = "{:>3d} MB {:<14} : incremental {:>8.1f} MB/s".format(
+                size, "chunked" if chunked else "content-length", size / elapsed)
+            # the former parser only handled Content-Length framing
+            if not chunked and size <= args.legacy_max:
+                elapsed, _ = timed(legacy_parse, message, args.read_size)
+                line += ", re-parse per read {:>8.1f} MB/s".format(size / elapsed)
+            print(line)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Benchmark of the keep-alive connection pool (core/downloader/pool.py) : a local HTTP/1.1 server waits before serving
+# the first request of every connection, standing in for the TCP and TLS round trips of a remote host. Deep pagination
+# on one host is simulated by workers fetching pages one after another, with and without settings.KEEP_ALIVE.
+#
+# Usage :
+#
+#     python benchmarks/bench_keep_alive.py [--pages 200] [--concurrency 8] [--latency 0.02]
+
+import os
+import sys
+import time
+import socket
+import threading
+import argparse
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import core.downloader.handlers.async_socket_http11 as http11
+from core.downloader.handlers.async_socket_http11 import Task, SimpleEventLoop, async_urlopen
+from config import settings
+
+BODY = b"<html><body>" + b"x" * 4096 + b"</body></html>"
+
+
+def start_server(latency):
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1024)
+    reply = b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(BODY), BODY)
+
+    def handle(conn):
+        time.sleep(latency)
+        buf = b""
+        while True:
+            while b"\r\n\r\n" not in buf:
+                data = conn.recv(4096)
+                if not data:
+                    conn.close()
+                    return
+                buf += data
+            _, buf = buf.split(b"\r\n\r\n", 1)
+            conn.sendall(reply)
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def run(url, n_pages, concurrency):
+    loop = SimpleEventLoop()
+    pending = list(range(n_pages))
+
+    def worker():
+        while pending:
+            n = pending.pop()
+            response = yield from async_urlopen("%s?page=%d" % (url, n), loop=loop)
+            yield from response.read()
+            response.release()
+
+    def routine():
+        tasks = [Task(worker(), loop=loop) for _ in range(concurrency)]
+        for t in tasks:
+            yield from t
+
+    start = time.perf_counter()
+    loop.run_until_complete(routine())
+    elapsed = time.perf_counter() - start
+    stats = dict(loop.connection_pool.stats)
+    loop.close()
+    return n_pages / elapsed, stats
+
+
+def main(raw_args):
+    parser = argparse.ArgumentParser(description="keep-alive connection pool benchmark")
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args(raw_args)
+
+    http11.DEBUG_TIME_ELAPSE = False
+    logging.disable(logging.ERROR)
+
+    port = start_server(args.latency)
+    url = "http://127.0.0.1:%d/list" % port
+    for keep_alive in (False, True):
+        settings.KEEP_ALIVE = keep_alive
+        rate, stats = run(url, args.pages, args.concurrency)
+        print("keep-alive={:<5} : {:>8.1f} pages/sec, {}".format(str(keep_alive), rate, stats))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
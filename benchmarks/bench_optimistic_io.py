@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Benchmark of the optimistic (try-first) read/write path of the async_socket_http11 downloader against a local
+# threaded HTTP server. Each mode fetches the same bodies concurrently and reports wall time and selector syscalls.
+#
+# Usage :
+#
+#     python benchmarks/bench_optimistic_io.py [--requests 200] [--concurrency 50] [--size 262144]
+
+import os
+import sys
+import time
+import socket
+import threading
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import core.downloader.handlers.async_socket_http11 as http11
+from core.downloader.handlers.async_socket_http11 import Task, SimpleEventLoop, async_urlopen, PROC_IN_PROGRESS
+from config import settings
+
+
+def start_server(body):
+    """
+    :param body: bytes, body served for every request
+    :return: int, port listened on 127.0.0.1
+    """
+    header = b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body)
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1024)
+
+    def handle(conn):
+        req = b""
+        while b"\r\n\r\n" not in req:
+            data = conn.recv(4096)
+            if not data:
+                break
+            req += data
+        conn.sendall(header + body)
+        conn.close()
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def fetch_all(url, n_requests, concurrency, expected):
+    loop = SimpleEventLoop()
+    loop.set_timeout(settings.TIME_OUT)
+    pending = list(range(n_requests))
+
+    def worker():
+        while pending:
+            pending.pop()
+            response = yield from async_urlopen(url, timeout=settings.TIME_OUT, loop=loop)
+            received = 0
+            while received < expected:
+                chunk = yield from response._read(8192)
+                if chunk == PROC_IN_PROGRESS:
+                    continue
+                if not chunk:
+                    break
+                # _read returns the number of bytes fed to the response parser
+                received += chunk
+            response.close()
+
+    def routine():
+        tasks = [Task(worker(), loop=loop) for _ in range(concurrency)]
+        for t in tasks:
+            yield from t
+
+    start = time.perf_counter()
+    loop.run_until_complete(routine())
+    return time.perf_counter() - start, loop.selector_stats
+
+
+def main(raw_args):
+    parser = argparse.ArgumentParser(description="optimistic I/O benchmark")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--size', type=int, default=256 * 1024)
+    args = parser.parse_args(raw_args)
+
+    http11.DEBUG_TIME_ELAPSE = False
+    import logging
+    logging.disable(logging.INFO)
+
+    body = b"x" * args.size
+    port = start_server(body)
+    url = "http://127.0.0.1:%d/bench" % port
+    expected = len(body) + len(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body))
+
+    for optimistic in (False, True):
+        settings.OPTIMISTIC_IO = optimistic
+        elapsed, stats = fetch_all(url, args.requests, args.concurrency, expected)
+        print("optimistic={:<5} : {:>8.1f} req/sec, {:>7.1f} MB/sec, selector syscalls {}".format(
+            str(optimistic), args.requests / elapsed, args.requests * args.size / elapsed / 2**20, stats))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
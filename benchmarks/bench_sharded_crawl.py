@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Benchmark of the sharded crawl mode (core/spiders/sharded.py) on a local synthetic site : several hosts (one port
+# each) serve pages linking to pages of every other host, and parsing burns a fixed amount of CPU per page to stand in
+# for lxml. Pages per second are reported for an increasing number of workers.
+#
+# Usage :
+#
+#     python benchmarks/bench_sharded_crawl.py [--hosts 8] [--pages 100] [--workers 1,2,4] [--parse-cost 2e-3]
+
+import os
+import re
+import sys
+import time
+import socket
+import threading
+import argparse
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import core.downloader.handlers.async_socket_http11 as http11
+from core.spiders.base_spider import BaseAsyncSpider
+from core.spiders.sharded import run_sharded
+
+LINK = re.compile(rb'href="([^"]+)"')
+
+
+def start_site(n_hosts, n_pages):
+    """
+    :return: List<int>, ports of the synthetic hosts
+    """
+    listeners = []
+    for _ in range(n_hosts):
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1024)
+        listeners.append(listener)
+    ports = [l.getsockname()[1] for l in listeners]
+
+    def page(port, n):
+        # page n of every host links to page n+1 of every host, hence the whole site is reachable from the roots
+        links = ['<a href="http://127.0.0.1:%d/p/%d">p</a>' % (other, (n + 1) % n_pages) for other in ports]
+        body = ("<html><body>%s</body></html>" % "".join(links)).encode("utf-8")
+        # chunked framing, as served by most dynamic sites
+        return b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n%x\r\n%s\r\n0\r\n\r\n" % (len(body), body)
+
+    def handle(conn, port):
+        req = b""
+        while b"\r\n\r\n" not in req:
+            data = conn.recv(4096)
+            if not data:
+                conn.close()
+                return
+            req += data
+        n = int(req.split(b" ")[1].rsplit(b"/", 1)[-1] or 0)
+        conn.sendall(page(port, n))
+        conn.close()
+
+    def serve(listener):
+        port = listener.getsockname()[1]
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=handle, args=(conn, port), daemon=True).start()
+
+    for listener in listeners:
+        threading.Thread(target=serve, args=(listener,), daemon=True).start()
+    return ports
+
+
+class SyntheticSpider(BaseAsyncSpider):
+
+    parse_cost = 2e-3
+
+    def parse_links(self, response):
+        # stands in for lxml parsing
+        deadline = time.perf_counter() + self.parse_cost
+        while time.perf_counter() < deadline:
+            pass
+        return [m.decode("utf-8") for m in LINK.findall(response.body)]
+        yield
+
+
+def crawl(seeds, n_workers, max_depth):
+    def make_spiders(seeds, loop, queue):
+        return [SyntheticSpider(root_url=url, max_redirect=3, max_depth=max_depth, loop=loop, queue=queue)
+                for url in (seeds or [None])]
+
+    start = time.perf_counter()
+    run_sharded(n_workers, seeds, make_spiders, concurrency=64)
+    return time.perf_counter() - start
+
+
+def main(raw_args):
+    parser = argparse.ArgumentParser(description="sharded crawl benchmark")
+    parser.add_argument('--hosts', type=int, default=8)
+    parser.add_argument('--pages', type=int, default=100)
+    parser.add_argument('--workers', default="1,2,4")
+    parser.add_argument('--parse-cost', type=float, default=2e-3)
+    args = parser.parse_args(raw_args)
+
+    http11.DEBUG_TIME_ELAPSE = False
+    logging.disable(logging.ERROR)
+    SyntheticSpider.parse_cost = args.parse_cost
+
+    ports = start_site(args.hosts, args.pages)
+    seeds = ["http://127.0.0.1:%d/p/0" % port for port in ports]
+    # every page of every host is reachable within this depth
+    max_depth = args.pages
+
+    n_pages = args.hosts * args.pages
+    print("%d cores, %d pages on %d hosts" % (os.cpu_count(), n_pages, args.hosts))
+    for n_workers in [int(n) for n in args.workers.split(",")]:
+        elapsed = crawl(seeds, n_workers, max_depth)
+        print("workers={:<3d} : {:>8.1f} pages/sec".format(n_workers, n_pages / elapsed))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
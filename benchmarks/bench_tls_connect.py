@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Benchmark of HTTPS connection setup against a local TLS server with artificial latency : the server waits before
+# answering each handshake. A blocking connect + handshake (the former async_urlopen) serializes the latency of every
+# connection, while the selector driven handshake overlaps them.
+#
+# A self-signed certificate is generated with the openssl command line tool and trusted through settings.CERT_FILE.
+#
+# Usage :
+#
+#     python benchmarks/bench_tls_connect.py [--connections 100] [--concurrency 50] [--latency 0.05]
+
+import os
+import sys
+import time
+import socket
+import ssl
+import tempfile
+import threading
+import subprocess
+import argparse
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import core.downloader.handlers.async_socket_http11 as http11
+from core.downloader.handlers.async_socket_http11 import Task, SimpleEventLoop, async_urlopen
+from core.downloader import tls
+from config import settings
+
+
+def make_certificate(dirname):
+    cert = os.path.join(dirname, "cert.pem")
+    key = os.path.join(dirname, "key.pem")
+    subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+                           "-days", "1", "-subj", "/CN=localhost",
+                           "-addext", "subjectAltName=DNS:localhost"], stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+def start_server(cert, key, latency):
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    # accept the legacy clients as well, so that both sides of the comparison can connect
+    ctx.minimum_version = ssl.TLSVersion.MINIMUM_SUPPORTED
+    ctx.set_ciphers("ALL:@SECLEVEL=0")
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1024)
+
+    def handle(conn):
+        try:
+            time.sleep(latency)
+            tls_conn = ctx.wrap_socket(conn, server_side=True)
+            tls_conn.recv(4096)
+            tls_conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+            tls_conn.close()
+        except (OSError, ssl.SSLError):
+            conn.close()
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def blocking_connect(url, loop):
+    """
+    The former HTTPS path of async_urlopen : blocking connect and blocking handshake on the loop thread
+    """
+    parsed = http11.urlparse(url)
+    uns_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    uns_sock.connect((parsed.hostname, parsed.port))
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    sock = ctx.wrap_socket(uns_sock, server_hostname=parsed.hostname)
+    sock.setblocking(False)
+    req = http11.Request('GET', url, parsed_url=parsed)
+    response = yield from req.send(sock, is_secured=True, loop=loop)
+    return response
+
+
+def run(url, n_connections, concurrency, connect):
+    loop = SimpleEventLoop()
+    loop.set_timeout(settings.TIME_OUT)
+    pending = list(range(n_connections))
+
+    def worker():
+        while pending:
+            pending.pop()
+            response = yield from connect(url, loop)
+            # reading the reply also processes the TLS 1.3 session tickets
+            chunk = http11.PROC_IN_PROGRESS
+            while chunk == http11.PROC_IN_PROGRESS:
+                chunk = yield from response._read(4096)
+            response.close()
+
+    def routine():
+        tasks = [Task(worker(), loop=loop) for _ in range(concurrency)]
+        for t in tasks:
+            yield from t
+
+    start = time.perf_counter()
+    loop.run_until_complete(routine())
+    return n_connections / (time.perf_counter() - start)
+
+
+def main(raw_args):
+    parser = argparse.ArgumentParser(description="TLS connection setup benchmark")
+    parser.add_argument('--connections', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args(raw_args)
+
+    http11.DEBUG_TIME_ELAPSE = False
+    logging.disable(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        cert, key = make_certificate(dirname)
+        port = start_server(cert, key, args.latency)
+        url = "https://localhost:%d/" % port
+        # trust the self-signed certificate
+        settings.CERT_FILE = cert
+
+        nonblocking = lambda url, loop: async_urlopen(url, timeout=settings.TIME_OUT, loop=loop)
+        for name, connect in (("blocking", blocking_connect), ("selector", nonblocking)):
+            rate = run(url, args.connections, args.concurrency, connect)
+            print("{:<9} : {:>8.1f} connections/sec".format(name, rate))
+        print("TLS session resumption rate of the selector path : %.2f" % tls.sessions.resumption_rate())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
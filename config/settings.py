@@ -10,8 +10,126 @@ import os
 
 # Root path will be compute dynamically in runtime
 
-# downlaoder
+# downlaoder : seconds a request may take from the connection to the end of its body (crawl_timeout of spider.conf),
+# seconds to connect (DNS, TCP and TLS) and to receive the response head once the request is sent, both bounded by
+# TIME_OUT, streamed bodies are bound by FIRST_BYTE_TIMEOUT between two reads instead of TIME_OUT
 TIME_OUT=15
+CONNECT_TIMEOUT=10
+FIRST_BYTE_TIMEOUT=10
+
+# event loop : maximum of ready callbacks executed per iteration before polling I/O again, 0 means no limit
+MAX_READY_PER_ITERATION=4096
+
+# downloader : try non-blocking recv/send before waiting on the selector
+OPTIMISTIC_IO=True
+
+# event loop : pool used by run_in_executor for parsing and media saving, "thread" or "process"
+EXECUTOR_TYPE="thread"
+EXECUTOR_WORKERS=4
+
+# dns resolver cache, seconds to keep answers and failures
+DNS_TTL=300
+DNS_NEGATIVE_TTL=30
+DNS_WORKERS=8
+DNS_CACHE_SIZE=100000
+
+# downloader : size of the buffers sockets are read into (recv_into), and number of free buffers recycled per loop
+READ_BUFFER_SIZE=65536
+READ_BUFFER_POOL_SIZE=16
+
+# media downloads : stream bodies to a temporary file renamed once complete instead of a PIL decode and re-encode,
+# bytes gathered before a write, signature check of image files, threads writing files
+DOWNLOAD_STREAMING=True
+DOWNLOAD_FLUSH_SIZE=262144
+DOWNLOAD_SNIFF_IMAGES=True
+FILE_IO_WORKERS=2
+
+# segmented downloads : files are fetched by byte ranges of DOWNLOAD_SEGMENT_SIZE bytes, DOWNLOAD_SEGMENTS at a time,
+# written in place and resumed from a sidecar progress file (streaming mode only)
+DOWNLOAD_SEGMENTED=True
+DOWNLOAD_SEGMENT_SIZE=1048576
+DOWNLOAD_SEGMENTS=4
+
+# downloader : advertise Accept-Encoding (gzip, deflate, and br when the brotli module is installed), responses are
+# decoded incrementally
+HTTP_COMPRESSION=True
+
+# keep-alive connection pool : idle sockets kept in total, connections per (scheme, host, port) (0 means no limit),
+# seconds an idle socket is kept
+KEEP_ALIVE=True
+POOL_MAX_IDLE=100
+POOL_MAX_PER_HOST=32
+POOL_IDLE_TIMEOUT=30
+
+# HTTP/2 : offer "h2" with ALPN to https hosts (needs the h2 module), streams multiplexed over one connection at most,
+# receive windows of a stream and of the connection in bytes
+HTTP2=True
+H2_MAX_STREAMS=100
+H2_STREAM_WINDOW=16777216
+H2_CONNECTION_WINDOW=67108864
+
+# on-disk HTTP cache : fresh pages are served without a request, stale ones are revalidated with their ETag or
+# Last-Modified, least recently used entries are evicted beyond HTTP_CACHE_MAX_SIZE bytes. Off by default, entries are
+# written under HTTP_CACHE_DIR relative to the working directory
+HTTP_CACHE=False
+HTTP_CACHE_DIR='./cache/http/'
+HTTP_CACHE_MAX_SIZE=1073741824
+
+# politeness : seconds between two requests started to the same host (crawl_interval of spider.conf, <= 0 disables it),
+# pages of a host crawled at the same time (0 means no limit), see core/spiders/scheduler.py
+CRAWL_INTERVAL=-1
+HOST_MAX_CONNECTIONS=32
+
+# order of the crawl (crawl_strategy of spider.conf) : "bfs" (shallowest pages first), "dfs" (deepest first, down to
+# max_depth), "best_first" (media links with the extensions below first, then urls matching target_url, then the
+# others) or "round_robin" (hosts in turn, pages of a host in discovery order), see core/spiders/frontier.py
+CRAWL_STRATEGY="bfs"
+CRAWL_MEDIA_TYPES=(".jpg", ".jpeg", ".png", ".gif")
+
+# jobs held by the priority heaps of the frontier, 0 means no limit (operations stay O(log n) at millions of jobs),
+# jobs found beyond the limit wait in arrival order until there is room, they are never dropped
+FRONTIER_MAXSIZE=0
+
+# adaptive per host concurrency (AIMD) below HOST_MAX_CONNECTIONS : window of a new host, factor applied to the window
+# on timeouts, errors and 429/503, latency over the best one beyond which the window stops growing, longest pause
+# honoured for a Retry-After, see core/spiders/congestion.py
+ADAPTIVE_CONCURRENCY=True
+AIMD_INITIAL_WINDOW=2
+AIMD_DECREASE=0.5
+AIMD_LATENCY_FACTOR=2.0
+RETRY_AFTER_MAX=300
+
+# retries of failed pages (connection refused or reset, timeouts, 5xx, 429) : retries per url, 0 disables them, first
+# and longest backoff in seconds, the delays are jittered, see core/spiders/retry.py
+RETRY_MAX=3
+RETRY_BASE_DELAY=1.0
+RETRY_MAX_DELAY=60.0
+
+# circuit breaker per host : consecutive failures holding the host back, 0 disables it, first and longest cooldown in
+# seconds before a single probe is let through
+BREAKER_THRESHOLD=5
+BREAKER_COOLDOWN=30.0
+BREAKER_MAX_COOLDOWN=600.0
+
+# query parameters dropped from the canonical form of urls, they track visitors and do not change the page, see
+# core/spiders/canonical.py
+URL_IGNORED_PARAMS=frozenset(["utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content", "gclid", "fbclid"])
+
+# urls seen by a spider : "table" (64-bit fingerprints, exact), "bloom" (scalable Bloom filter with the false positive
+# rate below), "mmap" (fingerprints in a file under DEDUP_DIR, kept across restarts) or "set" (url strings), urls held
+# before the first resize, see core/spiders/dedup.py
+DEDUP_STORE="table"
+DEDUP_CAPACITY=1048576
+DEDUP_ERROR_RATE=0.001
+DEDUP_DIR='./cache/dedup/'
+
+# sharded crawls : the worker processes share one table of fingerprints in shared memory instead of their own stores,
+# urls held by the table (8 bytes per slot, 32 MB for the default), see SharedFingerprintSet
+DEDUP_SHARED=True
+DEDUP_SHARED_CAPACITY=2097152
+
+# spider : number of worker processes, each one running its own event loop on a shard of hosts (see core/spiders/sharded.py)
+THREAD_COUNT=1
 
 # mail 
 MAIL_ADDR=["mail.x.com", "devops@x.com", "notify@x.com"]
@@ -79,7 +197,12 @@ LOGGING = {
 CERT_FILE = '/etc/ssl/certs/ca-certificates.crt'
 
 # see see https://github.com/python/cpython/blob/master/Lib/test/test_ssl.py for supported (tested) cipher algorithms
-CHIPHER = 'AES128-GCM-SHA256'
+# None keeps the OpenSSL defaults, a single suite like 'AES128-GCM-SHA256' restricts TLS 1.2 negotiation to it
+CHIPHER = None
+# verify certificates and hostnames against CERT_FILE (or the system store when it is missing)
+SSL_VERIFY = True
+# number of hosts whose latest TLS session is kept for resumption
+SSL_SESSION_CACHE_SIZE = 1024
 
 # Webkit support
 JsInjRoot = "/home/yiakwy/WorkSpace/Bitbucket/mini_spider/remote_inj_js_call_wireless_protocol"
\ No newline at end of file
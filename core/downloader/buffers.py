@@ -0,0 +1,46 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Receive buffers of the downloader : sockets are read with recv_into into preallocated bytearrays which are recycled
+# by the event loop, instead of allocating a bytes object per read and concatenating them.
+
+
+class BufferPool:
+    """
+    Free list of fixed size bytearrays, one pool per event loop
+
+    Key members :
+
+        acquire(size) : a bytearray of at least size bytes
+        release(buf) : give a buffer back once no memoryview of it is alive anymore
+        stats : Map<str, int>, counters of allocated and reused buffers
+    """
+
+    def __init__(self, buf_size=65536, max_free=16):
+        """
+        :param buf_size: int, size of pooled buffers
+        :param max_free: int, maximum of buffers kept in the free list
+        """
+        self.buf_size = buf_size
+        self.max_free = max_free
+        self._free = []
+        self.stats = {"allocated": 0, "reused": 0}
+
+    def acquire(self, size=None):
+        """
+        :param size: int, minimum size, buffers larger than buf_size are not pooled
+        :return: bytearray
+        """
+        if size is not None and size > self.buf_size:
+            self.stats["allocated"] += 1
+            return bytearray(size)
+        if self._free:
+            self.stats["reused"] += 1
+            return self._free.pop()
+        self.stats["allocated"] += 1
+        return bytearray(self.buf_size)
+
+    def release(self, buf):
+        if len(buf) == self.buf_size and len(self._free) < self.max_free:
+            self._free.append(buf)
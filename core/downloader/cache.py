@@ -0,0 +1,464 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# On-disk HTTP cache of the downloader (a private cache in the sense of RFC 7234) : responses carrying validators
+# (ETag, Last-Modified) or freshness information are stored, then
+#
+#     1. fresh entries (Cache-Control max-age, Expires, or 10% of the Last-Modified age) are served without any request
+#     2. stale entries are revalidated with If-None-Match / If-Modified-Since, a 304 is answered from the cache
+#     3. the store is bounded in bytes, least recently used entries are evicted first
+#
+# Each entry is a single file named by the fingerprint of its url : a JSON line of metadata followed by the decoded
+# body, written to a temporary file and renamed, so that shards crawling into the same directory never see a partial
+# entry. The in-memory index (fingerprint -> size, in LRU order) is rebuilt from the directory when the cache opens.
+#
+# reference:
+#     1. https://tools.ietf.org/html/rfc7234
+#     2. https://tools.ietf.org/html/rfc7232
+
+import os
+import io
+import time
+import json
+import hashlib
+import tempfile
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from http.client import parse_headers
+
+import logging
+import utils.Log as Log
+_logger = logging.getLogger("downloader/handlers/async_socket_http11")
+
+# status codes stored, see RFC 7231 section 6.1
+CACHEABLE_STATUS = (200, 203, 301, 308)
+# fields describing the transfer of the original message, the stored body is already decoded
+SKIPPED_HEADERS = ("connection", "keep-alive", "transfer-encoding", "content-encoding", "content-length")
+# upper bound of heuristic freshness, see RFC 7234 section 4.2.2
+MAX_HEURISTIC_LIFETIME = 86400
+
+
+def fingerprint(url):
+    """
+    :param url: str, url
+    :return: str, hexadecimal digest naming the entry of the url
+    """
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def parse_cache_control(value):
+    """
+    :param value: str, value of the Cache-Control header
+    :return: Map<str, str>, directive -> argument (None without argument)
+    """
+    directives = {}
+    for directive in (value or "").split(","):
+        name, _, arg = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('" ') if arg else None
+    return directives
+
+
+def _http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def freshness_lifetime(headers):
+    """
+    :param headers: http.client.HTTPMessage, headers of the response
+    :return: Number, seconds the response stays fresh, 0 when it must be revalidated before any use
+    """
+    cc = parse_cache_control(headers.get("cache-control"))
+    if "no-cache" in cc or "no-store" in cc:
+        return 0
+    for directive in ("s-maxage", "max-age"):
+        if cc.get(directive) is not None:
+            try:
+                return max(0, int(cc[directive]))
+            except ValueError:
+                return 0
+    date = _http_date(headers.get("date"))
+    expires = headers.get("expires")
+    if expires is not None:
+        expires = _http_date(expires)
+        # an invalid date, e.g. "0", means already expired
+        return max(0, expires - (date or time.time())) if expires is not None else 0
+    last_modified = _http_date(headers.get("last-modified"))
+    if last_modified is not None:
+        return min(MAX_HEURISTIC_LIFETIME, max(0, 0.1 * ((date or time.time()) - last_modified)))
+    return 0
+
+
+class CacheEntry:
+    """
+    A stored response
+
+    Key members :
+
+        status, headers (http.client.HTTPMessage), body (bytes)
+        age(now) : seconds since the response was generated by the origin
+        is_fresh(now) : the entry may be used without contacting the origin
+        validators() : Map<str, str>, conditional headers revalidating the entry
+    """
+
+    def __init__(self, url, status, fields, body, stored_at, initial_age=0):
+        """
+        :param url: str, url
+        :param status: int, status code
+        :param fields: List<Tuple(str, str)>, header fields
+        :param body: bytes, decoded body
+        :param stored_at: Number, time.time() when the response was stored or last revalidated
+        :param initial_age: Number, value of the Age header when it was stored
+        """
+        self.url = url
+        self.status = status
+        self.fields = fields
+        self.body = body
+        self.stored_at = stored_at
+        self.initial_age = initial_age
+        self.headers = parse_headers(io.BytesIO("".join("%s: %s\r\n" % field for field in fields).encode("latin-1")
+                                                + b"\r\n"))
+        self.lifetime = freshness_lifetime(self.headers)
+
+    def age(self, now):
+        return self.initial_age + max(0, now - self.stored_at)
+
+    def is_fresh(self, now):
+        return self.age(now) < self.lifetime
+
+    def validators(self):
+        headers = {}
+        etag = self.headers.get("etag")
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        last_modified = self.headers.get("last-modified")
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def dumps(self):
+        meta = {"url": self.url, "status": self.status, "fields": self.fields, "stored_at": self.stored_at,
+                "initial_age": self.initial_age}
+        return json.dumps(meta).encode("utf-8") + b"\n" + self.body
+
+    @classmethod
+    def loads(cls, data):
+        line, _, body = data.partition(b"\n")
+        meta = json.loads(line.decode("utf-8"))
+        return cls(meta["url"], meta["status"], [tuple(field) for field in meta["fields"]], body, meta["stored_at"],
+                   meta.get("initial_age", 0))
+
+
+class CachedResponse:
+    """
+    A response served from the cache, with the interface of async_socket_http11.Response
+
+    Key members :
+
+        read_headers(), read(), stream(writer) : coroutines returning at once
+        status, headers, body, get_header(name), body_view()
+        release(), close() : nothing to give back
+        revalidated : bool, the origin answered 304 Not Modified
+    """
+
+    from_cache = True
+
+    def __init__(self, method, entry, revalidated=False):
+        self.method = method
+        self.url = entry.url
+        self._entry = entry
+        self.revalidated = revalidated
+        self.complete = True
+
+    def read_headers(self, CHUNK=None):
+        return self._entry.status
+        yield
+
+    def read(self, CHUNK=None):
+        return self._entry.body
+        yield
+
+    def stream(self, writer, CHUNK=None):
+        writer.write(memoryview(self._entry.body))
+        yield from writer.drain()
+
+    def get_header(self, header):
+        return self._entry.headers.get(header)
+
+    @property
+    def status(self):
+        return self._entry.status
+
+    @property
+    def headers(self):
+        return self._entry.headers
+
+    @property
+    def body(self):
+        return self._entry.body
+
+    def body_view(self):
+        return memoryview(self._entry.body)
+
+    def is_reusable(self):
+        return False
+
+    def release(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _write_entry(path, data):
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".", suffix=".part", dir=dirname)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _read_entry(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    # the access time drives LRU ordering across runs
+    os.utime(path)
+    return data
+
+
+def _remove_entries(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            # evicted by another shard
+            pass
+
+
+def _scan_entries(dirname):
+    """
+    :param dirname: str, directory of the entries
+    :return: List<Tuple(str, int)>, fingerprint and size of the entries, least recently used first
+    """
+    entries = []
+    if os.path.isdir(dirname):
+        for sub in os.scandir(dirname):
+            if not sub.is_dir():
+                continue
+            for f in os.scandir(sub.path):
+                if f.name.startswith("."):
+                    continue
+                st = f.stat()
+                entries.append((max(st.st_atime, st.st_mtime), f.name, st.st_size))
+    return [(fp, size) for _, fp, size in sorted(entries)]
+
+
+class HTTPCache:
+    """
+    Size bounded on-disk cache of GET responses, bound to an event loop whose file executor performs the I/O
+
+    Key members :
+
+        load() : a coroutine building the index from the directory in the file executor, once, on first use
+        lookup(url) : a coroutine returning the CacheEntry of the url, or None
+        response(entry) : CachedResponse serving an entry
+        handle(url, entry, response) : a coroutine processing the response of a (possibly conditional) request, a 304
+        is turned into a CachedResponse, a cacheable response is stored once read (see Response.read)
+        store(response) : a coroutine storing a fully read response
+        stats : Map<str, int>, counters of fresh hits, revalidations, misses, stores and evictions
+    """
+
+    logger = Log.LogAdapter(_logger, "HTTPCache")
+
+    def __init__(self, dirname, loop, max_size=1 << 30, clock=time.time):
+        """
+        :param dirname: str, directory of the entries
+        :param loop: SimpleEventLoop
+        :param max_size: int, maximum of bytes stored
+        :param clock: Func() -> Number, wall clock, entries outlive the process
+        """
+        self.dirname = dirname
+        self._loop = loop
+        self.max_size = max_size
+        self._clock = clock
+        # fingerprint -> size, the most recently used entry is on the right
+        self._index = OrderedDict()
+        self.size = 0
+        self.stats = {"fresh": 0, "revalidated": 0, "miss": 0, "stored": 0, "evicted": 0}
+        # the directory is scanned by load(), a large cache must not block the loop thread
+        self._loaded = False
+        self._loading = None
+
+    def _path(self, fp):
+        return os.path.join(self.dirname, fp[:2], fp)
+
+    def load(self):
+        """
+        Concurrent callers wait for the same scan
+
+        :return: None
+        """
+        if self._loaded:
+            return
+        if self._loading is None:
+            self._loading = self._loop.run_in_executor(self._loop.file_executor, _scan_entries, self.dirname)
+        try:
+            entries = yield from self._loading
+        except OSError as e:
+            # the cache starts empty, entries found later are overwritten
+            self.logger.error("failed to scan %s : %s" % (self.dirname, e))
+            entries = []
+        if self._loaded:
+            return
+        self._loaded = True
+        self._loading = None
+        for fp, size in entries:
+            self._index[fp] = size
+            self.size += size
+        yield from self._evict()
+        self.logger.info("%d entries, %d bytes in %s" % (len(self._index), self.size, self.dirname))
+
+    def _evict(self):
+        """
+        Drop least recently used entries from the index at once, their files are removed in the file executor
+
+        :return: None
+        """
+        paths = []
+        while self.size > self.max_size and self._index:
+            fp, size = self._index.popitem(last=False)
+            self.size -= size
+            self.stats["evicted"] += 1
+            paths.append(self._path(fp))
+        if not paths:
+            return
+        try:
+            yield from self._loop.run_in_executor(self._loop.file_executor, _remove_entries, paths)
+        except OSError as e:
+            # left on disk, the next scan of the directory evicts them again
+            self.logger.error("failed to evict %d entries : %s" % (len(paths), e))
+
+    def _forget(self, fp):
+        size = self._index.pop(fp, None)
+        if size is not None:
+            self.size -= size
+
+    def lookup(self, url):
+        """
+        :param url: str, url
+        :return: CacheEntry or None
+        """
+        yield from self.load()
+        fp = fingerprint(url)
+        if fp not in self._index:
+            self.stats["miss"] += 1
+            return None
+        try:
+            data = yield from self._loop.run_in_executor(self._loop.file_executor, _read_entry, self._path(fp))
+            entry = CacheEntry.loads(data)
+        except (OSError, ValueError, KeyError) as e:
+            # evicted by another shard, or corrupted
+            self.logger.info("entry of %s dropped : %s" % (url, e))
+            self._forget(fp)
+            self.stats["miss"] += 1
+            return None
+        if entry.url != url:
+            self.stats["miss"] += 1
+            return None
+        self._index.move_to_end(fp)
+        return entry
+
+    def is_fresh(self, entry):
+        return entry.is_fresh(self._clock())
+
+    def response(self, entry, method="GET", revalidated=False):
+        self.stats["revalidated" if revalidated else "fresh"] += 1
+        return CachedResponse(method, entry, revalidated=revalidated)
+
+    def handle(self, url, entry, response):
+        """
+        :param url: str, url
+        :param entry: CacheEntry, entry revalidated by the request, None for an unconditional request
+        :param response: Response, response of the origin, headers not read yet
+        :return: Response or CachedResponse
+        """
+        if entry is not None:
+            status = yield from response.read_headers()
+            if status == 304:
+                yield from response.read()
+                response.release()
+                entry = yield from self._refresh(entry, response.headers)
+                return self.response(entry, method=response.method, revalidated=True)
+            self.stats["miss"] += 1
+        response._cache = self
+        return response
+
+    def _cacheable(self, response):
+        if response.method != "GET" or response.status not in CACHEABLE_STATUS or not response.complete:
+            return False
+        cc = parse_cache_control(response.get_header("cache-control"))
+        if "no-store" in cc or response.get_header("vary") == "*":
+            return False
+        headers = response.headers
+        # without validators nor freshness the entry could never be used
+        return headers.get("etag") is not None or headers.get("last-modified") is not None or \
+            freshness_lifetime(headers) > 0
+
+    def _initial_age(self, headers):
+        try:
+            return max(0, int(headers.get("age") or 0))
+        except ValueError:
+            return 0
+
+    def store(self, response):
+        """
+        :param response: Response, fully read response
+        :return: None
+        """
+        if not self._cacheable(response):
+            return
+        fields = [(name, value) for name, value in response.headers.items() if name.lower() not in SKIPPED_HEADERS]
+        entry = CacheEntry(response.url, response.status, fields, response.body, self._clock(),
+                           self._initial_age(response.headers))
+        yield from self._save(entry)
+        self.stats["stored"] += 1
+
+    def _refresh(self, entry, headers):
+        # headers of the 304 update the stored ones, see RFC 7234 section 4.3.4
+        updated = dict((name.lower(), (name, value)) for name, value in headers.items()
+                       if name.lower() not in SKIPPED_HEADERS)
+        fields = [field for field in entry.fields if field[0].lower() not in updated] + list(updated.values())
+        entry = CacheEntry(entry.url, entry.status, fields, entry.body, self._clock(), self._initial_age(headers))
+        yield from self._save(entry)
+        return entry
+
+    def _save(self, entry):
+        yield from self.load()
+        fp = fingerprint(entry.url)
+        data = entry.dumps()
+        try:
+            yield from self._loop.run_in_executor(self._loop.file_executor, _write_entry, self._path(fp), data)
+        except OSError as e:
+            self.logger.error("failed to store %s : %s" % (entry.url, e))
+            return
+        self._forget(fp)
+        self._index[fp] = len(data)
+        self.size += len(data)
+        yield from self._evict()
+
+    def hit_rate(self):
+        hits = self.stats["fresh"] + self.stats["revalidated"]
+        total = hits + self.stats["miss"]
+        return hits / total if total > 0 else 0.
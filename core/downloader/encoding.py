@@ -0,0 +1,142 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Negotiated content codings of the downloader : requests advertise the codings we can decode, and responses are
+# decompressed incrementally, piece by piece, as they are framed by the parser (see core/downloader/http_parser.py).
+#
+# brotli is optional, it is only offered when the module is installed.
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class DecodingError(Exception):pass
+
+
+class GzipDecoder:
+    """
+    Streaming gzip decoder, concatenated members are supported
+    """
+
+    def __init__(self):
+        self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        ret = self._obj.decompress(data)
+        while self._obj.eof and self._obj.unused_data:
+            unused = self._obj.unused_data
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            ret += self._obj.decompress(unused)
+        return ret
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class DeflateDecoder:
+    """
+    Streaming deflate decoder : zlib wrapped data as the RFC says, raw deflate as some servers send
+    """
+
+    def __init__(self):
+        self._obj = zlib.decompressobj(zlib.MAX_WBITS)
+        self._first = b""
+        self._decided = False
+
+    def decompress(self, data):
+        if self._decided:
+            return self._obj.decompress(data)
+        # a wrong zlib header is reported within the first bytes, they are replayed to a raw decoder then
+        self._first += data
+        try:
+            ret = self._obj.decompress(data)
+        except zlib.error:
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            self._decided = True
+            return self._obj.decompress(self._first)
+        if ret:
+            self._decided = True
+            self._first = b""
+        return ret
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class BrotliDecoder:
+    """
+    Streaming brotli decoder, a corrupt stream raises DecodingError
+    """
+
+    def __init__(self):
+        self._obj = brotli.Decompressor()
+
+    def decompress(self, data):
+        try:
+            return self._obj.process(bytes(data))
+        except brotli.error as e:
+            raise DecodingError("corrupt brotli stream : %s" % e)
+
+    def flush(self):
+        return b""
+
+
+DECODERS = {"gzip": GzipDecoder, "x-gzip": GzipDecoder, "deflate": DeflateDecoder}
+if brotli is not None:
+    DECODERS["br"] = BrotliDecoder
+
+
+def accept_encoding():
+    """
+    :return: str, value of the Accept-Encoding header
+    """
+    return ", ".join(["gzip", "deflate"] + (["br"] if brotli is not None else []))
+
+
+def make_decoder(content_encoding):
+    """
+    :param content_encoding: str, value of the Content-Encoding header
+    :return: decoder providing decompress(data) and flush(), None for identity, raises DecodingError for codings we
+    cannot decode
+    """
+    codings = [c.strip().lower() for c in (content_encoding or "").split(",") if c.strip()]
+    codings = [c for c in codings if c != "identity"]
+    if not codings:
+        return None
+    if len(codings) > 1:
+        raise DecodingError("stacked content codings %s are not supported" % content_encoding)
+    factory = DECODERS.get(codings[0])
+    if factory is None:
+        raise DecodingError("content coding %s is not supported" % codings[0])
+    return factory()
+
+
+class TransferStats:
+    """
+    Bytes of payload received on the wire vs after decoding, over every response of the process
+
+    Key members :
+      record(wire, decoded) : account a response
+      savings() : ratio of bandwidth saved by compression
+    """
+
+    def __init__(self):
+        self.wire = 0
+        self.decoded = 0
+        self.responses = 0
+
+    def record(self, wire, decoded):
+        self.wire += wire
+        self.decoded += decoded
+        self.responses += 1
+
+    def savings(self):
+        return 1. - self.wire / self.decoded if self.decoded > 0 else 0.
+
+
+stats = TransferStats()
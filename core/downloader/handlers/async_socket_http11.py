@@ -5,12 +5,25 @@
 #     1. fea(async_urlopen): add support to websites with Protocol HTTPS, [M2] refactored to baidu CodeMaster competition
 #  Updated on Feb 20, 2021
 #     1. optimize(aysnc_urlopen): optimize reading speed for SSL non-blocking socket
+#  Updated on Oct 18, 2026
+#     1. optimize(async_urlopen): TCP connect and TLS handshake are driven by the selector, no blocking call is left
+#     2. fea(async_urlopen): keep-alive connections are reused through a per host pool, see core/downloader/pool.py
+#     3. optimize(Response): responses are parsed incrementally, see core/downloader/http_parser.py
+#     4. optimize(Response): sockets are read with recv_into pooled buffers, see core/downloader/buffers.py
+#     5. fea(async_download): media are streamed to disk and renamed once complete, see core/downloader/media.py
+#     6. optimize(Request): gzip/deflate (br when available) are negotiated and decoded on the fly
+#     7. fea(async_urlopen): https hosts negotiating h2 with ALPN are multiplexed, see async_socket_http2.py
+#     8. fea(async_urlopen): responses are cached on disk and revalidated, see core/downloader/cache.py
+#     9. fea(async_download): large files are fetched by concurrent byte ranges and resumed, see core/downloader/segmented.py
+#    10. fea(async_urlopen): connect, first byte and total deadlines are enforced per request with loop timers
 # reference:
 #     1. https://stackoverflow.com/questions/28508374/ssl-connect-for-non-blocking-socket
 #     2. https://github.com/darrenjs/openssl_examples
 #     3. #
 
 import os
+import heapq
+from collections import deque
 import logging
 _logger = logging.getLogger("downloader/handlers/async_socket_http11")
 import utils.Log as Log
@@ -29,13 +42,7 @@ except:
     from urlparse import urlparse, urlencode, quote_plus
 import http
 
-try:
-    from asyncio import JoinableQueue as Queue
-except ImportError:
-    # py35+
-    from asyncio import Queue
-
-import ctypes as ct
+import concurrent.futures
 
 # multiplexing through python interface
 from asyncio import AbstractEventLoop
@@ -46,6 +53,14 @@ from PIL import Image
 import io
 
 from config import settings
+from core.downloader.resolver import Resolver
+from core.downloader.pool import ConnectionPool
+from core.downloader.http_parser import ResponseParser, HTTPParseError
+from core.downloader.buffers import BufferPool
+from core.downloader.media import MediaWriter, DownloadError, is_image_path
+from core.downloader.cache import HTTPCache
+from core.downloader import tls
+from core.downloader import encoding
 
 
 # Used inside Response I/O event once async_urlopen builds a connection successfully, yiakwy
@@ -81,11 +96,56 @@ class Handle:
         """
         self._cb = cb
         self._args = args
-        self.logger = Log.LogAdapter(_logger, "Handle <%s>" % cb.__name__)
+
+    @property
+    def logger(self):
+        # created on demand, handles are allocated for every task switch
+        return Log.LogAdapter(_logger, "Handle <%s>" % getattr(self._cb, "__name__", repr(self._cb)))
 
     def _run(self, fut):
         try:
             self._cb(fut, *self._args)
+        except (StopEventLoop, StopImediately):
+            raise
+        except Exception as e:
+            import traceback; traceback.print_exc()
+            self.logger.info(e)
+            raise(e)
+
+
+class TimerHandle(Handle):
+    """
+    Scheduled callback wrapper, ordered by its deadline inside the event loop timer heap
+
+    Key members :
+      when : float, absolute deadline in the loop clock (see SimpleEventLoop.time)
+      cancel() : mark the callback as cancelled, the loop will drop it once it is popped
+    """
+
+    def __init__(self, when, cb, *args):
+        """
+        :param when: float, absolute deadline in the loop clock, None means "as soon as possible"
+        :param cb: Func, callback function
+        :param args: List<Object>, list of arguments to the passed callback function
+        """
+        super().__init__(cb, *args)
+        self.when = when
+        self._cancelled = False
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+    def cancel(self):
+        self._cancelled = True
+
+    def cancelled(self):
+        return self._cancelled
+
+    def _run(self, fut=None):
+        try:
+            self._cb(*self._args)
+        except (StopEventLoop, StopImediately):
+            raise
         except Exception as e:
             import traceback; traceback.print_exc()
             self.logger.info(e)
@@ -107,7 +167,9 @@ class Future:
       add_done_callback (handle), add a callback wrapper
       remove_done_callback (handle), remove a callback wrapper
 
-      set_ret(ret), store the result retrieved after a callback and execute all callbacks wrapper immediately
+      set_ret(ret), store the result retrieved after a callback and schedule all callbacks wrapper on the loop ready
+      queue (or execute them immediately when the future is not bound to a loop)
+      set_exception(exception), same as set_ret, the exception is raised from `yield from fut`
       _execute_callbacks : execute callbacks and clear remained tasks.
     """
     
@@ -116,17 +178,27 @@ class Future:
         :param loop: A async events dispatching query loop
         """
         self._ret = None
+        self._exception = None
+        self._done = False
         self._callbacks = []
         self._loop = loop
  
     def __iter__(self):
         yield self
+        if self._exception is not None:
+            raise self._exception
         return self._ret
 
     def cancel(self):
         return True
 
+    def done(self):
+        return self._done
+
     def add_done_callback(self, handle):
+        if self._done and self._loop is not None:
+            self._loop.call_soon(handle._run, self)
+            return
         self._callbacks.append(handle)
 
     def remove_done_callback(self, handle):
@@ -135,11 +207,25 @@ class Future:
 
     def set_ret(self, ret):
         self._ret = ret
+        self._done = True
+        self._execute_callbacks()
+
+    def set_exception(self, exception):
+        """
+        :param exception: Exception, raised inside the coroutine waiting on the future
+        """
+        self._exception = exception
+        self._done = True
         self._execute_callbacks()
 
     def _execute_callbacks(self):
         callbacks = self._callbacks[:]
         self._callbacks[:] = []
+        if self._loop is not None:
+            # defer to the loop ready queue, so that resolving a future never recurses into other tasks
+            for h in callbacks:
+                self._loop.call_soon(h._run, self)
+            return
         for h in callbacks:
             h._run(self)
 
@@ -159,15 +245,24 @@ class Task(Future):
 
         _step(fut : Future) : when the task is ready (fetched by event loop and set callback result to itself), try to
         drive it to run continuously by issuing "send" -- a special jump to and from a address in user space stacks.
+
+    When a loop is given, the first step is scheduled with loop.call_soon instead of being executed in the constructor.
     """
 
     def __init__(self, coro, *, loop=None):
         super().__init__(loop=loop)
         self._coro = coro
-        self._step(self)
+        if loop is not None:
+            loop.call_soon(self._step, self)
+        else:
+            self._step(self)
 
     def cancel(self):
-        self._coro.throw(Cancel())
+        try:
+            self._coro.throw(Cancel())
+        except (Cancel, StopIteration):
+            pass
+        self._cancelled = True
 
     def _step(self, fut):
         """
@@ -202,10 +297,46 @@ class Task(Future):
         next_fut.add_done_callback(h)
 
 
+class FdRegistration:
+    """
+    Persistent interest of a file descriptor inside SimpleEventLoop
+
+    The descriptor is registered once to the selector and stays registered for the life of the connection. Switching
+    between reading and writing only issues `selector.modify`, and only when the kernel interest mask really changes.
+    Removing a reader is lazy : the READ interest is kept armed so that the next read of a streaming body costs no
+    syscall at all, it is only dropped when the kernel reports readiness nobody is waiting for.
+
+    Key members :
+      fd : int, file descriptor
+      mask : int, interest mask known by the kernel, 0 means not registered
+      reader, writer : Func, callbacks executed when the descriptor is readable / writable
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.mask = 0
+        self.reader = None
+        self.writer = None
+
+
 class StopEventLoop(Exception):pass
 class StopImediately(Exception):pass
 
 
+def create_executor(kind="thread", max_workers=None):
+    """
+    :param kind: str, "thread" or "process", thread pools suit lxml and PIL which release the GIL for most of their work,
+    process pools suit pure python parsing
+    :param max_workers: int, pool size
+    :return: concurrent.futures.Executor
+    """
+    if kind == "process":
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    elif kind == "thread":
+        return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    raise ValueError("executor type %s is not supported" % kind)
+
+
 # https://github.com/python/cpython/blob/a6fba9b827e395fc9583c07bc2d15cd11f684439/Lib/asyncio/base_events.py#L232
 class SimpleEventLoop(AbstractEventLoop):
     """
@@ -218,17 +349,271 @@ class SimpleEventLoop(AbstractEventLoop):
 
         _process_evts(ready_evts : List[Tuple[SelectorKey, _EventMask]]), called when I/O is ready by kernel
 
+        call_soon(cb, *args), call_later(delay, cb, *args), call_at(when, cb, *args) : schedule callbacks on the loop
+        instead of blocking the thread, deadlines are kept in a binary heap and _run_once derives the select timeout
+        from the nearest one
+
+        sleep(delay) : a yieldable future resolved by the timer heap, use it instead of time.sleep inside coroutines
+
+        add_reader(fd, cb), remove_reader(fd), add_writer(fd, cb), remove_writer(fd), remove_fd(fd) : maintain a
+        persistent interest table (see FdRegistration), remove_fd must be called before the descriptor is closed
+
+        selector_stats : Map<str, int>, counters of selector syscalls issued by the loop
+
+        run_in_executor(executor, func, *args) : run CPU bound work on a thread or process pool, completion is signaled
+        back through a self-pipe watched by the selector, usage : `ret = yield from loop.run_in_executor(None, f, x)`
+
+        getaddrinfo(host, port) : non-blocking, cached DNS resolution, see core/downloader/resolver.py
+
+        connection_pool : ConnectionPool, keep-alive sockets of the loop, see core/downloader/pool.py
+
+        buffer_pool : BufferPool, receive buffers recycled by every response read on the loop, see core/downloader/buffers.py
+
     """
 
     def __init__(self):
         self._stopped = False 
         self._stopping = False
         self._selector = DefaultSelector()
+        self.timeout = None
+        # callbacks ready to run in the next iteration and timers ordered by deadline
+        self._ready = deque()
+        self._scheduled = []
+        # fairness limit : maximum of ready callbacks executed before the selector is polled again
+        self.max_ready_per_iteration = settings.MAX_READY_PER_ITERATION
+        # fd -> FdRegistration
+        self._fds = {}
+        self.selector_stats = {"select": 0, "register": 0, "modify": 0, "unregister": 0}
+        # executor offloading, the self-pipe is created on first use
+        self._default_executor = None
+        self._self_pipe = None
+        self._completed = deque()
+        self._resolver = None
+        self._connection_pool = None
+        self._buffer_pool = None
+        self._file_executor = None
+        self._http_cache = None
         self.logger = Log.LogAdapter(_logger, "SimpleEventLoop")
 
+    def time(self):
+        return time.monotonic()
+
+    def call_soon(self, cb, *args, context=None):
+        """
+        :param cb: Func, callback function
+        :param args: List<Object>, list of arguments to the passed callback function
+        :param context: not used, kept for compatibility with asyncio.Future
+        :return: TimerHandle
+        """
+        handle = TimerHandle(None, cb, *args)
+        self._ready.append(handle)
+        return handle
+
+    def call_at(self, when, cb, *args, context=None):
+        """
+        :param when: float, absolute deadline in the loop clock
+        :param cb: Func, callback function
+        :param args: List<Object>, list of arguments to the passed callback function
+        :return: TimerHandle
+        """
+        handle = TimerHandle(when, cb, *args)
+        heapq.heappush(self._scheduled, handle)
+        return handle
+
+    def call_later(self, delay, cb, *args, context=None):
+        """
+        :param delay: float, seconds to wait before the callback is executed
+        :param cb: Func, callback function
+        :param args: List<Object>, list of arguments to the passed callback function
+        :return: TimerHandle
+        """
+        return self.call_at(self.time() + delay, cb, *args)
+
+    def sleep(self, delay, result=None):
+        """
+        :param delay: float, seconds to suspend the calling coroutine
+        :param result: Object, value returned to the coroutine once waken up
+        :return: Future, usage : `yield from loop.sleep(1e-3)`
+        """
+        fut = Future(loop=self)
+        self.call_later(delay, fut.set_ret, result)
+        return fut
+
     def isStopping(self):
         return self._stopping
 
+    def _update_interest(self, reg, mask):
+        """
+        :param reg: FdRegistration
+        :param mask: int, the new interest mask, 0 unregisters the descriptor
+        :return: None
+        """
+        if mask == reg.mask:
+            return
+        if mask == 0:
+            self._selector.unregister(reg.fd)
+            self.selector_stats["unregister"] += 1
+        elif reg.mask == 0:
+            self._selector.register(reg.fd, mask, reg)
+            self.selector_stats["register"] += 1
+        else:
+            self._selector.modify(reg.fd, mask, reg)
+            self.selector_stats["modify"] += 1
+        reg.mask = mask
+
+    def _get_registration(self, fd):
+        reg = self._fds.get(fd)
+        if reg is None:
+            reg = FdRegistration(fd)
+            self._fds[fd] = reg
+        return reg
+
+    def add_reader(self, fd, cb):
+        """
+        :param fd: int, file descriptor
+        :param cb: Func, callback executed without arguments when the descriptor is readable
+        """
+        reg = self._get_registration(fd)
+        reg.reader = cb
+        self._update_interest(reg, reg.mask | EVENT_READ)
+
+    def remove_reader(self, fd):
+        reg = self._fds.get(fd)
+        if reg is not None:
+            # lazy, the READ interest stays armed for the next read
+            reg.reader = None
+
+    def add_writer(self, fd, cb):
+        """
+        :param fd: int, file descriptor
+        :param cb: Func, callback executed without arguments when the descriptor is writable
+        """
+        reg = self._get_registration(fd)
+        reg.writer = cb
+        self._update_interest(reg, reg.mask | EVENT_WRITE)
+
+    def remove_writer(self, fd):
+        reg = self._fds.get(fd)
+        if reg is not None:
+            reg.writer = None
+            # a writable socket is almost always ready, hence WRITE interest is dropped eagerly. The descriptor is
+            # parked on READ, which is what a HTTP client waits for next.
+            self._update_interest(reg, (reg.mask & ~EVENT_WRITE) or EVENT_READ)
+
+    def remove_fd(self, fd):
+        """
+        Unregister the descriptor from the selector, called once when the connection is closed
+
+        :param fd: int, file descriptor
+        """
+        reg = self._fds.pop(fd, None)
+        if reg is not None:
+            reg.reader = None
+            reg.writer = None
+            self._update_interest(reg, 0)
+
+    def create_task(self, coro):
+        return Task(coro, loop=self)
+
+    @property
+    def resolver(self):
+        if self._resolver is None:
+            self._resolver = Resolver(self, ttl=settings.DNS_TTL, negative_ttl=settings.DNS_NEGATIVE_TTL,
+                                      max_workers=settings.DNS_WORKERS, max_size=settings.DNS_CACHE_SIZE)
+        return self._resolver
+
+    @property
+    def connection_pool(self):
+        if self._connection_pool is None:
+            self._connection_pool = ConnectionPool(self, max_idle=settings.POOL_MAX_IDLE,
+                                                   max_per_host=settings.POOL_MAX_PER_HOST,
+                                                   idle_timeout=settings.POOL_IDLE_TIMEOUT)
+        return self._connection_pool
+
+    @property
+    def buffer_pool(self):
+        if self._buffer_pool is None:
+            self._buffer_pool = BufferPool(buf_size=settings.READ_BUFFER_SIZE, max_free=settings.READ_BUFFER_POOL_SIZE)
+        return self._buffer_pool
+
+    @property
+    def default_executor(self):
+        # executor of run_in_executor(None, ...), a process pool when settings.EXECUTOR_TYPE is "process"
+        if self._default_executor is None:
+            self._default_executor = create_executor(settings.EXECUTOR_TYPE, settings.EXECUTOR_WORKERS)
+        return self._default_executor
+
+    @property
+    def file_executor(self):
+        # threads writing downloaded files, kept apart from the default executor which may be a process pool
+        if self._file_executor is None:
+            self._file_executor = create_executor("thread", max_workers=settings.FILE_IO_WORKERS)
+        return self._file_executor
+
+    @property
+    def http_cache(self):
+        if self._http_cache is None:
+            self._http_cache = HTTPCache(settings.HTTP_CACHE_DIR, self, max_size=settings.HTTP_CACHE_MAX_SIZE)
+        return self._http_cache
+
+    def getaddrinfo(self, host, port, family=0, type=socket.SOCK_STREAM):
+        """
+        :return: List<Tuple>, see socket.getaddrinfo, usage : `infos = yield from loop.getaddrinfo(host, 80)`
+        """
+        return self.resolver.getaddrinfo(host, port, family=family, type=type)
+
+    def set_default_executor(self, executor):
+        self._default_executor = executor
+
+    def _make_self_pipe(self):
+        rsock, wsock = socket.socketpair()
+        rsock.setblocking(False)
+        wsock.setblocking(False)
+        self._self_pipe = (rsock, wsock)
+        self.add_reader(rsock.fileno(), self._read_from_self)
+
+    def _read_from_self(self):
+        rsock = self._self_pipe[0]
+        try:
+            while rsock.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self._completed:
+            fut, cf = self._completed.popleft()
+            if fut.done():
+                continue
+            exception = cf.exception()
+            if exception is not None:
+                fut.set_exception(exception)
+            else:
+                fut.set_ret(cf.result())
+
+    def _on_executor_done(self, fut, cf):
+        # executed in a worker thread (or the result handler thread of a process pool)
+        self._completed.append((fut, cf))
+        try:
+            self._self_pipe[1].send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            # the pipe is full, hence the loop is already going to wake up
+            pass
+
+    def run_in_executor(self, executor, func, *args):
+        """
+        :param executor: concurrent.futures.Executor, None to use the default executor (see create_executor)
+        :param func: Func, must be picklable (module level) for a process pool
+        :param args: List<Object>, arguments to the passed function
+        :return: Future
+        """
+        if executor is None:
+            executor = self.default_executor
+        if self._self_pipe is None:
+            self._make_self_pipe()
+        fut = Future(loop=self)
+        cf = executor.submit(func, *args)
+        cf.add_done_callback(lambda cf: self._on_executor_done(fut, cf))
+        return fut
+
     def set_timeout(self, timeout):
         self.timeout = timeout
 
@@ -251,6 +636,7 @@ class SimpleEventLoop(AbstractEventLoop):
             raise(e)
         finally:
             self.logger.info("The event loop die.")
+            self.logger.info("selector syscalls : %s" % self.selector_stats)
             task.remove_done_callback(h)
 
     def run_forever(self):
@@ -258,8 +644,35 @@ class SimpleEventLoop(AbstractEventLoop):
             self._run_once()
 
     def _run_once(self):
-        ready_evts = self._selector.select(self.timeout)
+        timeout = self.timeout
+        if self._ready:
+            timeout = 0
+        elif self._scheduled:
+            # drop cancelled timers sitting on the top of the heap
+            while self._scheduled and self._scheduled[0].cancelled():
+                heapq.heappop(self._scheduled)
+            if self._scheduled:
+                nearest = max(0, self._scheduled[0].when - self.time())
+                timeout = nearest if timeout is None else min(timeout, nearest)
+
+        ready_evts = self._selector.select(timeout)
+        self.selector_stats["select"] += 1
         self._process_evts(ready_evts)
+
+        now = self.time()
+        while self._scheduled and self._scheduled[0].when <= now:
+            handle = heapq.heappop(self._scheduled)
+            if not handle.cancelled():
+                self._ready.append(handle)
+
+        # only run callbacks scheduled before this iteration, callbacks added meanwhile wait for the next round
+        ntodo = len(self._ready)
+        if self.max_ready_per_iteration:
+            ntodo = min(ntodo, self.max_ready_per_iteration)
+        for _ in range(ntodo):
+            handle = self._ready.popleft()
+            if not handle.cancelled():
+                handle._run()
     
     def _process_evts(self, ready_evts):
         """
@@ -267,18 +680,42 @@ class SimpleEventLoop(AbstractEventLoop):
         :return:
         """
         for key, mask in ready_evts:
-            (reader, writer) = key.data
-            if mask & selectors.EVENT_READ and reader is not None:
-                reader()
-            if mask & selectors.EVENT_WRITE and writer is not None:
-                writer()
+            reg = key.data
+            if self._fds.get(reg.fd) is not reg:
+                # removed by a callback executed earlier in this iteration
+                continue
+            if mask & selectors.EVENT_READ:
+                if reg.reader is not None:
+                    reg.reader()
+                else:
+                    # nobody waits for the data, stop polling it until a reader is added again
+                    self._update_interest(reg, reg.mask & ~EVENT_READ)
+            if mask & selectors.EVENT_WRITE and reg.writer is not None:
+                reg.writer()
     
     # used by standard asyncio.Queue
     def create_future(self):
         return Future(loop=self)
 
     def close(self):
-        pass
+        if self._stopped:
+            return
+        self._stopped = True
+        if self._connection_pool is not None:
+            self._connection_pool.close()
+        if self._default_executor is not None:
+            self._default_executor.shutdown(wait=False)
+            self._default_executor = None
+        if self._file_executor is not None:
+            self._file_executor.shutdown(wait=True)
+            self._file_executor = None
+        if self._resolver is not None:
+            self._resolver.close()
+        if self._self_pipe is not None:
+            self.remove_fd(self._self_pipe[0].fileno())
+            for sock in self._self_pipe:
+                sock.close()
+            self._self_pipe = None
 
     def is_closed(self):
         return self._stopped 
@@ -288,6 +725,268 @@ class SimpleEventLoop(AbstractEventLoop):
             self.close()
 
 
+class QueueFull(Exception):pass
+class QueueEmpty(Exception):pass
+
+
+# reference to
+# https://github.com/python/cpython/blob/a6fba9b827e395fc9583c07bc2d15cd11f684439/Lib/asyncio/queues.py
+class Queue:
+    """
+    A FIFO jobs queue whose waiters are Futures of SimpleEventLoop.
+
+    asyncio.Queue parks its getters on asyncio futures, which are only resolved by an asyncio event loop, hence an empty
+    queue used to freeze our loop. The interface is kept the same so that spiders do not need to change.
+
+    Key members :
+      put_nowait(item), put(item) : enqueue an item, `put` is a coroutine waiting for room when the queue is full
+      get_nowait(), get() : dequeue an item, `get` is a coroutine waiting for an item when the queue is empty
+      task_done(item) : mark an item fetched with get as processed, item is only used by schedulers, see
+      core/spiders/scheduler.py
+      join() : a coroutine waiting until every item put has been processed
+      is_idle() : no item is waiting or being processed
+    """
+
+    def __init__(self, maxsize=0, *, loop=None):
+        """
+        :param maxsize: int, maximum of items in the queue, 0 means no limit
+        :param loop: SimpleEventLoop
+        """
+        self._maxsize = maxsize
+        self._loop = loop
+        self._queue = deque()
+        self._getters = deque()
+        self._putters = deque()
+        self._joiners = []
+        self._unfinished_tasks = 0
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def qsize(self):
+        return len(self._queue)
+
+    def empty(self):
+        return not self._queue
+
+    def full(self):
+        return 0 < self._maxsize <= len(self._queue)
+
+    def is_idle(self):
+        return self._unfinished_tasks == 0
+
+    def _wakeup_next(self, waiters):
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_ret(None)
+                break
+
+    def put_nowait(self, item):
+        if self.full():
+            raise QueueFull()
+        self._queue.append(item)
+        self._unfinished_tasks += 1
+        self._wakeup_next(self._getters)
+
+    def put(self, item):
+        while self.full():
+            putter = Future(loop=self._loop)
+            self._putters.append(putter)
+            yield from putter
+        self.put_nowait(item)
+
+    def get_nowait(self):
+        if self.empty():
+            raise QueueEmpty()
+        item = self._queue.popleft()
+        self._wakeup_next(self._putters)
+        return item
+
+    def get(self):
+        while self.empty():
+            getter = Future(loop=self._loop)
+            self._getters.append(getter)
+            yield from getter
+        return self.get_nowait()
+
+    def task_done(self, item=None):
+        if self._unfinished_tasks <= 0:
+            raise ValueError('task_done() called too many times')
+        self._unfinished_tasks -= 1
+        if self._unfinished_tasks == 0:
+            joiners, self._joiners = self._joiners, []
+            for joiner in joiners:
+                joiner.set_ret(None)
+
+    def join(self):
+        if self._unfinished_tasks > 0:
+            joiner = Future(loop=self._loop)
+            self._joiners.append(joiner)
+            yield from joiner
+
+
+def wait_readable(sock, loop):
+    """
+    :param sock: Sock or SSLContext.SSLSocket, non-blocking network device file descriptor
+    :param loop: SimpleEventLoop
+    :return: None, usage : `yield from wait_readable(sock, loop)`
+    """
+    fut = Future(loop=loop)
+    fd = sock.fileno()
+
+    def onReadable():
+        if not fut.done():
+            fut.set_ret(None)
+
+    loop.add_reader(fd, onReadable)
+    yield from fut
+    loop.remove_reader(fd)
+
+
+def wait_writable(sock, loop):
+    """
+    :param sock: Sock or SSLContext.SSLSocket, non-blocking network device file descriptor
+    :param loop: SimpleEventLoop
+    :return: None, usage : `yield from wait_writable(sock, loop)`
+    """
+    fut = Future(loop=loop)
+    fd = sock.fileno()
+
+    def onWritable():
+        if not fut.done():
+            fut.set_ret(None)
+
+    loop.add_writer(fd, onWritable)
+    yield from fut
+    loop.remove_writer(fd)
+
+
+def do_handshake(sock, loop):
+    """
+    Drive a TLS handshake of a non-blocking SSLSocket with the selector, many handshakes overlap on the loop
+
+    :param sock: SSLContext.SSLSocket, wrapped with do_handshake_on_connect=False
+    :param loop: SimpleEventLoop
+    :return: None
+    """
+    while True:
+        try:
+            sock.do_handshake()
+            return
+        except ssl.SSLWantReadError:
+            yield from wait_readable(sock, loop)
+        except ssl.SSLWantWriteError:
+            yield from wait_writable(sock, loop)
+
+
+def wait_for(coro, timeout, loop, message=None):
+    """
+    Drive a coroutine under a deadline : once it passes, TimeoutError is thrown into the coroutine where it waits, the
+    future it was waiting on is left alone since it may be shared (e.g. a probe of the connection pool), every later
+    wait of the coroutine fails as well
+
+    :param coro: generator or Future, the coroutine
+    :param timeout: Number, seconds, None means no deadline, <= 0 means already expired
+    :param loop: SimpleEventLoop
+    :param message: str, message of the TimeoutError
+    :return: Object, result of the coroutine, usage : `ret = yield from wait_for(coro, 10, loop)`
+    """
+    if timeout is None:
+        return (yield from coro)
+    coro = iter(coro)
+    state = {"expired": False, "waiter": None}
+
+    def on_timeout():
+        state["expired"] = True
+        waiter = state["waiter"]
+        if waiter is not None and not waiter.done():
+            waiter.set_ret(None)
+
+    def on_done(fut, waiter):
+        if not waiter.done():
+            waiter.set_ret(None)
+
+    timer = loop.call_later(max(0, timeout), on_timeout)
+    to_send, to_throw = None, None
+    try:
+        while True:
+            try:
+                if to_throw is not None:
+                    exc, to_throw = to_throw, None
+                    fut = coro.throw(exc)
+                else:
+                    fut = coro.send(to_send)
+            except StopIteration as e:
+                return e.value
+            to_send = None
+            if not isinstance(fut, Future):
+                to_send = yield fut
+                continue
+            if not state["expired"] and not fut.done():
+                # the coroutine resumes when either its future or the deadline is done
+                waiter = state["waiter"] = Future(loop=loop)
+                fut.add_done_callback(Handle(on_done, waiter))
+                try:
+                    yield from waiter
+                except BaseException as e:
+                    # e.g. Cancel thrown by Task.cancel
+                    to_throw = e
+                    continue
+                finally:
+                    state["waiter"] = None
+            if state["expired"] and not fut.done():
+                to_throw = TimeoutError(message or "timed out after %ss" % timeout)
+    finally:
+        timer.cancel()
+
+
+def recv_into(sock, buf, size):
+    """
+    :param sock: Sock or SSLContext.SSLSocket, non-blocking network device file descriptor
+    :param buf: bytearray, receive buffer
+    :param size: int, maximum of bytes to read
+    :return: int, number of bytes read, 0 once the remote closed the connection, or PROC_IN_PROGRESS when the kernel
+    (or the TLS layer) has nothing buffered yet
+    """
+    view = memoryview(buf)
+
+    if hasattr(sock, "_sslobj"):
+        # ssl recv will raise an exception for streaming socket, yiakwy Dec 26, 2020, also discussion with Giampaolo Rodola https://bugs.python.org/issue3890
+        # records already decrypted by the TLS layer do not wake the selector up, hence drain them
+        filled = 0
+        try:
+            while filled < size:
+                readed = sock.recv_into(view[filled:size])
+                if readed == 0:
+                    # EOF, reported by the next call
+                    break
+                filled += readed
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            # WantWrite happens on renegotiation, the socket is writable again by the time we poll it
+            if filled == 0:
+                return PROC_IN_PROGRESS
+        return filled
+
+    try:
+        return sock.recv_into(view, size)
+    except (BlockingIOError, InterruptedError):
+        return PROC_IN_PROGRESS
+
+
+def send_nowait(sock, data):
+    """
+    :param sock: Sock or SSLContext.SSLSocket, non-blocking network device file descriptor
+    :param data: memoryview, bytes remained to send
+    :return: int, number of bytes accepted by the kernel
+    """
+    try:
+        return sock.send(data)
+    except (BlockingIOError, InterruptedError, ssl.SSLWantWriteError, ssl.SSLWantReadError):
+        return 0
+
+
 class Request:
     """
     A simple HTTP Request with customer socket.
@@ -300,7 +999,7 @@ class Request:
 
     Key Members:
 
-        send(sock, is_secured=False) : send messages to remote
+        send(sock, is_secured=False, loop=None) : send messages to remote, a coroutine returning the Response
     """
 
     def __init__(self, method, url, 
@@ -308,27 +1007,52 @@ class Request:
         self.url = url 
         self.parsed_url = parsed_url or urlparse(url)
         self.method = method
+        self.headers = headers or {}
         self._cert = None
 
-    def send(self, sock, is_secured=False):
+    def send(self, sock, is_secured=False, loop=None):
         """
         :param sock: Sock or SSLContext.SSLSocket, network device file descriptor
         :param is_secured: is message encrypted
-        :return: Response
+        :param loop: SimpleEventLoop
+        :return: Response, usage : `response = yield from req.send(sock, loop=loop)`
         """
-        _req_msg = ""
-        if not is_secured:
-            _req_msg = '{} {} HTTP/1.0\r\nHost: {}\r\nConnection: keep-alive\r\n\r\n'.format(self.method, self.url,
-                                                                                             self.parsed_url.hostname)
-        else:
-            if self._cert is None:
-                self._cert = sock.getpeercert()
-                logging.info("Verified Certificate:\n%s" % self._cert)
-            _req_msg = '{} {} HTTP/1.1\r\nHost: {}\r\nConnection: keep-alive\r\n\r\n'.format(self.method,
-                                                                                             self.parsed_url.path or "/",
-                                                                                             self.parsed_url.hostname)
-        sock.send(_req_msg.encode("utf-8"))
-        return Response(self.method, self.url, sock)
+        if is_secured and self._cert is None:
+            self._cert = sock.getpeercert()
+            logging.info("Verified Certificate:\n%s" % self._cert)
+        # HTTP/1.1 in origin form for both schemes, the connection is kept alive unless the remote refuses
+        _req_msg = '{} {} HTTP/1.1\r\nHost: {}\r\nConnection: keep-alive\r\n'.format(self.method, self._target(),
+                                                                                   self._host())
+        if settings.HTTP_COMPRESSION and 'Accept-Encoding' not in self.headers:
+            # decoded incrementally by the response parser, see core/downloader/encoding.py
+            _req_msg += 'Accept-Encoding: {}\r\n'.format(encoding.accept_encoding())
+        for name, value in self.headers.items():
+            _req_msg += '{}: {}\r\n'.format(name, value)
+        _req_msg += '\r\n'
+        data = memoryview(_req_msg.encode("utf-8"))
+        if not settings.OPTIMISTIC_IO:
+            yield from wait_writable(sock, loop)
+        while len(data) > 0:
+            # try first, the socket buffer of a fresh connection almost always has room for the request
+            sent = self._send_nowait(sock, data)
+            data = data[sent:]
+            if len(data) > 0:
+                yield from wait_writable(sock, loop)
+        return Response(self.method, self.url, sock, loop=loop)
+
+    def _target(self):
+        target = self.parsed_url.path or "/"
+        if self.parsed_url.query:
+            target += "?" + self.parsed_url.query
+        return target
+
+    def _host(self):
+        if self.parsed_url.port:
+            return "%s:%d" % (self.parsed_url.hostname, self.parsed_url.port)
+        return self.parsed_url.hostname
+
+    def _send_nowait(self, sock, data):
+        return send_nowait(sock, data)
 
 
 class Response:
@@ -338,17 +1062,28 @@ class Response:
     Usually, HTTPResponse in python system library is handling blocked socket, since we are dealing with asynchronous events
     we have to manually process sockets telegraph.
 
-    The key idea is to reuse the parser from HTTPResponse to decode messages while keep a non-blocking socket in use.
+    The key idea is to feed an incremental parser (see core/downloader/http_parser.py) with every chunk read from the
+    non-blocking socket, so that the message is parsed once, whatever the number of reads.
 
     Key Members:
 
-        _read(chunk : Number, iter = 0 : Number) : read a chunk of data from kernel synchronously
-        _parse(res_txt : Bytes) : parse message from socket into HTTP response format
-
-        read(chunk : Number) : read a chunk of data asynchronously
+        _read(chunk : Number, iter = 0 : Number) : read a chunk of data from kernel with recv_into a pooled buffer, the
+        socket is tried before waiting on the selector when settings.OPTIMISTIC_IO is on, the chunk is fed to the parser
+        on the way
+
+        read_headers(chunk : Number) : read until the status line and the headers are parsed
+        read(chunk : Number) : read the whole message asynchronously, returns the decoded body
+        body_view() : memoryview of the decoded body
+        stream(writer : MediaWriter, chunk : Number) : hand the body over to a writer while it arrives
+        set_deadlines(first_byte, total, stall) : loop times by which the head and the whole message must be received,
+        seconds a streamed body may stall, the response is closed and TimeoutError raised once one passes
+        is_reusable() : the message is fully framed and the remote keeps the connection alive
+        release() : give the connection back to the pool once the response is fully framed, close it otherwise
         close() : close the network device file descriptor
     """
 
+    logger = Log.LogAdapter(_logger, "Response")
+
     def __init__(self, method, url, sock, loop=None):
         """
         :param method: HTTP method used, currently we only support 'GET'
@@ -360,9 +1095,22 @@ class Response:
         self.url = url
         self.sock = sock
         self._loop = loop 
-        # traditional response info, reference HTTPResponse 
-        self._response = None
-        self._chunked = None
+        self._optimistic_io = settings.OPTIMISTIC_IO
+        # status, headers and framing of the message, fed with every chunk read
+        self._parser = ResponseParser(method)
+        self._eof = False
+        # bytes past the end of the message were read and dropped, the position in the stream is lost
+        self._overread = False
+        # ConnectionPool and its key, set by async_urlopen
+        self._pool = None
+        self._pool_key = None
+        # HTTPCache storing the response once read, see core/downloader/cache.py
+        self._cache = None
+        # deadlines, see set_deadlines
+        self.first_byte_deadline = None
+        self.deadline = None
+        self.stall_timeout = None
+        self._closed = False
 
     def __iter__(self):
         yield self
@@ -370,211 +1118,463 @@ class Response:
     def set_loop(self, loop):
         self._loop = loop 
 
+    def _recv_nowait(self, buf_size):
+        """
+        Read into a pooled buffer and feed the parser with a view of it, no bytes object is created on the way
+
+        :param buf_size: int, maximum of bytes to read
+        :return: int, number of bytes read, 0 on EOF, or PROC_IN_PROGRESS
+        """
+        buffers = self._loop.buffer_pool
+        buf = buffers.acquire(buf_size)
+        try:
+            readed = recv_into(self.sock, buf, min(buf_size, len(buf)))
+            if readed == 0:
+                self._eof = True
+                self._parser.feed_eof()
+            elif readed != PROC_IN_PROGRESS:
+                if self._parser.complete or self._parser.feed(memoryview(buf)[:readed]) < readed:
+                    # e.g. a server sending more than its Content-Length
+                    self._overread = True
+            return readed
+        finally:
+            buffers.release(buf)
+
+    @property
+    def complete(self):
+        return self._parser.complete
+
+    def is_reusable(self):
+        """
+        :return: bool, the whole message has been read and the remote keeps the connection open
+        """
+        return self._parser.complete and self._parser.keep_alive and not self._eof and not self._overread
+
     def _read(self, buf_size, iter=0):
-        fut = Future()
+        """
+        :param buf_size: int, maximum of bytes to read
+        :return: int, number of bytes read and fed to the parser, 0 on EOF, or PROC_IN_PROGRESS
+        """
+        if self._optimistic_io:
+            # try first : most reads after the first one find data already buffered by the kernel
+            ret = self._recv_nowait(buf_size)
+            if ret != PROC_IN_PROGRESS:
+                return ret
+
+        fut = Future(loop=self._loop)
         fd = self.sock.fileno()
 
         @timmer
         def onReadable():
-            sock = self.sock
-            CHUNK = buf_size
+            if fut.done():
+                # the waiting task has not been scheduled yet
+                return
+            fut.set_ret(self._recv_nowait(buf_size))
 
-            if hasattr(sock, "_sslobj"):
-                # ssl recv will raise an exception for streaming socket, yiakwy Dec 26, 2020, also discussion with Giampaolo Rodola https://bugs.python.org/issue3890
-                buf = ct.create_string_buffer(CHUNK+1)
-                try:
-                    # readed = self.sock.read(CHUNK, buf)
-                    # ret = buf.value
-
-                    ret = b""
-                    while CHUNK > 0:
-                        readed = self.sock.recv(CHUNK)# self.sock.read(CHUNK, buf)
-                        if len(readed) == 0:#not readed:
-                            time.sleep(1e-6)
-                            raise EOFError
-                        ret += readed#buf.value
-                        CHUNK -= len(readed)#readed
-
-                    # if readed < CHUNK:
-                    #     logging.info("reading %d bytes at iteration %d" % (readed, iter))
-                except ssl.SSLWantReadError:
-                    if len(ret) == 0:
-                        ret = PROC_IN_PROGRESS
-                except EOFError:
-                    pass
-                except Exception as e:
-                    print(e.args[0])
-                    SystemExit(e)
-                fut.set_ret(ret)
-            else:
-                fut.set_ret(self.sock.recv(CHUNK))
-
-        self._loop._selector.register(fd, EVENT_READ, (onReadable, None))
+        self._loop.add_reader(fd, onReadable)
         chunk = yield from fut
-        self._loop._selector.unregister(fd)
+        self._loop.remove_reader(fd)
         return chunk 
 
+    def _read_until(self, done, CHUNK):
+        while not done() and not self._eof:
+            yield from self._read(CHUNK)
+
+    def set_deadlines(self, first_byte=None, total=None, stall=None):
+        """
+        :param first_byte: Number, loop time by which the status line and the headers must be received
+        :param total: Number, loop time by which the whole message must be received by read()
+        :param stall: Number, seconds a read of stream() may wait, streamed bodies are not bound by the total deadline
+        :return: None
+        """
+        self.first_byte_deadline = first_byte
+        self.deadline = total
+        self.stall_timeout = stall
+
+    def _guard(self, coro, when, what):
+        """
+        :param coro: generator, reading from the remote
+        :param when: Number, loop time of the deadline, None means no deadline
+        :param what: str, part of the message being read, for the error message
+        :return: Object, result of the coroutine, the response is closed once the deadline passed
+        """
+        if when is None:
+            return (yield from coro)
+        try:
+            return (yield from wait_for(coro, when - self._loop.time(), self._loop,
+                                        "timed out reading the %s of %s" % (what, self.url)))
+        except TimeoutError:
+            self.close()
+            raise
+
+    def _head_deadline(self):
+        deadlines = [when for when in (self.first_byte_deadline, self.deadline) if when is not None]
+        return min(deadlines) if deadlines else None
+
+    def read_headers(self, CHUNK=None):
+        """
+        :param CHUNK: int, maximum of bytes per read
+        :return: int, status code, usage : `status = yield from response.read_headers()`
+        """
+        if not self._parser.headers_complete:
+            yield from self._guard(self._read_headers(CHUNK), self._head_deadline(), "head")
+        if not self._parser.headers_complete:
+            raise HTTPParseError("connection closed before the response head of %s" % self.url)
+        return self._parser.status
+
+    def _read_headers(self, CHUNK):
+        yield from self._read_until(lambda: self._parser.headers_complete, CHUNK or self._loop.buffer_pool.buf_size)
+
     def read(self, CHUNK=None):
-        if self._chunked is not None and CHUNK is not None:
-            return self._chunked   
-        CHUNK = CHUNK or 8192
-        ret = b""
-        while True:
-            chunk = yield from self._read(CHUNK)
-            if chunk == PROC_IN_PROGRESS:
-                # continue to read
-                continue
-            if not chunk: # empty
-                time.sleep(1e-3)
-                continue#break
-            ret += chunk
-            if chunk.endswith(b'0\r\n\r\n'): # HTTP1.1 chunk end sign
-                # detach the connection
-                break
-            else:
-                print("read chunk size : %3.3f M" % (len(ret) / 1024))
-        self._chunked = ret
-        self._parse(ret)
-        return ret 
-
-    def recv(self, buf_size, media_type=None):
-        CHUNK = buf_size
-        CHUNK = CHUNK or 8192
-        ret = b""
-        target_size = -1
-        while True:
-            chunk = yield from self._read(CHUNK)
-            if chunk == PROC_IN_PROGRESS:
-                # continue to read
-                continue
-            if not chunk: # empty
-                time.sleep(1e-3)
-                continue#break
-            ret += chunk
-            if chunk.endswith(b'0\r\n\r\n') or len(chunk) < CHUNK: # HTTP1.1 chunk end sign, also see https://en.wikipedia.org/wiki/Chunked_transfer_encoding
-                # detach the connection
-                break
-            else:
-                print("read chunk size : %3.3f M" % (len(ret) / 1024))
-        return ret
+        """
+        :param CHUNK: int, maximum of bytes per read
+        :return: bytes, decoded body, usage : `body = yield from response.read()`
+        """
+        yield from self.read_headers(CHUNK)
+        # a message cut by the remote is returned as is, it will not be reused though
+        yield from self._guard(self._read_body(CHUNK), self.deadline, "body")
+        self._record_transfer()
+        if self._cache is not None:
+            yield from self._cache.store(self)
+        return self.body
+
+    def _read_body(self, CHUNK):
+        yield from self._read_until(lambda: self._parser.complete, CHUNK or self._loop.buffer_pool.buf_size)
+
+    def stream(self, writer, CHUNK=None):
+        """
+        Hand the body over to a writer piece by piece instead of accumulating it
+
+        :param writer: MediaWriter, or any object providing write(memoryview) and the drain() coroutine
+        :param CHUNK: int, maximum of bytes per read
+        :return: None, usage : `yield from response.stream(writer)`
+        """
+        yield from self.read_headers(CHUNK)
+        self._parser.set_on_body(writer.write)
+        CHUNK = CHUNK or self._loop.buffer_pool.buf_size
+        while not self._parser.complete and not self._eof:
+            yield from self._guard(self._read(CHUNK), self._stall_deadline(), "body")
+            # wait for the disk when too much is pending, the socket is not read meanwhile
+            yield from writer.drain()
+        self._record_transfer()
+
+    def _stall_deadline(self):
+        return self._loop.time() + self.stall_timeout if self.stall_timeout is not None else None
+
+    def _record_transfer(self):
+        parser = self._parser
+        encoding.stats.record(parser.body_size, parser.decoded_size)
+        if parser.body_size != parser.decoded_size:
+            self.logger.info("%s : %d bytes on the wire, %d decoded, bandwidth saved overall %.1f%%" % (
+                self.url, parser.body_size, parser.decoded_size, 100 * encoding.stats.savings()))
 
     def get_header(self, header):
-        return self._response.getheader(header)
+        return self._parser.headers.get(header)
 
     @property 
     def status(self):
-        return self._response.status 
+        return self._parser.status
     
     @property 
     def body(self):
-        return self._response.read()
+        return bytes(self._parser.body)
 
     @property
     def headers(self):
-        return self._response.headers
+        return self._parser.headers
 
-    def _parse(self, res_txt):
-        try:
-            from httplib import HTTPResponse
-        except:
-            # py3
-            from http.client import HTTPResponse
-        try:
-            from BytesIO import BytesIO
-        except:
-            # py3
-            from io import BytesIO
-
-        class _FakeSocket():
-
-            def __init__(self, bytes):
-                self._fp = BytesIO(bytes)
-
-            # https://github.com/python/cpython/blob/c9758784eb321fb9771e0bc7205b296e4d658045/Lib/http/client.py#L217
-            # https://stackoverflow.com/questions/24728088/python-parse-http-response-string 
-            def makefile(self, *args, **kwargs):
-                return self._fp
-        
-        fsock = _FakeSocket(res_txt)
-        self._response = HTTPResponse(fsock)
-        self._response.begin()
-        # freshly added to avoid chunked HTTPResponse
-        self._response.chunked = False
+    def body_view(self):
+        """
+        :return: memoryview, the body without copying it, e.g. for writers
+        """
+        return memoryview(self._parser.body)
+
+    def release(self):
+        """
+        Park the socket in the pool when the response is fully framed and the remote keeps it alive, close it otherwise
+        """
+        if self._pool is not None and self.is_reusable():
+            pool, self._pool = self._pool, None
+            # the socket belongs to the pool from now on, a later close() must not shut it down
+            sock, self.sock = self.sock, None
+            self._closed = True
+            pool.release(self._pool_key, sock)
+            return
+        self.close()
 
     def close(self):
-        self.sock.shutdown(socket.SHUT_RDWR)
+        if self._closed:
+            return
+        self._closed = True
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            pool.discard(self._pool_key)
+        if isinstance(self.sock, ssl.SSLSocket):
+            # TLS 1.3 session tickets are only received after the handshake
+            tls.sessions.save(self.sock, urlparse(self.url).port or default_port('https'))
+        if self._loop is not None:
+            self._loop.remove_fd(self.sock.fileno())
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # already closed by the remote
+            pass
         self.sock.close()
 
 
-def async_urlopen(url, parsed_url=None, timeout=None, loop=None):
+def open_connection(parsed, loop, alpn_protocols=None):
+    """
+    Open a new connection to the host of a url : non-blocking connect, plus the TLS handshake for https
+
+    :param parsed: Object, parsed url object
+    :param loop: SimpleEventLoop
+    :param alpn_protocols: Tuple<str>, protocols offered with ALPN, see sock.selected_alpn_protocol()
+    :return: Sock or SSLContext.SSLSocket, connected non-blocking socket
+    """
+    logger = Log.LogAdapter(_logger, "async_urlopen")
+    port = parsed.port or default_port(parsed.scheme)
+
+    # resolve on the resolver thread pool instead of letting connect call getaddrinfo on the loop thread
+    infos = yield from loop.getaddrinfo(parsed.hostname, port)
+    family, _, _, _, addr = infos[0]
+
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setblocking(False)
+
+    try:
+        logger.info("connectting to addr (%s,%d)" % addr[:2])
+        sock.connect(addr)
+    except BlockingIOError:
+        # connection in progress, completion is reported by the selector
+        pass
+    except Exception as e:
+        sock.close()
+        raise(e)
+
+    try:
+        yield from wait_writable(sock, loop)
+    except BaseException:
+        # e.g. the connect deadline passed
+        loop.remove_fd(sock.fileno())
+        sock.close()
+        raise
+    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    if err != 0:
+        loop.remove_fd(sock.fileno())
+        sock.close()
+        raise OSError(err, "failed to connect to (%s,%d) : %s" % (addr[0], addr[1], os.strerror(err)))
+    logger.info("TCP connection built.")
+
+    if parsed.scheme == 'https':
+        # contexts are shared, see core/downloader/tls.py
+        ssl_ctx = tls.get_ssl_context(alpn_protocols=alpn_protocols)
+        # create secure socket, the handshake is driven by the selector below instead of blocking the loop. The last
+        # session of the host is offered to get an abbreviated handshake.
+        sock = ssl_ctx.wrap_socket(sock, server_hostname=parsed.hostname, do_handshake_on_connect=False,
+                                   session=tls.sessions.get(ssl_ctx, parsed.hostname, port))
+        try:
+            yield from do_handshake(sock, loop)
+        except BaseException:
+            loop.remove_fd(sock.fileno())
+            sock.close()
+            raise
+        tls.sessions.record_handshake(sock)
+        tls.sessions.save(sock, port)
+        logger.info("TLS handshake done with %s, session reused %s, resumption rate %.2f" % (
+            sock.version(), sock.session_reused, tls.sessions.resumption_rate()))
+    return sock
+
+
+def is_stale(sock):
+    """
+    :param sock: Sock or SSLContext.SSLSocket, readable socket
+    :return: bool, the remote closed the connection instead of answering
+    """
+    try:
+        return not socket.socket.recv(sock, 1, socket.MSG_PEEK)
+    except (BlockingIOError, InterruptedError):
+        return False
+    except OSError:
+        return True
+
+
+def request_timeouts(timeout=None):
+    """
+    :param timeout: Number, seconds a request may take as a whole, None or <= 0 means no total deadline
+    :return: Tuple(Number, Number, Number), connect, first byte and total timeouts, settings.CONNECT_TIMEOUT and
+    settings.FIRST_BYTE_TIMEOUT bounded by the total one, None disables a deadline
+    """
+    if timeout is not None and timeout <= 0:
+        timeout = None
+
+    def bounded(value):
+        if value is None or value <= 0:
+            return timeout
+        return value if timeout is None else min(value, timeout)
+
+    return bounded(settings.CONNECT_TIMEOUT), bounded(settings.FIRST_BYTE_TIMEOUT), timeout
+
+
+def async_urlopen(url, parsed_url=None, timeout=None, loop=None, headers=None):
     """
     :param url: str, parsed url
     :param parsed_url: Object, parsed url object
-    :param timeout: Number, timeout for kernel to wait for response
+    :param timeout: Number, seconds the request may take from the connection to the end of response.read(), see
+    request_timeouts for the connect and first byte deadlines, a late request is closed and raises TimeoutError
     :param loop: SimpleEventLoop
-    :return: Response
+    :param headers: Map<str, str>, extra request headers, e.g. Range, such requests bypass the cache
+    :return: Response, call response.release() once the body is read to give the connection back to the pool, or
+    CachedResponse when settings.HTTP_CACHE is on and the cached copy is fresh or has been revalidated
     """
     logger = Log.LogAdapter(_logger, "async_urlopen")
 
     parsed = parsed_url or urlparse(url)
-    is_secured_sock_used = False
-
-    if parsed.scheme == 'http':
-        sock = socket.socket()
-        addr = (parsed.hostname, parsed.port or 80)
-    elif parsed.scheme == 'https':
-        uns_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        addr = (parsed.hostname, parsed.port or 443)
-
-        # Note ssl connect has a bug, hence I decided to connect manually
-        uns_sock.connect(addr)
-
-        is_secured_sock_used = True
-
-        ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_TLSv1)
-        # create secure socket
-        sock = ssl_ctx.wrap_socket(uns_sock, server_hostname=parsed.hostname)#, do_handshake_on_connect=False)
-        # @todo TODO (hard coded)
-        ssl_ctx.load_verify_locations(settings.CERT_FILE)
-        # please check ctx.get_ciphers(), also @see https://github.com/python/cpython/blob/master/Lib/test/test_ssl.py
-        # how to use it, yiakwy
-        ssl_ctx.set_ciphers(settings.CHIPHER)
-        # sock.do_handshake()
-    else:
+
+    if parsed.scheme not in ('http', 'https'):
         raise SystemExit("scheme %s is not supported yet" % parsed.scheme)
 
-    sock.setblocking(False)
-    loop.set_timeout(timeout)
+    timeouts = request_timeouts(timeout)
+    if not settings.HTTP_CACHE or headers:
+        return (yield from _request(url, parsed, loop, headers, timeouts))
 
+    cache = loop.http_cache
+    entry = yield from cache.lookup(url)
+    if entry is not None and cache.is_fresh(entry):
+        logger.info("%s served from the cache, cache hit rate %.2f" % (url, cache.hit_rate()))
+        return cache.response(entry)
+    response = yield from _request(url, parsed, loop, entry.validators() if entry is not None else None, timeouts)
     try:
-        logger.info("connectting to addr (%s,%d)" % addr)
-        if not is_secured_sock_used:
-            sock.connect(addr)
-    except BlockingIOError as e:
-        print(e)
-    except Exception as e:
-        raise(e)
+        return (yield from cache.handle(url, entry, response))
+    except Exception:
+        response.close()
+        raise
 
-    fut = Future()
 
-    def onConnected():
-        fut.set_ret(None)
-    
-    fd = sock.fileno()
-    loop._selector.register(fd, EVENT_WRITE, (None, onConnected))
-    yield from fut
-    logger.info("TCP connection built.")
-    loop._selector.unregister(fd)
-    # initiate http reuqest
-    req = Request('GET', url, parsed_url=parsed)
-    response = req.send(sock, is_secured=is_secured_sock_used)
-    response.set_loop(loop)
+def _request(url, parsed, loop, headers, timeouts):
+    """
+    :param url: str, url
+    :param parsed: Object, parsed url object
+    :param loop: SimpleEventLoop
+    :param headers: Map<str, str>, extra request headers
+    :param timeouts: Tuple(Number, Number, Number), see request_timeouts
+    :return: Response, bound to the first byte and total deadlines
+    """
+    connect_timeout, first_byte_timeout, total_timeout = timeouts
+    deadline = loop.time() + total_timeout if total_timeout is not None else None
+    response = yield from wait_for(_urlopen(url, parsed, loop, headers=headers, connect_timeout=connect_timeout),
+                                   total_timeout, loop, "timed out opening %s" % url)
+    # the request has just been sent
+    response.set_deadlines(first_byte=loop.time() + first_byte_timeout if first_byte_timeout is not None else None,
+                           total=deadline, stall=first_byte_timeout)
     return response
 
 
+def _urlopen(url, parsed, loop, headers=None, connect_timeout=None):
+    """
+    :param url: str, url
+    :param parsed: Object, parsed url object
+    :param loop: SimpleEventLoop
+    :param headers: Map<str, str>, extra request headers, e.g. validators of a cached copy
+    :param connect_timeout: Number, seconds to resolve the host, connect and complete the TLS handshake
+    :return: Response
+    """
+    logger = Log.LogAdapter(_logger, "async_urlopen")
+    is_secured_sock_used = parsed.scheme == 'https'
+    pool = loop.connection_pool if settings.KEEP_ALIVE else None
+    key = (parsed.scheme, parsed.hostname, parsed.port or default_port(parsed.scheme))
+
+    # imported here, the HTTP/2 handler is built on top of this module
+    from core.downloader.handlers import async_socket_http2 as http2
+    use_h2 = pool is not None and is_secured_sock_used and settings.HTTP2 and http2.available()
+
+    while True:
+        if use_h2:
+            session = pool.get_shared(key)
+            if session is not None:
+                try:
+                    return (yield from session.request('GET', url, parsed, headers=headers))
+                except http2.StreamError:
+                    # the session went away while waiting for a free stream
+                    continue
+            probe = pool.get_probe(key)
+            if probe is not None:
+                # the first connection to the host is negotiating, the request may be multiplexed over it
+                yield from probe
+                continue
+
+        sock = None
+        if pool is not None:
+            sock = yield from pool.acquire(key)
+        reused = sock is not None
+        probing = False
+        try:
+            if not reused:
+                alpn_protocols = None
+                if use_h2:
+                    alpn_protocols = http2.ALPN_PROTOCOLS
+                    if pool.protocol(key) is None and pool.get_probe(key) is None:
+                        pool.start_probe(key)
+                        probing = True
+                sock = yield from wait_for(open_connection(parsed, loop, alpn_protocols=alpn_protocols),
+                                           connect_timeout, loop, "timed out connecting to %s:%d" % key[1:])
+                if alpn_protocols is not None:
+                    protocol = sock.selected_alpn_protocol() or "http/1.1"
+                    if probing:
+                        probing = False
+                        pool.end_probe(key, protocol)
+                    if protocol == "h2":
+                        if pool.get_shared(key) is None:
+                            pool.put_shared(key, http2.HTTP2Session(sock, key, loop, pool=pool))
+                            logger.info("%s negotiated h2, requests are multiplexed" % (key,))
+                        else:
+                            loop.remove_fd(sock.fileno())
+                            sock.close()
+                        # the socket now belongs to the session, not to the keep-alive pool
+                        pool.discard(key)
+                        continue
+            # initiate http reuqest
+            req = Request('GET', url, parsed_url=parsed, headers=headers)
+            response = yield from req.send(sock, is_secured=is_secured_sock_used, loop=loop)
+            if reused:
+                # the remote may have closed the idle connection while the request was on its way
+                yield from wait_readable(sock, loop)
+                if is_stale(sock):
+                    raise ConnectionResetError("keep-alive connection closed by the remote")
+        except Exception as e:
+            if probing:
+                # let a waiting request probe again
+                pool.end_probe(key, None)
+            if pool is not None:
+                pool.discard(key)
+            if sock is not None:
+                loop.remove_fd(sock.fileno())
+                sock.close()
+            # only a stale pooled connection is worth another try
+            if not reused or not isinstance(e, OSError) or isinstance(e, TimeoutError):
+                raise
+            logger.info("reused connection to %s is stale (%s), reconnecting" % (key, e))
+            continue
+        if reused:
+            logger.info("connection to %s reused, pool stats %s" % (key, pool.stats))
+        response._pool = pool
+        response._pool_key = key
+        return response
+
+
+def save_image(content, path):
+    """
+    :param content: bytes, encoded image
+    :param path: str, destination of the image
+    :return: str, path
+    """
+    im = Image.open(io.BytesIO(content))
+    im.save(path)
+    return path
+
+
 # dataset downloader
 def async_download(url, timeout=settings.TIME_OUT, loop=None,
-                   success_handler=None, err_handler=None, dirname=None):
+                   success_handler=None, err_handler=None, dirname=None, stream=None, max_connections=None):
     """
     :param url: str, parsed url target address
     :param timeout: Number, timeout for kernel to wait for response from remote
@@ -582,7 +1582,11 @@ def async_download(url, timeout=settings.TIME_OUT, loop=None,
     :param success_handler: callback when success
     :param err_handler: callback when an error is thrown
     :param dirname: str, directory path for downloaded files
-    :return: Response
+    :param stream: bool, stream the body to disk (see core/downloader/media.py) instead of decoding and re-encoding it
+    with PIL, defaults to settings.DOWNLOAD_STREAMING
+    :param max_connections: int, ranges of a segmented download fetched at the same time at most, see
+    core/downloader/segmented.py
+    :return: str, filename of the downloaded file, None when the download failed
     """
     # TO DO: logger adpator
     logger = Log.LogAdapter(_logger, "download")
@@ -596,67 +1600,88 @@ def async_download(url, timeout=settings.TIME_OUT, loop=None,
     # write I/O, socket write http request to remote
     # response = urlopen(url, timeout=timeout)
     logger.info("downloading ...")
-    start = time.time()
-    response = yield from async_urlopen(url, timeout=timeout, loop=loop)
-    elapsed = time.time() - start
-    logger.info("connection built, eslapsed :%s sec" % elapsed)
-    CHUNK = 8192
-    
     dirname = dirname or "downloaded_data"
     if not os.path.exists(dirname):
         os.mkdir(dirname)
-    
-    logger.info("writing data to local file ...")
-
-    ## The codes works with http but not https
-    # import pdb; pdb.set_trace()
-    # with open(os.path.join(dirname, filename), "wb") as f:
-    #     while True:
-    #         # read I/O
-    #         # import pdb; pdb.set_trace()
-    #         chunk = yield from response._read(CHUNK) # read from socked's chunk
-    #         if not chunk:
-    #             break
-    #         f.write(chunk)
-
-    is_complete = False
-    total_read = -1
-    content_length = -1
-    bytes_str = b''
-    while not is_complete:
-        chunk = yield from response.recv(CHUNK)
-        bytes_str += chunk
-
-        if content_length == -1:
-            response._chunked = bytes_str
-            response._parse(bytes_str) # TODO to be optimized
+    path = os.path.join(dirname, filename)
+    stream = settings.DOWNLOAD_STREAMING if stream is None else stream
+    sniff = settings.DOWNLOAD_SNIFF_IMAGES and is_image_path(filename)
 
+    start = time.time()
+    response = None
+    if stream and settings.DOWNLOAD_SEGMENTED:
+        # imported here, segmented downloads are built on top of this module
+        from core.downloader.segmented import SegmentedDownload
+        download = SegmentedDownload(url, path, loop, segment_size=settings.DOWNLOAD_SEGMENT_SIZE,
+                                     concurrency=settings.DOWNLOAD_SEGMENTS, flush_size=settings.DOWNLOAD_FLUSH_SIZE,
+                                     sniff=sniff, timeout=timeout, max_connections=max_connections)
         try:
-            total_read = len(response.body)
-            if content_length == -1:
-                content_length = int(response.get_header('CONTENT-LENGTH'))
-            if  total_read >= content_length:
-                break
-        except http.client.IncompleteRead:
-            pass
-        except Exception as e:
-            print(e)
-            SystemExit(e)
-
-    response._chunked = bytes_str
-    response._parse(bytes_str)
-    content = response.body
-    image_buf = io.BytesIO(content)
-
-    im = Image.open(image_buf)
-    im.save(os.path.join(dirname, filename))
+            response = yield from download.run()
+        except (DownloadError, HTTPParseError, OSError) as e:
+            # the progress file is kept, the next attempt resumes
+            logger.error("failed to download %s : %s" % (url, e))
+            return None
+        if response is None:
+            logger.info("done, eslapsed :%s sec" % (time.time() - start))
+            return filename
+        # ranges are not served, the probe response carries the whole file
+    if response is None:
+        response = yield from async_urlopen(url, timeout=timeout, loop=loop)
+    elapsed = time.time() - start
+    logger.info("connection built, eslapsed :%s sec" % elapsed)
+    
+    logger.info("writing data to local file ...")
 
+    # the parser frames the body by Content-Length or chunked coding while the chunks arrive
+    status = yield from response.read_headers()
+    logger.info("status %d, content length %s" % (status, response.get_header('Content-Length')))
+    if not 200 <= status < 300:
+        logger.error("failed to download %s, status %d" % (url, status))
+        response.close()
+        return None
+
+    if not stream:
+        yield from response.read()
+        if isinstance(loop.default_executor, concurrent.futures.ThreadPoolExecutor):
+            content = response.body_view()
+        else:
+            # arguments are pickled for a process pool, memoryviews cannot be
+            content = response.body
+        # decoding and encoding images is CPU bound, keep it away from the loop thread
+        yield from loop.run_in_executor(None, save_image, content, path)
+        logger.info("done.")
+        response.release()
+        return filename
+
+    # the body goes to a temporary file as it arrives, memory stays bounded whatever the size of the file
+    writer = MediaWriter(path, loop, flush_size=settings.DOWNLOAD_FLUSH_SIZE, sniff=sniff)
+    try:
+        yield from response.stream(writer)
+        if not response.complete:
+            raise DownloadError("connection closed after %d bytes of %s" % (writer.size, url))
+        yield from writer.commit()
+    except (DownloadError, OSError) as e:
+        writer.abort()
+        response.close()
+        logger.error("failed to download %s : %s" % (url, e))
+        return None
+    except:
+        writer.abort()
+        response.close()
+        raise
     logger.info("done.")
-
-    response.close()
+    response.release()
     return filename
 
 
+def default_port(scheme):
+    """
+    :param scheme: str, 'http' or 'https'
+    :return: int
+    """
+    return 443 if scheme == 'https' else 80
+
+
 def is_redirect(code):
     """
     :param code: Int, HTTP status code
@@ -0,0 +1,423 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# HTTP/2 handler : hosts negotiating "h2" with ALPN get a single TLS connection over which every concurrent GET is
+# multiplexed as a stream. The framing and HPACK state machine come from the h2 library (optional, HTTP/1.1 is used
+# when it is not installed), I/O is driven by SimpleEventLoop exactly like async_socket_http11.
+#
+# Responses share the interface of async_socket_http11.Response, hence spiders use either protocol unchanged.
+#
+# reference:
+#     1. https://tools.ietf.org/html/rfc7540
+#     2. https://python-hyper.org/projects/h2/en/stable/
+
+from collections import deque
+
+import logging
+import utils.Log as Log
+_logger = logging.getLogger("downloader/handlers/async_socket_http11")
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.errors
+    import h2.events
+    import h2.settings
+    import h2.exceptions
+except ImportError:
+    h2 = None
+
+from config import settings
+from core.downloader import encoding
+from core.downloader.handlers.async_socket_http11 import Future, Response, PROC_IN_PROGRESS, \
+    wait_readable, wait_writable, recv_into, send_nowait
+from core.downloader.http_parser import HTTPParseError
+
+ALPN_PROTOCOLS = ("h2", "http/1.1")
+
+
+def available():
+    return h2 is not None
+
+
+class StreamError(ConnectionError):pass
+
+
+class HTTP2Response(Response):
+    """
+    Response carried by an HTTP/2 stream : the session reads the connection and feeds the parser of every stream,
+    the methods below only wait for their stream to progress
+
+    Key Members:
+
+        read_headers(), read(), stream(writer) : same as Response, deadlines included
+        release(), close() : reset the stream if it is still open, the connection stays up for the other streams
+    """
+
+    def __init__(self, method, url, session, stream_id, loop=None):
+        super().__init__(method, url, session.sock, loop=loop)
+        self._session = session
+        self.stream_id = stream_id
+        self._waiter = None
+        self._error = None
+        self._streaming = False
+        self._unacked = 0
+
+    # called by HTTP2Session
+
+    def _on_headers(self, headers):
+        status = None
+        fields = []
+        for name, value in headers:
+            if name == b":status":
+                status = value
+            elif not name.startswith(b":"):
+                fields.append((name, value))
+        if status is None or len(status) != 3 or not status.isdigit():
+            raise HTTPParseError("missing or malformed :status %r" % status)
+        status = int(status)
+        if 100 <= status < 200:
+            # interim response, the final one follows
+            return
+        self._parser.feed_headers(status, fields)
+        self._wake()
+
+    def _on_data(self, data, flow_controlled_length):
+        self._parser.feed(data)
+        if self._streaming:
+            # acknowledged once the writer has drained, the stream window is the backpressure
+            self._unacked += flow_controlled_length
+        else:
+            self._session.ack(self.stream_id, flow_controlled_length)
+        self._wake()
+
+    def _on_end(self):
+        self._eof = True
+        self._parser.feed_eof()
+        self._wake()
+
+    def _on_error(self, error):
+        self._error = error
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_ret(None)
+
+    def _wait(self):
+        if self._error is not None:
+            raise self._error
+        self._waiter = Future(loop=self._loop)
+        yield from self._waiter
+        self._waiter = None
+        if self._error is not None:
+            raise self._error
+
+    # Response interface
+
+    def _read_headers(self, CHUNK):
+        while not self._parser.headers_complete and not self._eof:
+            yield from self._wait()
+
+    def _read_body(self, CHUNK):
+        while not self._parser.complete and not self._eof:
+            yield from self._wait()
+
+    def stream(self, writer, CHUNK=None):
+        yield from self.read_headers()
+        self._streaming = True
+        self._parser.set_on_body(writer.write)
+        while not self._parser.complete and not self._eof:
+            yield from self._guard(self._wait(), self._stall_deadline(), "body")
+            yield from writer.drain()
+            if self._unacked:
+                self._session.ack(self.stream_id, self._unacked)
+                self._unacked = 0
+        self._record_transfer()
+
+    def is_reusable(self):
+        return False
+
+    def release(self):
+        self.close()
+
+    def close(self):
+        if self._session is not None:
+            session, self._session = self._session, None
+            session.end_stream(self.stream_id, reset=not self._eof)
+
+
+class HTTP2Session:
+    """
+    A multiplexed HTTP/2 connection to one host, shared through the ConnectionPool of the loop
+
+    Key members :
+
+        request(method, url, parsed) : a coroutine opening a stream, returns an HTTP2Response once the request is
+        queued, waits while the number of open streams reaches the limit of the peer (and settings.H2_MAX_STREAMS)
+        is_usable() : the connection accepts new streams
+        close() : send GOAWAY and close the socket
+    """
+
+    logger = Log.LogAdapter(_logger, "HTTP2Session")
+
+    def __init__(self, sock, key, loop, pool=None):
+        """
+        :param sock: SSLContext.SSLSocket, connected socket which negotiated "h2"
+        :param key: Tuple(str, str, int), scheme, host and port
+        :param loop: SimpleEventLoop
+        :param pool: ConnectionPool, the session removes itself from it once closed
+        """
+        self.sock = sock
+        self.key = key
+        self._loop = loop
+        self._pool = pool
+        self._conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=True,
+                                                                                   header_encoding=None))
+        self._conn.initiate_connection()
+        # large windows for bulk crawling : the peer never waits for WINDOW_UPDATE frames on a fast link
+        self._conn.update_settings({
+            h2.settings.SettingCodes.ENABLE_PUSH: 0,
+            h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: settings.H2_STREAM_WINDOW,
+        })
+        increment = settings.H2_CONNECTION_WINDOW - self._conn.inbound_flow_control_window
+        if increment > 0:
+            self._conn.increment_flow_control_window(increment)
+        # stream id -> HTTP2Response
+        self._streams = {}
+        self._waiters = deque()
+        self._out = bytearray()
+        self._writing = False
+        self.goaway = False
+        self.closed = False
+        self._idle_timer = None
+        self.stats = {"streams": 0, "max_concurrent": 0}
+        self._flush()
+        self._reader = loop.create_task(self._read_loop())
+
+    def is_usable(self):
+        return not self.closed and not self.goaway
+
+    def max_streams(self):
+        return min(self._conn.remote_settings.max_concurrent_streams, settings.H2_MAX_STREAMS)
+
+    def request(self, method, url, parsed, headers=None):
+        """
+        :param method: str, HTTP method
+        :param url: str, url
+        :param parsed: Object, parsed url object
+        :param headers: Map<str, str>, extra request headers
+        :return: HTTP2Response
+        """
+        while self.is_usable() and len(self._streams) >= self.max_streams():
+            waiter = Future(loop=self._loop)
+            self._waiters.append(waiter)
+            try:
+                yield from waiter
+            except BaseException:
+                # e.g. the deadline of the request passed, the free stream goes to the next request
+                if waiter.done():
+                    self._stream_done()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+        if not self.is_usable():
+            raise StreamError("HTTP/2 connection to %s is closed" % (self.key,))
+
+        target = parsed.path or "/"
+        if parsed.query:
+            target += "?" + parsed.query
+        authority = parsed.hostname if not parsed.port else "%s:%d" % (parsed.hostname, parsed.port)
+        fields = [(b":method", method.encode()), (b":scheme", b"https"), (b":authority", authority.encode()),
+                  (b":path", target.encode())]
+        headers = dict((name.lower(), value) for name, value in (headers or {}).items())
+        if settings.HTTP_COMPRESSION and "accept-encoding" not in headers:
+            fields.append((b"accept-encoding", encoding.accept_encoding().encode()))
+        for name, value in headers.items():
+            fields.append((name.encode(), value.encode()))
+
+        stream_id = self._conn.get_next_available_stream_id()
+        self._conn.send_headers(stream_id, fields, end_stream=True)
+        response = HTTP2Response(method, url, self, stream_id, loop=self._loop)
+        self._streams[stream_id] = response
+        self.stats["streams"] += 1
+        self.stats["max_concurrent"] = max(self.stats["max_concurrent"], len(self._streams))
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        self._flush()
+        return response
+        yield
+
+    def ack(self, stream_id, size):
+        if self.closed or size == 0:
+            return
+        self._conn.acknowledge_received_data(size, stream_id)
+        self._flush()
+
+    def end_stream(self, stream_id, reset=False):
+        """
+        :param stream_id: int, stream released by its response
+        :param reset: bool, the response was abandoned before the end of the stream
+        """
+        if self._streams.pop(stream_id, None) is None or self.closed:
+            return
+        if reset:
+            try:
+                self._conn.reset_stream(stream_id, error_code=h2.errors.ErrorCodes.CANCEL)
+            except h2.exceptions.StreamClosedError:
+                pass
+            self._flush()
+        self._stream_done()
+
+    def _stream_done(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_ret(None)
+                break
+        if not self._streams and self._idle_timer is None and not self.closed:
+            self._idle_timer = self._loop.call_later(settings.POOL_IDLE_TIMEOUT, self._close_if_idle)
+
+    def _close_if_idle(self):
+        self._idle_timer = None
+        if not self._streams:
+            self.close()
+
+    def _flush(self):
+        data = self._conn.data_to_send()
+        if data:
+            self._out += data
+        if not self._out or self._writing or self.closed:
+            return
+        sent = send_nowait(self.sock, memoryview(self._out))
+        del self._out[:sent]
+        if self._out:
+            self._writing = True
+            self._loop.create_task(self._write_loop())
+
+    def _write_loop(self):
+        try:
+            while self._out and not self.closed:
+                yield from wait_writable(self.sock, self._loop)
+                sent = send_nowait(self.sock, memoryview(self._out))
+                del self._out[:sent]
+        except OSError as e:
+            self._terminate(e)
+        finally:
+            self._writing = False
+
+    def _read_loop(self):
+        buffers = self._loop.buffer_pool
+        error = None
+        try:
+            while not self.closed:
+                buf = buffers.acquire()
+                try:
+                    readed = recv_into(self.sock, buf, len(buf))
+                    if readed == PROC_IN_PROGRESS:
+                        yield from wait_readable(self.sock, self._loop)
+                        continue
+                    if readed == 0:
+                        break
+                    events = self._conn.receive_data(bytes(memoryview(buf)[:readed]))
+                finally:
+                    buffers.release(buf)
+                for event in events:
+                    self._dispatch(event)
+                self._flush()
+        except (OSError, h2.exceptions.ProtocolError) as e:
+            error = e
+        self._terminate(error or StreamError("HTTP/2 connection to %s closed by the remote" % (self.key,)))
+
+    def _dispatch(self, event):
+        if isinstance(event, h2.events.ResponseReceived):
+            response = self._streams.get(event.stream_id)
+            if response is not None:
+                self._feed(response, response._on_headers, event.headers)
+        elif isinstance(event, h2.events.DataReceived):
+            response = self._streams.get(event.stream_id)
+            if response is None or not self._feed(response, response._on_data, event.data,
+                                                   event.flow_controlled_length):
+                # the stream was released early or failed, keep the connection window open
+                self._conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+        elif isinstance(event, h2.events.StreamEnded):
+            response = self._streams.get(event.stream_id)
+            if response is not None:
+                self._feed(response, response._on_end)
+        elif isinstance(event, h2.events.StreamReset):
+            response = self._streams.pop(event.stream_id, None)
+            if response is not None:
+                response._on_error(StreamError("stream %d reset by the remote, error code %s" % (
+                    event.stream_id, event.error_code)))
+                self._stream_done()
+        elif isinstance(event, h2.events.RemoteSettingsChanged):
+            # the stream limit may have been raised
+            for _ in range(len(self._waiters)):
+                self._stream_done()
+        elif isinstance(event, h2.events.ConnectionTerminated):
+            # streams up to last_stream_id are still answered, no new one is accepted
+            self.goaway = True
+            if self._pool is not None:
+                self._pool.remove_shared(self.key, self)
+            self.logger.info("GOAWAY from %s, error code %s" % (self.key, event.error_code))
+
+    def _feed(self, response, callback, *args):
+        """
+        Hand an event over to the response of its stream, a malformed response (or a writer refusing its body) fails
+        and resets that stream only, the other streams of the connection go on
+
+        :return: bool, the response took the event
+        """
+        try:
+            callback(*args)
+            return True
+        except Exception as e:
+            self.logger.info("stream %d of %s failed : %s: %s" % (response.stream_id, self.key, type(e).__name__, e))
+            if self._streams.pop(response.stream_id, None) is None:
+                return False
+            if isinstance(e, HTTPParseError):
+                code = h2.errors.ErrorCodes.PROTOCOL_ERROR
+            else:
+                code = h2.errors.ErrorCodes.CANCEL
+            try:
+                self._conn.reset_stream(response.stream_id, error_code=code)
+            except h2.exceptions.StreamClosedError:
+                pass
+            response._on_error(e)
+            self._stream_done()
+            return False
+
+    def _terminate(self, error):
+        if self.closed:
+            return
+        self.closed = True
+        if self._pool is not None:
+            self._pool.remove_shared(self.key, self)
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        streams, self._streams = self._streams, {}
+        for response in streams.values():
+            response._on_error(error)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_ret(None)
+        self._loop.remove_fd(self.sock.fileno())
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.logger.info("HTTP/2 connection to %s closed, stats %s" % (self.key, self.stats))
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._conn.close_connection()
+            send_nowait(self.sock, memoryview(self._out + self._conn.data_to_send()))
+        except (OSError, h2.exceptions.ProtocolError):
+            pass
+        self._terminate(StreamError("HTTP/2 connection to %s closed" % (self.key,)))
@@ -102,15 +102,17 @@ class Response:
         self._loop = loop
 
     def _read(self, CHUNK, iter=0):
-        fut = Future()
+        fut = Future(loop=self._loop)
         fd = self.pipe.fileno()
 
         def onReadable():
+            if fut.done():
+                return
             fut.set_ret(self.pipe.recv(CHUNK))
 
-        self._loop._selector.register(fd, EVENT_READ, (onReadable, None))
+        self._loop.add_reader(fd, onReadable)
         chunk = yield from fut
-        self._loop._selector.unregister(fd)
+        self._loop.remove_reader(fd)
         return chunk
 
     def read(self, CHUNK=None):
@@ -171,7 +173,8 @@ class Response:
 
     # @todo TODO
     def close(self):
-        pass
+        if self._loop is not None:
+            self._loop.remove_fd(self.pipe.fileno())
 
 class PipeSession(subprocess.Popen):
     """
@@ -0,0 +1,290 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Incremental HTTP/1.1 response parser : bytes are fed as they arrive from the socket, the status line and the headers
+# are parsed once, then the body is framed by Content-Length, chunked transfer coding or the close of the connection.
+# Every byte is looked at a constant number of times, whatever the number and size of the reads. Content codings (gzip,
+# deflate, br) are decoded on the fly, see core/downloader/encoding.py.
+#
+# reference:
+#     1. https://tools.ietf.org/html/rfc7230#section-3.3.3 , message body length
+#     2. https://tools.ietf.org/html/rfc7230#section-4.1 , chunked transfer coding
+
+import io
+import re
+import zlib
+from http.client import parse_headers
+
+from core.downloader.encoding import make_decoder, DecodingError
+
+# parser states
+HEAD = 0
+BODY = 1
+CHUNK_SIZE = 2
+CHUNK_DATA = 3
+CHUNK_CRLF = 4
+TRAILERS = 5
+UNTIL_CLOSE = 6
+DONE = 7
+
+MAX_HEAD_SIZE = 65536
+MAX_LINE_SIZE = 8192
+# searched in place, re accepts any buffer while memoryview has no find()
+_NEWLINE = re.compile(b"\n")
+
+
+class HTTPParseError(Exception):pass
+
+
+class ResponseParser:
+    """
+    State machine parsing one HTTP/1.1 response
+
+    Key members :
+
+        feed(data) : consume bytes (bytes, bytearray or memoryview), returns the number of bytes which belong to the
+        message, the rest is left to the caller
+        feed_eof() : the remote closed the connection, which ends close delimited messages
+        feed_headers(status, fields) : start a message whose head was framed by HTTP/2
+        set_on_body(on_body) : switch to streaming the payload once the headers are known
+
+        headers_complete : status, reason, version and headers (http.client.HTTPMessage) are available
+        body : bytearray, decoded payload, unless on_body is given
+        body_size, decoded_size : bytes of payload on the wire and after content decoding
+        complete : the whole message has been framed
+        keep_alive : the remote keeps the connection open once the message is complete
+    """
+
+    def __init__(self, method="GET", on_body=None, decode=True):
+        """
+        :param method: str, HTTP method of the request, responses to HEAD have no body
+        :param on_body: Func, called with a memoryview of every piece of payload instead of accumulating it in body,
+        the view is only valid during the call
+        :param decode: bool, undo the content coding announced by Content-Encoding
+        """
+        self.method = method
+        self._on_body = on_body
+        self._decode = decode
+        self._decoder = None
+        self._state = HEAD
+        self._head = bytearray()
+        self._scanned = 0
+        self._line = bytearray()
+        self._remaining = 0
+
+        self.version = None
+        self.status = None
+        self.reason = None
+        self.headers = None
+        self.headers_complete = False
+        self.keep_alive = False
+        self.chunked = False
+        self.content_length = None
+        self.body = bytearray()
+        self.body_size = 0
+        self.decoded_size = 0
+        self.eof = False
+
+    @property
+    def complete(self):
+        return self._state == DONE
+
+    def feed(self, data):
+        """
+        :param data: bytes, bytearray or memoryview, data read from the socket
+        :return: int, number of bytes consumed
+        """
+        view = memoryview(data)
+        pos = 0
+        end = len(view)
+        while pos < end and self._state != DONE:
+            state = self._state
+            if state == HEAD:
+                pos = self._feed_head(view, pos, end)
+            elif state == BODY or state == CHUNK_DATA:
+                n = min(self._remaining, end - pos)
+                self._emit(view[pos:pos + n])
+                pos += n
+                self._remaining -= n
+                if self._remaining == 0:
+                    if state == BODY:
+                        self._done()
+                    else:
+                        self._state = CHUNK_CRLF
+            elif state == UNTIL_CLOSE:
+                self._emit(view[pos:end])
+                pos = end
+            else:
+                line, pos = self._readline(view, pos, end)
+                if line is not None:
+                    self._on_line(state, line)
+        return pos
+
+    def set_on_body(self, on_body):
+        """
+        Stream the payload from now on, the part already accumulated in body is handed over first
+
+        :param on_body: Func, see __init__
+        """
+        if self.body:
+            on_body(memoryview(self.body))
+            self.body = bytearray()
+        self._on_body = on_body
+
+    def feed_eof(self):
+        self.eof = True
+        if self._state == UNTIL_CLOSE:
+            self._done()
+
+    def _done(self):
+        self._state = DONE
+        if self._decoder is not None:
+            self._deliver(self._decoder.flush())
+
+    def _emit(self, piece):
+        if not piece:
+            return
+        self.body_size += len(piece)
+        if self._decoder is not None:
+            try:
+                piece = self._decoder.decompress(piece)
+            except (zlib.error, DecodingError) as e:
+                raise HTTPParseError("failed to decode %s body : %s" % (self.headers.get("content-encoding"), e))
+        self._deliver(piece)
+
+    def _deliver(self, piece):
+        if not piece:
+            return
+        self.decoded_size += len(piece)
+        if self._on_body is not None:
+            self._on_body(piece if isinstance(piece, memoryview) else memoryview(piece))
+        else:
+            self.body += piece
+
+    def _feed_head(self, view, pos, end):
+        start = len(self._head)
+        self._head += view[pos:end]
+        # the terminator may straddle two reads
+        i = self._head.find(b"\r\n\r\n", max(0, self._scanned - 3))
+        if i < 0:
+            self._scanned = len(self._head)
+            if self._scanned > MAX_HEAD_SIZE:
+                raise HTTPParseError("response head exceeds %d bytes" % MAX_HEAD_SIZE)
+            return end
+        head = bytes(self._head[:i])
+        self._head = bytearray()
+        self._scanned = 0
+        self._on_head(head)
+        return pos + (i + 4 - start)
+
+    def _on_head(self, head):
+        status_line, _, fields = head.partition(b"\r\n")
+        try:
+            version, status, reason = (status_line.decode("iso-8859-1").split(None, 2) + [""])[:3]
+            status = int(status)
+        except ValueError:
+            raise HTTPParseError("malformed status line %r" % status_line)
+        if not version.startswith("HTTP/"):
+            raise HTTPParseError("malformed status line %r" % status_line)
+        if 100 <= status < 200 and status != 101:
+            # interim response (100 Continue, 103 Early Hints), the final one follows
+            return
+
+        headers = parse_headers(io.BytesIO(fields + b"\r\n\r\n" if fields else b"\r\n"))
+        self._on_fields(version, status, reason.strip(), headers)
+
+    def feed_headers(self, status, fields, version="HTTP/2"):
+        """
+        Start a message whose head was framed by another protocol (HTTP/2 HEADERS), the payload is then fed as usual
+        and ended by feed_eof unless Content-Length tells its size
+
+        :param status: int, status code
+        :param fields: List<Tuple(bytes, bytes)>, header fields, pseudo headers excluded
+        :param version: str, protocol version
+        """
+        block = b"".join(name + b": " + value + b"\r\n" for name, value in fields)
+        self._on_fields(version, status, "", parse_headers(io.BytesIO(block + b"\r\n")))
+
+    def _on_fields(self, version, status, reason, headers):
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.headers_complete = True
+
+        connection = (self.headers.get("connection") or "").lower()
+        if version == "HTTP/1.1":
+            self.keep_alive = "close" not in connection
+        else:
+            self.keep_alive = "keep-alive" in connection
+
+        if self._decode:
+            try:
+                self._decoder = make_decoder(self.headers.get("content-encoding"))
+            except DecodingError as e:
+                raise HTTPParseError(str(e))
+
+        transfer_encoding = (self.headers.get("transfer-encoding") or "").lower()
+        content_length = self.headers.get("content-length")
+        if self.method == "HEAD" or status in (101, 204, 304):
+            self._decoder = None
+            self._state = DONE
+        elif "chunked" in transfer_encoding:
+            self.chunked = True
+            self._state = CHUNK_SIZE
+        elif content_length is not None:
+            try:
+                self.content_length = int(content_length)
+            except ValueError:
+                raise HTTPParseError("invalid Content-Length %r" % content_length)
+            if self.content_length < 0:
+                raise HTTPParseError("invalid Content-Length %r" % content_length)
+            self._remaining = self.content_length
+            if self.content_length > 0:
+                self._state = BODY
+            else:
+                self._done()
+        else:
+            self.keep_alive = False
+            self._state = UNTIL_CLOSE
+
+    def _readline(self, view, pos, end):
+        """
+        :return: Tuple(bytes or None, int), the line without its terminator once complete, and the new position
+        """
+        limit = min(end, pos + MAX_LINE_SIZE)
+        match = _NEWLINE.search(view, pos, limit)
+        if match is None:
+            self._line += view[pos:limit]
+            if len(self._line) > MAX_LINE_SIZE:
+                raise HTTPParseError("line exceeds %d bytes" % MAX_LINE_SIZE)
+            return None, limit
+        i = match.start()
+        # only the line itself is copied, not the body data following it
+        self._line += view[pos:i]
+        line = bytes(self._line).rstrip(b"\r")
+        self._line = bytearray()
+        return line, i + 1
+
+    def _on_line(self, state, line):
+        if state == CHUNK_SIZE:
+            # chunk extensions are ignored
+            size = line.split(b";", 1)[0].strip()
+            try:
+                size = int(size, 16)
+            except ValueError:
+                raise HTTPParseError("invalid chunk size %r" % line)
+            if size == 0:
+                self._state = TRAILERS
+            else:
+                self._remaining = size
+                self._state = CHUNK_DATA
+        elif state == CHUNK_CRLF:
+            if line:
+                raise HTTPParseError("missing CRLF after chunk data")
+            self._state = CHUNK_SIZE
+        elif state == TRAILERS:
+            # trailer fields are dropped, an empty line ends the message
+            if not line:
+                self._done()
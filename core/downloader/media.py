@@ -0,0 +1,144 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Streaming media downloads : the body is written to a temporary file next to its destination while it arrives, and
+# renamed atomically once complete. A partially downloaded file is never visible under the final name.
+#
+# Images are validated by sniffing their signature instead of decoding them, the original bytes are kept as sent.
+
+import os
+import tempfile
+
+import logging
+import utils.Log as Log
+_logger = logging.getLogger("downloader/handlers/async_socket_http11")
+
+# signature -> format, see https://en.wikipedia.org/wiki/List_of_file_signatures
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"\x00\x00\x01\x00", "ico"),
+)
+SNIFF_SIZE = 16
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".ico", ".webp")
+
+
+class DownloadError(Exception):pass
+
+
+def sniff_image(head):
+    """
+    :param head: bytes, first bytes of a file, SNIFF_SIZE bytes are enough
+    :return: str, image format, or None when the signature is unknown
+    """
+    head = bytes(head[:SNIFF_SIZE])
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, fmt in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    return None
+
+
+def write_all(fd, data, offset=None):
+    """
+    Raw writes may write fewer bytes than asked, e.g. when the disk is full or on a signal, the rest is written again
+
+    :param fd: int, file descriptor
+    :param data: bytes-like object
+    :param offset: int, position in the file for pwrite, None writes at the current position
+    :return: int, bytes written
+    """
+    view = memoryview(data)
+    while view:
+        n = os.write(fd, view) if offset is None else os.pwrite(fd, view, offset)
+        if n == 0:
+            raise OSError("no byte written")
+        view = view[n:]
+        if offset is not None:
+            offset += n
+    return len(data)
+
+
+def is_image_path(path):
+    """
+    :param path: str, file name or path
+    :return: bool, the extension is one of an image format
+    """
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+
+class MediaWriter:
+    """
+    Stream a body to disk with bounded memory : pieces are gathered up to flush_size, then written by a thread of the
+    loop while the download waits, so at most flush_size plus one read are held per download
+
+    Key members :
+
+        write(view) : on_body callback of the response parser, copies the piece into the pending buffer
+        drain() : a coroutine writing the pending buffer once it reaches flush_size
+        commit() : a coroutine flushing the rest, validating the signature and renaming the file, returns the path
+        abort() : drop the temporary file
+    """
+
+    logger = Log.LogAdapter(_logger, "MediaWriter")
+
+    def __init__(self, path, loop, flush_size=262144, sniff=True):
+        """
+        :param path: str, destination of the file
+        :param loop: SimpleEventLoop
+        :param flush_size: int, bytes gathered before a write is issued
+        :param sniff: bool, reject bodies whose signature is not an image one
+        """
+        self.path = path
+        self._loop = loop
+        self.flush_size = flush_size
+        self.sniff = sniff
+        dirname, basename = os.path.split(path)
+        fd, self._tmp = tempfile.mkstemp(prefix="." + basename + ".", suffix=".part", dir=dirname or ".")
+        self._file = os.fdopen(fd, "wb", buffering=0)
+        self._pending = bytearray()
+        self._head = bytearray()
+        self.size = 0
+
+    def write(self, view):
+        if len(self._head) < SNIFF_SIZE:
+            self._head += view[:SNIFF_SIZE - len(self._head)]
+        self._pending += view
+        self.size += len(view)
+
+    def _flush(self):
+        data, self._pending = self._pending, bytearray()
+        yield from self._loop.run_in_executor(self._loop.file_executor, write_all, self._file.fileno(), data)
+
+    def drain(self):
+        if len(self._pending) >= self.flush_size:
+            yield from self._flush()
+
+    def commit(self):
+        """
+        :return: str, path of the downloaded file
+        """
+        if self.sniff and sniff_image(self._head) is None:
+            self.abort()
+            raise DownloadError("%s is not an image, starts with %r" % (self.path, bytes(self._head)))
+        if self._pending:
+            yield from self._flush()
+        self._file.close()
+        os.replace(self._tmp, self.path)
+        self.logger.info("%s saved, %d bytes" % (self.path, self.size))
+        return self.path
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.unlink(self._tmp)
+        except FileNotFoundError:
+            pass
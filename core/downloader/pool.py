@@ -0,0 +1,255 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Keep-alive connection pool for HTTP/1.1 : once a response is fully framed, its socket is parked here instead of being
+# shut down, and the next request to the same (scheme, host, port) skips the TCP connect and the TLS handshake.
+#
+#     1. max_idle : idle sockets kept in total, the oldest one of the pool is closed beyond it
+#     2. max_per_host : connections opened (busy and idle) per key, acquirers wait for a release beyond it
+#     3. idle_timeout : seconds an idle socket is kept, expired sockets are swept by a loop timer
+#
+# Hosts which negotiated HTTP/2 keep a single shared session instead (see handlers/async_socket_http2.py), the first
+# connection to a host is a probe : concurrent requests wait for its ALPN outcome rather than all connecting.
+
+import socket
+from collections import deque, OrderedDict
+
+import logging
+import utils.Log as Log
+_logger = logging.getLogger("downloader/handlers/async_socket_http11")
+
+
+def is_alive(sock):
+    """
+    Check that the remote has not closed an idle connection : nothing, not even a FIN, is expected on it
+
+    :param sock: Sock or SSLContext.SSLSocket, non-blocking socket
+    :return: bool
+    """
+    try:
+        # peek at the raw descriptor, bypassing the TLS layer of SSLSocket
+        socket.socket.recv(sock, 1, socket.MSG_PEEK)
+    except (BlockingIOError, InterruptedError):
+        return True
+    except OSError:
+        return False
+    # b"" is a FIN, unsolicited bytes (e.g. a TLS close_notify) mean the connection cannot be reused either
+    return False
+
+
+class ConnectionPool:
+    """
+    Per host pool of keep-alive sockets bound to an event loop
+
+    Key members :
+
+        acquire(key) : a coroutine returning an idle socket of the key, or None when the caller is allowed to connect
+        a new one, usage : `sock = yield from pool.acquire(("https", host, port))`
+        release(key, sock, reusable) : give a socket back, it is closed unless reusable
+        discard(key) : the socket acquired (or connected) for the key has been closed by the caller
+        get_shared(key), put_shared(key, session), remove_shared(key, session) : multiplexed sessions of HTTP/2 hosts
+        protocol(key) : protocol negotiated with the key so far, None when unknown
+        start_probe(key), end_probe(key, protocol), get_probe(key) : the ALPN outcome of a first connection
+        stats : Map<str, int>, counters of reused and created connections
+    """
+
+    logger = Log.LogAdapter(_logger, "ConnectionPool")
+
+    def __init__(self, loop, max_idle=100, max_per_host=32, idle_timeout=30):
+        """
+        :param loop: SimpleEventLoop
+        :param max_idle: int, maximum of idle sockets over all keys
+        :param max_per_host: int, maximum of connections per key, 0 means no limit
+        :param idle_timeout: Number, seconds an idle socket is kept
+        """
+        self._loop = loop
+        self.max_idle = max_idle
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        # key -> deque of (released at, sock), the most recently released socket is on the right
+        self._idle = {}
+        # sock -> key, in the order of release, to close the oldest idle socket first
+        self._idle_order = OrderedDict()
+        # key -> number of connections handed out
+        self._active = {}
+        # key -> deque of Future waiting for a free slot
+        self._waiters = {}
+        # key -> shared session, e.g. HTTP2Session
+        self._shared = {}
+        # key -> negotiated protocol, "h2" or "http/1.1"
+        self._protocols = {}
+        # key -> Future resolved with the protocol once the probing connection is established
+        self._probes = {}
+        self._sweeper = None
+        self.stats = {"reused": 0, "created": 0, "closed": 0}
+
+    def _count(self, key):
+        return self._active.get(key, 0) + len(self._idle.get(key, ()))
+
+    def _close(self, sock):
+        self._loop.remove_fd(sock.fileno())
+        try:
+            sock.close()
+        except OSError:
+            pass
+        self.stats["closed"] += 1
+
+    def _pop_idle(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            released_at, sock = idle.pop()
+            del self._idle_order[sock]
+            if self._loop.time() - released_at < self.idle_timeout and is_alive(sock):
+                return sock
+            self._close(sock)
+        return None
+
+    def acquire(self, key):
+        """
+        :param key: Tuple(str, str, int), scheme, host and port
+        :return: Sock, SSLContext.SSLSocket or None, None means a new connection must be opened by the caller
+        """
+        while True:
+            sock = self._pop_idle(key)
+            if sock is not None:
+                self._active[key] = self._active.get(key, 0) + 1
+                self.stats["reused"] += 1
+                return sock
+            if self.max_per_host <= 0 or self._count(key) < self.max_per_host:
+                self._active[key] = self._active.get(key, 0) + 1
+                self.stats["created"] += 1
+                return None
+            waiter = self._loop.create_future()
+            waiters = self._waiters.setdefault(key, deque())
+            waiters.append(waiter)
+            try:
+                yield from waiter
+            except BaseException:
+                # e.g. the deadline of the request passed, the free slot goes to the next request
+                if waiter.done():
+                    self._wakeup(key)
+                elif waiter in waiters:
+                    waiters.remove(waiter)
+                raise
+
+    def _wakeup(self, key):
+        waiters = self._waiters.get(key)
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_ret(None)
+                break
+        if not waiters:
+            self._waiters.pop(key, None)
+
+    def _done(self, key):
+        n = self._active.get(key, 0) - 1
+        if n > 0:
+            self._active[key] = n
+        else:
+            self._active.pop(key, None)
+
+    def release(self, key, sock, reusable=True):
+        """
+        :param key: Tuple(str, str, int), scheme, host and port
+        :param sock: Sock or SSLContext.SSLSocket, socket acquired (or connected) for the key
+        :param reusable: bool, the response was fully framed and the remote did not ask to close
+        :return: None
+        """
+        self._done(key)
+        if not reusable or self.max_idle <= 0:
+            self._close(sock)
+        else:
+            while len(self._idle_order) >= self.max_idle:
+                oldest, oldest_key = self._idle_order.popitem(last=False)
+                idle = self._idle[oldest_key]
+                idle.remove(next(item for item in idle if item[1] is oldest))
+                if not idle:
+                    del self._idle[oldest_key]
+                self._close(oldest)
+            self._idle.setdefault(key, deque()).append((self._loop.time(), sock))
+            self._idle_order[sock] = key
+            if self._sweeper is None:
+                self._sweeper = self._loop.call_later(self.idle_timeout, self._sweep)
+        self._wakeup(key)
+
+    def discard(self, key):
+        """
+        :param key: Tuple(str, str, int), scheme, host and port
+        :return: None
+        """
+        self._done(key)
+        self._wakeup(key)
+
+    def get_shared(self, key):
+        """
+        :param key: Tuple(str, str, int), scheme, host and port
+        :return: HTTP2Session, usable session of the key or None
+        """
+        session = self._shared.get(key)
+        if session is not None and not session.is_usable():
+            del self._shared[key]
+            session = None
+        return session
+
+    def put_shared(self, key, session):
+        self._shared[key] = session
+        self._protocols[key] = "h2"
+
+    def remove_shared(self, key, session):
+        if self._shared.get(key) is session:
+            del self._shared[key]
+
+    def protocol(self, key):
+        return self._protocols.get(key)
+
+    def get_probe(self, key):
+        """
+        :return: Future, resolved once the first connection of the key knows its protocol, None when no probe runs
+        """
+        return self._probes.get(key)
+
+    def start_probe(self, key):
+        self._probes[key] = self._loop.create_future()
+
+    def end_probe(self, key, protocol):
+        """
+        :param key: Tuple(str, str, int), scheme, host and port
+        :param protocol: str, protocol selected by ALPN, None when the connection failed
+        """
+        if protocol is not None:
+            self._protocols[key] = protocol
+        probe = self._probes.pop(key, None)
+        if probe is not None and not probe.done():
+            probe.set_ret(protocol)
+
+    def _sweep(self):
+        self._sweeper = None
+        deadline = self._loop.time() - self.idle_timeout
+        for key in list(self._idle):
+            idle = self._idle[key]
+            while idle and idle[0][0] <= deadline:
+                _, sock = idle.popleft()
+                del self._idle_order[sock]
+                self._close(sock)
+            if not idle:
+                del self._idle[key]
+        if self._idle_order:
+            self._sweeper = self._loop.call_later(self.idle_timeout, self._sweep)
+        self.logger.info("idle connections swept, %d left, stats %s" % (len(self._idle_order), self.stats))
+
+    def idle_count(self):
+        return len(self._idle_order)
+
+    def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for sock in list(self._idle_order):
+            self._close(sock)
+        self._idle.clear()
+        self._idle_order.clear()
+        for session in list(self._shared.values()):
+            session.close()
+        self._shared.clear()
@@ -0,0 +1,134 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Non-blocking DNS resolution for SimpleEventLoop : getaddrinfo runs on a dedicated thread pool (so that a busy parsing
+# executor never delays connections), results are cached with a TTL, failures are cached with a shorter one, and
+# concurrent lookups of the same host share a single request.
+#
+# getaddrinfo does not expose record TTLs, hence settings.DNS_TTL is applied to every positive answer.
+
+import socket
+import concurrent.futures
+
+import logging
+import utils.Log as Log
+_logger = logging.getLogger("downloader/handlers/async_socket_http11")
+
+
+class Resolver:
+    """
+    TTL aware resolver cache bound to an event loop
+
+    Key members :
+
+        getaddrinfo(host, port, family, type) : a coroutine returning the list of socket.getaddrinfo
+        prefetch(addrs) : start resolving hosts which are about to be crawled, in the background
+        hit_rate() : ratio of lookups served from the cache, negative answers included
+    """
+
+    logger = Log.LogAdapter(_logger, "Resolver")
+
+    def __init__(self, loop, ttl=300, negative_ttl=30, max_workers=8, max_size=100000):
+        """
+        :param loop: SimpleEventLoop
+        :param ttl: Number, seconds a resolved address is kept
+        :param negative_ttl: Number, seconds a resolution failure is kept
+        :param max_workers: int, number of threads calling getaddrinfo
+        :param max_size: int, maximum of cached entries
+        """
+        self._loop = loop
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        # key -> (expires, List<addrinfo> or socket.gaierror)
+        self._cache = {}
+        # key -> Future of the lookup in progress
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.
+
+    def _lookup(self, key):
+        fut = self._pending.get(key)
+        if fut is None:
+            host, port, family, type = key
+            fut = self._loop.run_in_executor(self._executor, socket.getaddrinfo, host, port, family, type)
+            self._pending[key] = fut
+        return fut
+
+    def _store(self, key, value, ttl):
+        if len(self._cache) >= self.max_size:
+            self._evict()
+        self._cache[key] = (self._loop.time() + ttl, value)
+
+    def _evict(self):
+        now = self._loop.time()
+        for key in [key for key, (expires, _) in self._cache.items() if expires <= now]:
+            del self._cache[key]
+        # still full : drop the oldest insertions
+        while len(self._cache) >= self.max_size:
+            del self._cache[next(iter(self._cache))]
+
+    def getaddrinfo(self, host, port, family=0, type=socket.SOCK_STREAM):
+        """
+        :param host: str, hostname
+        :param port: int, port
+        :param family: int, address family, 0 means any
+        :param type: int, socket type
+        :return: List<Tuple>, see socket.getaddrinfo, raises socket.gaierror when the host cannot be resolved, e.g. a
+        host which is not a valid IDNA name
+        """
+        key = (host, port, family, type)
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > self._loop.time():
+            self.hits += 1
+            if isinstance(entry[1], Exception):
+                raise entry[1]
+            return entry[1]
+
+        self.misses += 1
+        fut = self._lookup(key)
+        try:
+            addrs = yield from fut
+        except (socket.gaierror, UnicodeError, OSError) as e:
+            if not isinstance(e, socket.gaierror):
+                # e.g. UnicodeError for a label over 63 characters, which canonical urls may carry
+                e = socket.gaierror(socket.EAI_NONAME, "invalid host %r : %s" % (host, e))
+            self._store(key, e, self.negative_ttl)
+            self.logger.info("failed to resolve %s : %s, dns cache hit rate %.2f" % (host, e, self.hit_rate()))
+            raise e
+        finally:
+            # a failed lookup must not be shared by the later ones
+            if self._pending.get(key) is fut:
+                del self._pending[key]
+        self._store(key, addrs, self.ttl)
+        self.logger.info("%s resolved, dns cache hit rate %.2f" % (host, self.hit_rate()))
+        return addrs
+
+    def _prefetch_one(self, host, port):
+        try:
+            yield from self.getaddrinfo(host, port)
+        except (socket.gaierror, UnicodeError, OSError):
+            # cached as a negative answer, the crawl of the host reports it
+            pass
+
+    def prefetch(self, addrs):
+        """
+        :param addrs: Iterable<Tuple(str, int)>, hosts and ports sitting in the frontier
+        :return: None
+        """
+        now = self._loop.time()
+        for host, port in addrs:
+            key = (host, port, 0, socket.SOCK_STREAM)
+            entry = self._cache.get(key)
+            if (entry is not None and entry[0] > now) or key in self._pending:
+                continue
+            self._loop.create_task(self._prefetch_one(host, port))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
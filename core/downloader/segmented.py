@@ -0,0 +1,324 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Segmented downloads of large media : the file is split into byte ranges (RFC 7233) fetched concurrently on the
+# loop, each range is written in place into a preallocated file. Completed segments are recorded in a sidecar
+# progress file, so that an interrupted download resumes with the missing segments only.
+#
+# The first request is a probe asking for the first missing segment :
+#
+#     1. 206 Partial Content : the total size comes from Content-Range, the remaining segments are scheduled
+#     2. 200 OK : ranges are not supported (or the file changed, see If-Range), the response is handed back to
+#        async_download which streams it as usual
+#
+# Files smaller than a segment are therefore complete after the probe, with no extra round trip.
+#
+# reference:
+#     1. https://tools.ietf.org/html/rfc7233
+
+import os
+import re
+import json
+from collections import deque
+
+import logging
+import utils.Log as Log
+_logger = logging.getLogger("downloader/handlers/async_socket_http11")
+
+from core.downloader.media import DownloadError, sniff_image, write_all, SNIFF_SIZE
+from core.downloader.http_parser import HTTPParseError
+from core.downloader.handlers.async_socket_http11 import Task, async_urlopen
+from config import settings
+
+CONTENT_RANGE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)")
+# attempts per segment before the download is given up, its progress is kept for the next run
+SEGMENT_RETRIES = 3
+
+
+def parse_content_range(value):
+    """
+    :param value: str, value of the Content-Range header
+    :return: Tuple(int, int, int), first byte, last byte and complete length (None when unknown), or None
+    """
+    m = CONTENT_RANGE.match(value or "")
+    if m is None:
+        return None
+    first, last, total = m.groups()
+    return int(first), int(last), None if total == "*" else int(total)
+
+
+def _write_json(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def _preallocate(fd, size):
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            # not supported by the file system
+            pass
+    os.ftruncate(fd, size)
+
+
+def _read_head(fd):
+    return os.pread(fd, SNIFF_SIZE, 0)
+
+
+class SegmentWriter:
+    """
+    Write the body of a range at its offset in the shared file, with the interface of MediaWriter for Response.stream
+
+    Key members :
+
+        write(view) : on_body callback of the response parser
+        drain() : a coroutine writing the pending bytes once they reach flush_size
+        commit() : a coroutine writing the rest
+    """
+
+    def __init__(self, fd, offset, loop, flush_size=262144):
+        self._fd = fd
+        self._offset = offset
+        self._loop = loop
+        self.flush_size = flush_size
+        self._pending = bytearray()
+        self.size = 0
+
+    def write(self, view):
+        self._pending += view
+        self.size += len(view)
+
+    def _flush(self):
+        data, self._pending = self._pending, bytearray()
+        offset, self._offset = self._offset, self._offset + len(data)
+        yield from self._loop.run_in_executor(self._loop.file_executor, write_all, self._fd, data, offset)
+
+    def drain(self):
+        if len(self._pending) >= self.flush_size:
+            yield from self._flush()
+
+    def commit(self):
+        if self._pending:
+            yield from self._flush()
+
+
+class SegmentedDownload:
+    """
+    Download of one file by byte ranges, resumable through a sidecar progress file
+
+    Key members :
+
+        run() : a coroutine returning None once the file is saved, or the probe response when the server does not
+        serve ranges, raises DownloadError (the progress is kept) when a segment cannot be fetched
+        progress_path, data_path : the sidecar and the preallocated file, both removed once the file is complete
+    """
+
+    logger = Log.LogAdapter(_logger, "SegmentedDownload")
+
+    def __init__(self, url, path, loop, segment_size=1048576, concurrency=4, flush_size=262144, sniff=True,
+                 timeout=None, max_connections=None):
+        """
+        :param url: str, url of the file
+        :param path: str, destination of the file
+        :param loop: SimpleEventLoop
+        :param segment_size: int, bytes per range request
+        :param concurrency: int, ranges fetched at the same time
+        :param flush_size: int, bytes gathered before a write is issued
+        :param sniff: bool, reject files whose signature is not an image one
+        :param timeout: Number, see async_urlopen
+        :param max_connections: int, connections the download may open to the host at the same time, e.g. its share of
+        the window of the host in the scheduler, settings.HOST_MAX_CONNECTIONS by default, <= 0 means no limit
+        """
+        self.url = url
+        self.path = path
+        self._loop = loop
+        self.segment_size = segment_size
+        self.concurrency = concurrency
+        self.max_connections = settings.HOST_MAX_CONNECTIONS if max_connections is None else max_connections
+        self.flush_size = flush_size
+        self.sniff = sniff
+        self.timeout = timeout
+        dirname, basename = os.path.split(path)
+        self.data_path = os.path.join(dirname, "." + basename + ".segments")
+        self.progress_path = os.path.join(dirname, "." + basename + ".progress")
+        self._fd = None
+        self._progress = None
+        self._pending = deque()
+        self._failed = None
+
+    # progress
+
+    def _load_progress(self):
+        try:
+            with open(self.progress_path) as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if progress.get("url") != self.url or progress.get("segment_size") != self.segment_size or \
+                not os.path.isfile(self.data_path):
+            return None
+        return progress
+
+    def _save_progress(self):
+        yield from self._loop.run_in_executor(self._loop.file_executor, _write_json, self.progress_path,
+                                              self._progress)
+
+    def _reset(self):
+        for path in (self.data_path, self.progress_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _segments(self):
+        return (self._progress["size"] + self.segment_size - 1) // self.segment_size
+
+    def _range(self, index):
+        first = index * self.segment_size
+        return first, min(first + self.segment_size, self._progress["size"]) - 1
+
+    def _headers(self, first, last, validator=None):
+        # ranges apply to the encoded representation, ask for the identity one
+        headers = {"Range": "bytes=%d-%d" % (first, last), "Accept-Encoding": "identity"}
+        if validator:
+            # the server answers 200 with the whole file if it changed since the progress was recorded
+            headers["If-Range"] = validator
+        return headers
+
+    # download
+
+    def run(self):
+        self._progress = self._load_progress()
+        if self._progress is None:
+            self._reset()
+            first = 0
+            validator = None
+        else:
+            done = set(self._progress["done"])
+            if len(done) == self._segments():
+                # interrupted right before the rename
+                self._open()
+                try:
+                    yield from self._commit()
+                finally:
+                    self._close()
+                return None
+            first = next(i for i in range(self._segments()) if i not in done) * self.segment_size
+            validator = self._progress.get("etag") or self._progress.get("last_modified")
+            self.logger.info("resuming %s, %d of %d segments done" % (self.url, len(done), self._segments()))
+
+        response = yield from async_urlopen(self.url, timeout=self.timeout, loop=self._loop,
+                                            headers=self._headers(first, first + self.segment_size - 1, validator))
+        try:
+            status = yield from response.read_headers()
+            content_range = parse_content_range(response.get_header("content-range"))
+            if status != 206 or content_range is None or content_range[2] is None or content_range[0] != first or \
+                    response.get_header("content-encoding") not in (None, "identity"):
+                # served as a whole
+                if self._progress is not None:
+                    self.logger.info("%s changed or ranges are refused, restarting" % self.url)
+                self._reset()
+                return response
+            total = content_range[2]
+            etag, last_modified = response.get_header("etag"), response.get_header("last-modified")
+            if self._progress is not None and (self._progress["size"] != total or
+                                               self._progress.get("etag") != etag):
+                self.logger.info("%s changed, restarting" % self.url)
+                self._reset()
+                self._progress = None
+            if self._progress is None:
+                self._progress = {"url": self.url, "size": total, "segment_size": self.segment_size,
+                                  "etag": etag, "last_modified": last_modified, "done": []}
+            self._open()
+            yield from self._loop.run_in_executor(self._loop.file_executor, _preallocate, self._fd, total)
+            yield from self._receive(first // self.segment_size, response)
+        except:
+            response.close()
+            self._close()
+            raise
+        response.release()
+
+        try:
+            done = set(self._progress["done"])
+            self._pending.extend(i for i in range(self._segments()) if i not in done)
+            workers = [Task(self._worker(), loop=self._loop) for _ in range(self._workers())]
+            for worker in workers:
+                yield from worker
+            if self._failed is not None:
+                raise self._failed
+            yield from self._commit()
+        finally:
+            self._close()
+        return None
+
+    def _workers(self):
+        # each worker holds a connection to the host, the politeness of the crawl applies to them as to pages
+        n = min(self.concurrency, len(self._pending))
+        if self.max_connections > 0:
+            n = min(n, self.max_connections)
+        return n
+
+    def _open(self):
+        self._fd = os.open(self.data_path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _receive(self, index, response):
+        first, last = self._range(index)
+        writer = SegmentWriter(self._fd, first, self._loop, flush_size=self.flush_size)
+        yield from response.stream(writer)
+        if not response.complete or writer.size != last - first + 1:
+            raise DownloadError("segment %d of %s : %d bytes received instead of %d" % (
+                index, self.url, writer.size, last - first + 1))
+        yield from writer.commit()
+        self._progress["done"].append(index)
+        yield from self._save_progress()
+
+    def _fetch(self, index):
+        first, last = self._range(index)
+        validator = self._progress.get("etag") or self._progress.get("last_modified")
+        response = yield from async_urlopen(self.url, timeout=self.timeout, loop=self._loop,
+                                            headers=self._headers(first, last, validator))
+        try:
+            status = yield from response.read_headers()
+            content_range = parse_content_range(response.get_header("content-range"))
+            if status != 206 or content_range is None or content_range[:2] != (first, last):
+                raise DownloadError("segment %d of %s : status %d, content range %s" % (
+                    index, self.url, status, response.get_header("content-range")))
+            yield from self._receive(index, response)
+        except:
+            response.close()
+            raise
+        response.release()
+
+    def _worker(self):
+        while self._pending and self._failed is None:
+            index = self._pending.popleft()
+            for attempt in range(1, SEGMENT_RETRIES + 1):
+                try:
+                    yield from self._fetch(index)
+                    break
+                except (DownloadError, HTTPParseError, OSError) as e:
+                    self.logger.info("segment %d of %s failed (%s), attempt %d" % (index, self.url, e, attempt))
+                    if attempt == SEGMENT_RETRIES:
+                        self._failed = DownloadError("segment %d of %s failed : %s" % (index, self.url, e))
+
+    def _commit(self):
+        if self.sniff:
+            head = yield from self._loop.run_in_executor(self._loop.file_executor, _read_head, self._fd)
+            if sniff_image(head) is None:
+                self._close()
+                self._reset()
+                raise DownloadError("%s is not an image, starts with %r" % (self.path, head))
+        self._close()
+        os.replace(self.data_path, self.path)
+        os.unlink(self.progress_path)
+        self.logger.info("%s saved, %d bytes in %d segments" % (self.path, self._progress["size"], self._segments()))
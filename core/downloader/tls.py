@@ -0,0 +1,111 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Process wide TLS state of the downloader :
+#
+#     1. SSLContext cache : parsing the CA bundle is expensive, contexts are built once per (verify, ca file, ciphers)
+#     2. SSLSession cache : the last session of every host is kept so that reconnects do abbreviated handshakes
+#
+# Contexts negotiate the best protocol both ends support (TLS 1.2 at least) instead of the hardcoded TLSv1.
+
+import os
+import ssl
+from collections import OrderedDict
+
+import logging
+import utils.Log as Log
+_logger = logging.getLogger("downloader/handlers/async_socket_http11")
+
+from config import settings
+
+logger = Log.LogAdapter(_logger, "tls")
+
+# (verify, cafile, ciphers, alpn) -> SSLContext
+_contexts = {}
+
+
+def get_ssl_context(verify=None, cafile=None, ciphers=None, alpn_protocols=None):
+    """
+    :param verify: bool, verify certificates and hostnames, defaults to settings.SSL_VERIFY
+    :param cafile: str, CA bundle, defaults to settings.CERT_FILE, the system store is used when the file is missing
+    :param ciphers: str, OpenSSL cipher list for TLS 1.2, defaults to settings.CHIPHER. TLS 1.3 suites are not affected
+    :param alpn_protocols: Tuple<str>, protocols offered with ALPN, e.g. ("h2", "http/1.1")
+    :return: ssl.SSLContext, shared by every connection using the same settings
+    """
+    verify = settings.SSL_VERIFY if verify is None else verify
+    cafile = settings.CERT_FILE if cafile is None else cafile
+    ciphers = settings.CHIPHER if ciphers is None else ciphers
+    key = (verify, cafile, ciphers, tuple(alpn_protocols or ()))
+    ctx = _contexts.get(key)
+    if ctx is not None:
+        return ctx
+
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    if verify:
+        if cafile and os.path.isfile(cafile):
+            ctx.load_verify_locations(cafile)
+        else:
+            ctx.load_default_certs()
+    else:
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    if ciphers:
+        # please check ctx.get_ciphers(), also @see https://github.com/python/cpython/blob/master/Lib/test/test_ssl.py
+        ctx.set_ciphers(ciphers)
+    if alpn_protocols:
+        ctx.set_alpn_protocols(list(alpn_protocols))
+    _contexts[key] = ctx
+    logger.info("SSLContext created for %s" % (key,))
+    return ctx
+
+
+class SessionCache:
+    """
+    LRU cache of the latest SSLSession per (context, host, port)
+
+    Key members :
+      get(ctx, host, port) : SSLSession or None
+      save(sock, port) : keep the session of a connected SSLSocket, call it again before closing the socket since TLS 1.3
+      tickets arrive after the handshake
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._sessions = OrderedDict()
+        self.handshakes = 0
+        self.resumed = 0
+
+    def get(self, ctx, host, port):
+        key = (id(ctx), host, port)
+        session = self._sessions.get(key)
+        if session is not None:
+            self._sessions.move_to_end(key)
+        return session
+
+    def save(self, sock, port):
+        """
+        :param sock: ssl.SSLSocket, connected socket
+        :param port: int, port of the host, the peer may have already gone when the socket is closed
+        :return: None
+        """
+        session = sock.session
+        if session is None:
+            return
+        key = (id(sock.context), sock.server_hostname, port)
+        self._sessions[key] = session
+        self._sessions.move_to_end(key)
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+
+    def record_handshake(self, sock):
+        self.handshakes += 1
+        if sock.session_reused:
+            self.resumed += 1
+
+    def resumption_rate(self):
+        return self.resumed / self.handshakes if self.handshakes > 0 else 0.
+
+
+sessions = SessionCache(max_size=settings.SSL_SESSION_CACHE_SIZE)
@@ -5,7 +5,13 @@
 import os
 
 # import core asynchronous downloader using mutlplexing technology
-from core.downloader.handlers.async_socket_http11 import Queue, urlparse, async_download, async_urlopen, is_redirect, StopImediately
+from core.downloader.handlers.async_socket_http11 import urlparse, async_download, async_urlopen, is_redirect, StopImediately, default_port, \
+    Cancel, StopEventLoop
+from core.downloader import encoding
+from core.spiders.scheduler import create_queue
+from core.spiders.congestion import parse_retry_after, THROTTLING_STATUS
+from core.spiders.dedup import loop_store
+from core.spiders.canonical import canonicalize, resolve, resolve_all
 from config import settings
 
 import logging
@@ -31,14 +37,23 @@ class BaseAsyncSpider:
     logger = Log.LogAdapter(_logger, "base_spider")
 
     def __init__(self, root_url, max_redirect, max_depth, loop=None, queue=None):
-        self._q = queue or Queue(maxsize=10000)
+        self._q = queue or create_queue(loop)
+        if root_url is not None:
+            # the seed takes the form of the links found later, see core/spiders/canonical.py
+            root_url = canonicalize(root_url) or root_url
         self.root_url = root_url
         self.max_redirect = max_redirect
         self.max_depth = max_depth
         self._loop = loop 
-        self.seen_urls = set()
-        data = (root_url, max_redirect, 0)
-        self._q.put_nowait(data)
+        # urls already scheduled, shared by the spiders of the loop, a compact store of fingerprints by default, see
+        # core/spiders/dedup.py
+        self.seen_urls = loop_store(loop)
+        # ShardRouter, set by sharded crawls to hand links of foreign hosts over to their worker processes
+        self.router = None
+        # a seed linked from another seed of the loop, or scheduled by it already, is crawled once
+        if root_url is not None and self.seen_urls.add(root_url):
+            data = (root_url, max_redirect, 0)
+            self._enqueue(data)
         self._is_media_type_to_be_downloaded = False
         self._media_types_to_be_downloaded = []
         # @todo TODO(add switch support), see @webkit downloader usage tests.core.downloader.handlers.test_webkit_runtime.py
@@ -48,13 +63,126 @@ class BaseAsyncSpider:
     def _run(self):
         while True:
             # import pdb; pdb.set_trace()
-            url, max_redirect, depth = yield from self._q.get()
-            yield from self.crawl(url, max_redirect, 0)
-            self._q.task_done()
+            data = yield from self._q.get()
+            url, max_redirect, depth = data
+            try:
+                yield from self.crawl(url, max_redirect, depth)
+            except (Cancel, StopImediately, StopEventLoop):
+                raise
+            except Exception as e:
+                # a failed page must not take the worker, nor the event loop, down
+                self.logger.error("failed to crawl %s : %s: %s" % (url, type(e).__name__, e))
+            finally:
+                # the host of the url may be served again
+                self._q.task_done(data)
 
     def parse_links(self, response):
         raise Exception("Not Implemented!")
 
+    def _schedule(self, data):
+        """
+        :param data: Tuple(str, int, int), url, max_redirect and depth of a crawling job
+        :return: None
+        """
+        if self.router is not None and not self.router.owns(data[0]):
+            self.router.dispatch(data)
+        else:
+            self._enqueue(data)
+
+    def _enqueue(self, data):
+        # a full frontier must not cost the links of a page, HostScheduler keeps them aside until there is room
+        offer = getattr(self._q, "offer", None)
+        if offer is not None:
+            offer(data)
+        else:
+            self._q.put_nowait(data)
+
+    def _prefetch_hosts(self, links):
+        """
+        Resolve the hosts of freshly enqueued links in the background, before workers pick them up
+
+        :param links: List<str>, urls
+        :return: None
+        """
+        addrs = set()
+        for link in links:
+            parsed = urlparse(link)
+            if parsed.hostname is not None and (self.router is None or self.router.owns(link)):
+                addrs.add((parsed.hostname, parsed.port or default_port(parsed.scheme)))
+        self._loop.resolver.prefetch(addrs)
+
+    def accept_routed(self, data):
+        """
+        Accept a crawling job discovered by another shard
+
+        :param data: Tuple(str, int, int), url, max_redirect and depth of a crawling job
+        :return: None
+        """
+        url = data[0]
+        if not getattr(self.seen_urls, "cross_process", False):
+            if not self.seen_urls.add(url):
+                return
+        # otherwise the sender found the url in the shared store first, duplicates were not routed at all
+        self._enqueue(data)
+
+    def _observe(self, url, start, response=None, error=None):
+        """
+        Report the outcome of a request to the scheduler, which adapts the concurrency of the host
+
+        :param url: str, requested url
+        :param start: Number, loop time when the request started
+        :param response: Response, None when the request failed
+        :param error: Exception
+        :return: None
+        """
+        observe = getattr(self._q, "observe", None)
+        if observe is None:
+            return
+        if response is not None and getattr(response, "from_cache", False) and not response.revalidated:
+            # the host was not contacted
+            return
+        status, retry_after = self._outcome(response)
+        observe(url, self._loop.time() - start, status=status, error=error, retry_after=retry_after)
+
+    @staticmethod
+    def _outcome(response):
+        """
+        :param response: Response or None
+        :return: Tuple(int, Number), status code and Retry-After of the response, None when missing
+        """
+        if response is None:
+            return None, None
+        retry_after = None
+        if response.status in THROTTLING_STATUS:
+            retry_after = parse_retry_after(response.get_header("retry-after"))
+        return response.status, retry_after
+
+    def _connections(self, *data):
+        """
+        :param data: Tuple(str, int, int), url, max_redirect and depth of the crawling job being processed
+        :return: int, requests the job may run to its host at the same time within the window of the scheduler, None
+        without a HostScheduler
+        """
+        connections = getattr(self._q, "connections", None)
+        return connections(data) if connections is not None else None
+
+    def _retry(self, data, response=None, error=None):
+        """
+        Put a failed crawling job back to the scheduler after a backoff
+
+        :param data: Tuple(str, int, int), url, max_redirect and depth of the crawling job
+        :param response: Response, e.g. a 503, None when the request failed
+        :param error: Exception
+        :return: bool, the job will be retried
+        """
+        retry = getattr(self._q, "retry", None)
+        if retry is None:
+            return False
+        if response is not None and getattr(response, "from_cache", False):
+            return False
+        status, retry_after = self._outcome(response)
+        return retry(data, status=status, error=error, retry_after=retry_after)
+
     def crawl(self, url, max_redirect, depth):
         """
         :param url: str, parsed url
@@ -62,18 +190,12 @@ class BaseAsyncSpider:
         :param depth: int, depth go into from root url
         :return: None
         """
-        self.logger.info("crawling %s at depth %d, seen urls %d" % (url, depth, len(self.seen_urls)))
+        self.logger.info("crawling %s at depth %d, seen urls %d, dns cache hit rate %.2f, bandwidth saved %.1f%%" % (
+            url, depth, len(self.seen_urls), self._loop.resolver.hit_rate(), 100 * encoding.stats.savings()))
         parsed = urlparse(url)
         self.cur_addr = parsed
         filename = os.path.basename(parsed.path)
 
-        def is_media_type(link):
-            for media_ext in self._media_types_to_be_downloaded:
-                if link is not None and link.endswith(media_ext):
-                    return True
-
-            return False
-
         # handling media type
         if self._is_media_type_to_be_downloaded:
             if len(self._media_types_to_be_downloaded) > 0:
@@ -81,46 +203,63 @@ class BaseAsyncSpider:
                     if filename is not None and filename.endswith(media_ext):
                         if self.count >= self.target_number:
                             raise StopImediately()
-                        yield from async_download(url, dirname=self.dirname, loop=self._loop)
-                        self.count += 1
+                        # the ranges of a large file share the window of the host with its pages
+                        connections = self._connections(url, max_redirect, depth)
+                        filename = yield from async_download(url, dirname=self.dirname, loop=self._loop,
+                                                             max_connections=connections)
+                        if filename is not None:
+                            self.count += 1
                         return
 
         response = None
         try:
-            response = yield from async_urlopen(url, parsed_url=parsed, timeout=settings.TIME_OUT, loop=self._loop)
-            yield from response.read()
+            start = self._loop.time()
+            try:
+                response = yield from async_urlopen(url, parsed_url=parsed, timeout=settings.TIME_OUT, loop=self._loop)
+                yield from response.read()
+            except Exception as e:
+                self._observe(url, start, error=e)
+                if self._retry((url, max_redirect, depth), error=e):
+                    self.logger.info("%s failed (%s: %s), retry scheduled" % (url, type(e).__name__, e))
+                    return
+                raise
+            self._observe(url, start, response=response)
+            if self._retry((url, max_redirect, depth), response=response):
+                self.logger.info("%s answered %d, retry scheduled" % (url, response.status))
+                return
         # import pdb; pdb.set_trace()
             if depth >= self.max_depth:
                 raise StopCrawling()
             if is_redirect(response.status):
                 if max_redirect > 0:
-                    next_url = response.get_header('location')
+                    # Location may be relative
+                    next_url = resolve(url, response.get_header('location'))
                 else:
                     self.logger.error("url %s exeeds maximum of redirection %d" % (url, self.max_redirect))
                     return
 
-                if next_url in self.seen_urls: return 
+                # add() tells whether the url is new in one step, no other worker process can slip in between
+                if next_url is None or not self.seen_urls.add(next_url): return
 
                 self.logger.info("url %s is redirected to %s" % (url, next_url))
 
-                self.seen_urls.add(next_url)
                 data = (next_url, max_redirect-1, depth)
-                self._q.put_nowait(data)
+                self._schedule(data)
             else:
                 links = yield from self.parse_links(response)
-                links_to_wait = []
-                for link in set(links).difference(self.seen_urls):
-                    data = (link, self.max_redirect, depth + 1)
-                    if is_media_type(link):
-                        self._q.put_nowait(data)
-                    else:
-                        links_to_wait.append(data)
-                for data in links_to_wait:
-                    self._q.put_nowait(data)
-                self.seen_urls.update(links)
+                # canonical, absolute and unique, a no-op for links canonicalized by parse_links already
+                links = resolve_all(url, links)
+                # the order of the crawl is up to the strategy of the scheduler, see core/spiders/frontier.py
+                scheduled = []
+                for link in links:
+                    if not self.seen_urls.add(link):
+                        continue
+                    self._schedule((link, self.max_redirect, depth + 1))
+                    scheduled.append(link)
+                self._prefetch_hosts(scheduled)
         except StopCrawling:
             self.logger.info("StopCrawing ...")
             pass
         finally:
             if response:
-                response.close()
+                response.release()
@@ -0,0 +1,242 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Canonical form of the urls of a crawl, so that equivalent urls are fetched once :
+#
+#     1. scheme and host are lower cased, international hosts are IDNA encoded, a trailing dot of the host is dropped
+#     2. default ports (80 for http, 443 for https) are dropped
+#     3. the empty path becomes "/", dot segments are removed (RFC 3986, 5.2.4)
+#     4. percent-encoding : escapes of unreserved characters are decoded, the others are upper cased, characters which
+#        may not appear in a url (spaces, non ASCII characters as UTF-8) are escaped, a lone "%" becomes "%25"
+#     5. query parameters are sorted by name (values of a repeated name keep their order), tracking parameters listed
+#        in settings.URL_IGNORED_PARAMS are dropped, an empty query is dropped
+#     6. the fragment is dropped, it is never sent to the server
+#
+# Only http and https urls have a canonical form, other schemes (mailto:, javascript:, data:) are skipped. Canonical
+# urls are the keys of the dedup stores (see core/spiders/dedup.py) and of the hosts of the scheduler.
+#
+# reference:
+#     1. https://www.rfc-editor.org/rfc/rfc3986#section-6
+#     2. https://developers.google.com/search/docs/crawling-indexing/canonicalization
+
+import re
+import hashlib
+from functools import lru_cache
+from urllib.parse import quote
+
+from config import settings
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+_UNRESERVED = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+# a valid escape, or a lone "%"
+_ESCAPE = re.compile(r"%([0-9A-Fa-f]{2})?")
+# characters escaped by quote() with the safe sets below
+_UNSAFE = re.compile(r"[^A-Za-z0-9\-._~!$&'()*+,;=:@/?%]")
+_PATH_SAFE = "/:@!$&'()*+,;=%"
+_QUERY_SAFE = "/?:@!$'()*+,;=%"
+# RFC 3986 appendix B, one match instead of urlsplit
+_URL = re.compile(r"(?:([^:/?#]+):)?(?://([^/?#]*))?([^?#]*)(?:\?([^#]*))?")
+_SCHEME = re.compile(r"([A-Za-z][A-Za-z0-9+.\-]*):")
+_AUTHORITY = re.compile(r"[A-Za-z][A-Za-z0-9+.\-]*://([^/?#]*)")
+
+
+def _fix_escape(match):
+    hexdigits = match.group(1)
+    if hexdigits is None:
+        return "%25"
+    c = chr(int(hexdigits, 16))
+    if c in _UNRESERVED:
+        return c
+    return "%" + hexdigits.upper()
+
+
+def _normalize_escapes(s, safe):
+    if "%" in s:
+        s = _ESCAPE.sub(_fix_escape, s)
+    if _UNSAFE.search(s) is not None:
+        s = quote(s, safe=safe)
+    return s
+
+
+def remove_dot_segments(path):
+    """
+    :param path: str, absolute path
+    :return: str, path without "." and ".." segments, RFC 3986 5.2.4
+    """
+    output = []
+    for segment in path.split("/")[1:]:
+        if segment == "..":
+            if output:
+                output.pop()
+        elif segment != ".":
+            output.append(segment)
+    last = path.rsplit("/", 1)[-1]
+    if last in (".", ".."):
+        # "/a/b/.." is the directory "/a/"
+        output.append("")
+    return "/" + "/".join(output)
+
+
+def _normalize_host(host):
+    host = host.lower()
+    if host.endswith("."):
+        host = host[:-1]
+    if not host:
+        return None
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            return None
+    return host
+
+
+def _normalize_query(query):
+    params = [_normalize_escapes(param, _QUERY_SAFE) for param in query.split("&") if param]
+    ignored = settings.URL_IGNORED_PARAMS
+    if ignored:
+        params = [param for param in params if param.partition("=")[0] not in ignored]
+    # stable : values of a repeated parameter keep their order
+    params.sort(key=lambda param: param.partition("=")[0])
+    return "&".join(params)
+
+
+@lru_cache(maxsize=65536)
+def canonicalize(url):
+    """
+    :param url: str, absolute url
+    :return: str, canonical form of the url, None when the url is not an http(s) url or is invalid
+    """
+    url = url.strip()
+    if "\t" in url or "\n" in url or "\r" in url:
+        # removed by browsers, as by urlsplit
+        url = url.replace("\t", "").replace("\n", "").replace("\r", "")
+    scheme, netloc, path, query = _URL.match(url).groups()
+    if scheme is None or netloc is None:
+        return None
+    scheme = scheme.lower()
+    default_port = DEFAULT_PORTS.get(scheme)
+    if default_port is None:
+        return None
+    userinfo, _, hostport = netloc.rpartition("@")
+    if hostport.startswith("["):
+        # IPv6 literal
+        host, _, port = hostport.partition("]")
+        host += "]"
+        port = port[1:]
+    else:
+        host, _, port = hostport.partition(":")
+    host = _normalize_host(host)
+    if host is None:
+        return None
+    if port:
+        if not port.isdigit():
+            return None
+        port = int(port)
+    authority = host if not port or port == default_port else "%s:%d" % (host, port)
+    if userinfo:
+        authority = "%s@%s" % (userinfo, authority)
+
+    if path:
+        path = _normalize_escapes(path, _PATH_SAFE)
+        if "/." in path:
+            path = remove_dot_segments(path)
+    else:
+        path = "/"
+    canonical = scheme + "://" + authority + path
+    if query:
+        query = _normalize_query(query)
+        if query:
+            canonical += "?" + query
+    return canonical
+
+
+def resolve_all(base, hrefs):
+    """
+    Resolve the links of a page against its url and canonicalize them, the base is parsed once for the whole page
+
+    :param base: str, url of the page, or of its <base href>
+    :param hrefs: Iterable<str>, links as found in the page : absolute, scheme relative, absolute or relative paths,
+    queries or fragments
+    :return: List<str>, canonical urls without duplicates in the order of the page, links to other schemes, fragments of
+    the page itself and invalid links are dropped
+    """
+    base = canonicalize(base)
+    if base is None:
+        return []
+    scheme, _, rest = base.partition("://")
+    slash = rest.find("/")
+    origin = base[:len(scheme) + 3 + slash]
+    base_path = rest[slash:].partition("?")[0]
+    base_dir = base_path[:base_path.rfind("/") + 1]
+
+    urls = []
+    seen = set()
+    for href in hrefs:
+        href = href.strip()
+        if not href or href[0] == "#":
+            continue
+        first = href[0]
+        if first == "/":
+            url = scheme + ":" + href if href.startswith("//") else origin + href
+        elif first == "?":
+            url = origin + base_path + href
+        else:
+            match = _SCHEME.match(href)
+            if match is not None:
+                if match.group(1).lower() not in DEFAULT_PORTS:
+                    continue
+                url = href
+            else:
+                # relative path, dot segments are removed by canonicalize
+                url = origin + base_dir + href
+        url = canonicalize(url)
+        if url is not None and url not in seen:
+            seen.add(url)
+            urls.append(url)
+    return urls
+
+
+def resolve(base, href):
+    """
+    :param base: str, url of the page
+    :param href: str, link, e.g. the Location of a redirection
+    :return: str, canonical url, None when the link cannot be crawled
+    """
+    if href is None:
+        return None
+    urls = resolve_all(base, [href])
+    return urls[0] if urls else None
+
+
+def fingerprint(url):
+    """
+    :param url: str, canonical url
+    :return: int, stable 64-bit fingerprint of the url, never 0, `hash` is salted per process
+    """
+    return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+def url_fingerprint(url):
+    """
+    :param url: str, any absolute url
+    :return: int, fingerprint of its canonical form, equivalent urls share it, None for urls which cannot be crawled
+    """
+    canonical = canonicalize(url)
+    return fingerprint(canonical) if canonical is not None else None
+
+
+def host_of(url):
+    """
+    :param url: str, absolute url
+    :return: str, lower cased host without user info nor port, "" when missing, cheaper than urlparse
+    """
+    match = _AUTHORITY.match(url)
+    if match is None:
+        return ""
+    hostport = match.group(1).rpartition("@")[2]
+    if hostport.startswith("["):
+        return hostport[1:hostport.find("]")].lower()
+    return hostport.partition(":")[0].lower()
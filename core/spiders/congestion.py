@@ -0,0 +1,174 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Adaptive per host concurrency : every host gets a window of pages crawled at the same time, adjusted by AIMD
+# (additive increase, multiplicative decrease) as TCP congestion control does,
+#
+#     1. success with a steady latency : the window grows by one page per window of responses
+#     2. success with a latency far above the best one seen : the host is saturated, the window holds
+#     3. timeout, connection error, 429 or any 5xx : the window is cut by AIMD_DECREASE, at most once per latency
+#        period, Retry-After also pauses the host (see HostScheduler.observe)
+#
+# The windows are enforced by core/spiders/scheduler.py when handing jobs over to the spider tasks.
+
+import time
+from email.utils import parsedate_to_datetime
+
+import logging
+import utils.Log as Log
+_logger = logging.getLogger("base_spider")
+
+# statuses telling the client to slow down
+THROTTLING_STATUS = (429, 503)
+
+
+def parse_retry_after(value, now=None):
+    """
+    :param value: str, value of the Retry-After header, seconds or an HTTP date
+    :param now: Number, time.time() used for dates
+    :return: Number, seconds to wait, None when the value is invalid
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        when = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+    return max(0, when - (time.time() if now is None else now))
+
+
+class HostWindow:
+    """
+    Congestion state of a host
+
+    Key members :
+
+        window : float, pages of the host crawled at the same time, int(window) is enforced
+        latency : float, moving average of the response time, None before the first response
+        min_latency : float, best response time seen
+        stats : Map<str, int>, counters of responses, timeouts, throttling answers and other errors
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.latency = None
+        self.min_latency = None
+        self.last_decrease = None
+        self.stats = {"responses": 0, "timeouts": 0, "throttled": 0, "errors": 0, "increases": 0, "decreases": 0}
+
+
+class AIMDController:
+    """
+    AIMD windows of the hosts of a crawl
+
+    Key members :
+
+        limit(host) : int, pages of the host allowed at the same time
+        on_response(host, latency, status) : account a response
+        on_error(host, latency, error) : account a failed request, e.g. a timeout
+        host_stats(host) : Map, window, latency and counters of the host
+    """
+
+    logger = Log.LogAdapter(_logger, "AIMDController")
+
+    def __init__(self, initial_window=2, min_window=1, max_window=64, decrease=0.5, latency_factor=2., alpha=0.2,
+                 clock=None):
+        """
+        :param initial_window: float, window of a new host
+        :param min_window: float, lower bound of the windows
+        :param max_window: float, upper bound of the windows
+        :param decrease: float, factor applied to the window on congestion
+        :param latency_factor: float, latency over the best one beyond which the window stops growing
+        :param alpha: float, weight of a new sample in the latency moving average
+        :param clock: Func() -> Number, e.g. loop.time
+        """
+        self.initial_window = initial_window
+        self.min_window = min_window
+        self.max_window = max_window
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.alpha = alpha
+        self._clock = clock or time.monotonic
+        # host -> HostWindow
+        self._hosts = {}
+
+    def _get(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = HostWindow(self.initial_window)
+        return state
+
+    def limit(self, host):
+        state = self._hosts.get(host)
+        return max(self.min_window, int(state.window if state is not None else self.initial_window))
+
+    def _sample(self, state, latency):
+        if latency is None:
+            return
+        state.latency = latency if state.latency is None else (1 - self.alpha) * state.latency + self.alpha * latency
+        state.min_latency = latency if state.min_latency is None else min(state.min_latency, latency)
+
+    def _set_window(self, host, state, window, reason):
+        window = min(self.max_window, max(self.min_window, window))
+        if int(window) != int(state.window):
+            self.logger.info("%s : window %d -> %d (%s), latency %.3fs, best %.3fs" % (
+                host, int(state.window), int(window), reason, state.latency or 0., state.min_latency or 0.))
+        state.window = window
+
+    def on_response(self, host, latency, status):
+        """
+        :param host: str, hostname
+        :param latency: Number, seconds from the request to the end of the response
+        :param status: int, status code
+        :return: None
+        """
+        state = self._get(host)
+        state.stats["responses"] += 1
+        if status in THROTTLING_STATUS or status >= 500:
+            # an overloaded origin often answers 500, 502 or 504 rather than 503
+            if status in THROTTLING_STATUS:
+                state.stats["throttled"] += 1
+            else:
+                state.stats["errors"] += 1
+            self._congestion(host, state, "status %d" % status)
+            return
+        self._sample(state, latency)
+        if state.latency > self.latency_factor * state.min_latency:
+            # queueing at the host, keep the window
+            return
+        state.stats["increases"] += 1
+        # one more page per window of responses, i.e. +1 per round trip
+        self._set_window(host, state, state.window + 1. / state.window, "steady latency")
+
+    def on_error(self, host, latency, error):
+        """
+        :param host: str, hostname
+        :param latency: Number, seconds until the failure
+        :param error: Exception
+        :return: None
+        """
+        state = self._get(host)
+        if isinstance(error, TimeoutError):
+            state.stats["timeouts"] += 1
+        else:
+            state.stats["errors"] += 1
+        self._congestion(host, state, type(error).__name__)
+
+    def _congestion(self, host, state, reason):
+        now = self._clock()
+        # failures of requests sent in the same round trip count once
+        if state.last_decrease is not None and now - state.last_decrease < (state.latency or 0.):
+            return
+        state.last_decrease = now
+        state.stats["decreases"] += 1
+        self._set_window(host, state, state.window * self.decrease, reason)
+
+    def host_stats(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            return None
+        return dict(state.stats, window=state.window, latency=state.latency, min_latency=state.min_latency)
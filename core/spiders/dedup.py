@@ -0,0 +1,512 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Stores of the urls already seen by a crawl, drop-in replacements of the `seen_urls` set of full url strings :
+#
+#     1. FingerprintSet : 64-bit fingerprints of the urls in an open addressing hash table (linear probing) over a flat
+#        array of uint64, about 8 bytes per slot instead of ~100 bytes per string and set entry, exact up to collisions
+#        of 64-bit fingerprints, i.e. never below billions of urls
+#     2. ScalableBloomFilter : bounded false positive rate, a new and larger filter is appended whenever the last one is
+#        full, about 2 bytes per url at 0.1%, a false positive is a page which is not crawled
+#     3. MmapFingerprintSet : FingerprintSet in a memory mapped file, a restarted crawl knows what it has already seen
+#     4. SharedFingerprintSet : a table of fixed size in shared memory, read and written by every worker process of a
+#        sharded crawl without any message on the way
+#
+# The stores accept canonical urls (see core/spiders/canonical.py) with `in`, add(url) and update(urls), as sets do,
+# see create_dedup_store for the settings.
+# Every spider of a loop shares the store returned by loop_store(loop), a link found from two seeds is crawled once.
+#
+# reference:
+#     1. P. S. Almeida, C. Baquero, N. Preguica, D. Hutchison, Scalable Bloom Filters, 2007
+#     2. A. Kirsch, M. Mitzenmacher, Less Hashing, Same Performance: Building a Better Bloom Filter, 2006
+
+import os
+import math
+import mmap
+import struct
+import weakref
+from array import array
+from multiprocessing import shared_memory
+
+import logging
+import utils.Log as Log
+_logger = logging.getLogger("base_spider")
+
+from core.spiders.canonical import fingerprint
+from config import settings
+
+
+class UrlSet(set):
+    """
+    Url strings, whose add() tells whether the url was new as the other stores do
+    """
+
+    def add(self, url):
+        if url in self:
+            return False
+        set.add(self, url)
+        return True
+
+
+def _slots(capacity, max_load):
+    return 1 << max(4, math.ceil(math.log2(max(1, capacity) / max_load)))
+
+
+class FingerprintSet:
+    """
+    Urls seen by a crawl as 64-bit fingerprints in an open addressing hash table, the table doubles once its load
+    exceeds max_load
+
+    Key members :
+
+        add(url) : bool, the url was not seen yet
+        url in store, update(urls), len(store) : as with sets
+        add_fingerprint(fp), contains_fingerprint(fp) : same with fingerprints computed by the caller
+        nbytes() : int, memory used by the table
+    """
+
+    logger = Log.LogAdapter(_logger, "FingerprintSet")
+
+    def __init__(self, capacity=1 << 20, max_load=0.7):
+        """
+        :param capacity: int, urls held before the first resize
+        :param max_load: float, fraction of the slots used beyond which the table doubles
+        """
+        self.max_load = max_load
+        self._count = 0
+        self._set_table(array("Q", [0]) * _slots(capacity, max_load))
+
+    def _set_table(self, buf):
+        self._buf = buf
+        self._table = memoryview(buf)
+        self._mask = len(self._table) - 1
+        self._limit = int(len(self._table) * self.max_load)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, url):
+        return self.contains_fingerprint(fingerprint(url))
+
+    def add(self, url):
+        return self.add_fingerprint(fingerprint(url))
+
+    def update(self, urls):
+        for url in urls:
+            self.add_fingerprint(fingerprint(url))
+
+    def contains_fingerprint(self, fp):
+        table, mask = self._table, self._mask
+        i = fp & mask
+        while True:
+            slot = table[i]
+            if slot == fp:
+                return True
+            if slot == 0:
+                return False
+            i = (i + 1) & mask
+
+    def add_fingerprint(self, fp):
+        """
+        :param fp: int, fingerprint, see fingerprint()
+        :return: bool, the fingerprint was not in the table
+        """
+        table, mask = self._table, self._mask
+        i = fp & mask
+        while True:
+            slot = table[i]
+            if slot == fp:
+                return False
+            if slot == 0:
+                break
+            i = (i + 1) & mask
+        table[i] = fp
+        self._count += 1
+        if self._count > self._limit:
+            self._grow()
+        return True
+
+    def _insert(self, table, mask, fp):
+        i = fp & mask
+        while table[i] != 0:
+            i = (i + 1) & mask
+        table[i] = fp
+
+    def _rehash(self, old, new):
+        table = memoryview(new)
+        mask = len(table) - 1
+        insert = self._insert
+        for fp in old:
+            if fp:
+                insert(table, mask, fp)
+
+    def _grow(self):
+        old = self._table
+        new = array("Q", [0]) * (2 * len(old))
+        self._rehash(old, new)
+        self._set_table(new)
+        self.logger.info("grown to %d slots, %d urls" % (len(self._table), self._count))
+
+    def nbytes(self):
+        return self._table.nbytes
+
+
+class BloomFilter:
+    """
+    A Bloom filter of fixed capacity, k positions derived from the 64-bit fingerprint by double hashing
+
+    Key members :
+
+        add_fingerprint(fp) : bool, at least one bit was unset, i.e. the fingerprint was not added yet
+        contains_fingerprint(fp) : bool, may be a false positive with probability error_rate at capacity
+    """
+
+    def __init__(self, capacity, error_rate):
+        """
+        :param capacity: int, fingerprints added before the error rate is reached
+        :param error_rate: float, false positive rate at capacity
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.n_bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.n_bits + 7) // 8)
+
+    def contains_fingerprint(self, fp):
+        bits, n_bits = self._bits, self.n_bits
+        # position i is h1 + i * h2
+        h, h2 = fp & 0xffffffff, (fp >> 32) | 1
+        for _ in range(self.n_hashes):
+            pos = h % n_bits
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+            h += h2
+        return True
+
+    def add_fingerprint(self, fp):
+        bits, n_bits = self._bits, self.n_bits
+        h, h2 = fp & 0xffffffff, (fp >> 32) | 1
+        added = False
+        for _ in range(self.n_hashes):
+            pos = h % n_bits
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                added = True
+            h += h2
+        if added:
+            self.count += 1
+        return added
+
+    def nbytes(self):
+        return len(self._bits)
+
+
+class ScalableBloomFilter:
+    """
+    Bloom filters appended as the crawl grows, the false positive rate stays below error_rate whatever the number of
+    urls : the i-th filter has `growth ** i` times the initial capacity and `tightening ** i` times the initial error
+    rate, whose sum is bounded by error_rate
+
+    Key members :
+
+        add(url) : bool, the url was not seen yet (false positives return False)
+        url in store, update(urls), len(store) : as with sets, len counts the urls added
+        nbytes() : int, memory used by the filters
+    """
+
+    logger = Log.LogAdapter(_logger, "ScalableBloomFilter")
+
+    def __init__(self, capacity=1 << 20, error_rate=0.001, growth=2, tightening=0.8):
+        """
+        :param capacity: int, urls held by the first filter
+        :param error_rate: float, upper bound of the false positive rate
+        :param growth: int, capacity of a new filter over the previous one
+        :param tightening: float, error rate of a new filter over the previous one
+        """
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self._filters = [BloomFilter(capacity, error_rate * (1 - tightening))]
+
+    def __len__(self):
+        return sum(f.count for f in self._filters)
+
+    def __contains__(self, url):
+        return self.contains_fingerprint(fingerprint(url))
+
+    def add(self, url):
+        return self.add_fingerprint(fingerprint(url))
+
+    def update(self, urls):
+        for url in urls:
+            self.add_fingerprint(fingerprint(url))
+
+    def contains_fingerprint(self, fp):
+        # the last filter holds the most urls
+        for f in reversed(self._filters):
+            if f.contains_fingerprint(fp):
+                return True
+        return False
+
+    def add_fingerprint(self, fp):
+        filters = self._filters
+        for f in filters[:-1]:
+            if f.contains_fingerprint(fp):
+                return False
+        last = filters[-1]
+        if last.count >= last.capacity:
+            if last.contains_fingerprint(fp):
+                return False
+            last = BloomFilter(last.capacity * self.growth, last.error_rate * self.tightening)
+            filters.append(last)
+            self.logger.info("filter %d added, capacity %d, error rate %g" % (
+                len(filters), last.capacity, last.error_rate))
+        # testing and setting the bits of the last filter is a single pass
+        return last.add_fingerprint(fp)
+
+    def nbytes(self):
+        return sum(f.nbytes() for f in self._filters)
+
+
+class MmapFingerprintSet(FingerprintSet):
+    """
+    FingerprintSet in a memory mapped file : pages are written back by the kernel, the urls seen survive a restart of
+    the crawl. The header holds a magic, the number of slots, the number of fingerprints and whether the file was
+    closed cleanly, the fingerprints are counted again otherwise.
+
+    Key members :
+
+        flush() : write the table back to the file
+        close() : flush and unmap, the store must not be used afterwards
+    """
+
+    logger = Log.LogAdapter(_logger, "MmapFingerprintSet")
+
+    MAGIC = b"URLFP001"
+    HEADER = struct.Struct("<8sQQQ")
+
+    def __init__(self, path, capacity=1 << 20, max_load=0.7):
+        """
+        :param path: str, file of the table, created when missing
+        :param capacity: int, urls held before the first resize of a new file
+        :param max_load: float, see FingerprintSet
+        """
+        self.path = path
+        self.max_load = max_load
+        self._count = 0
+        self._file = None
+        self._mm = None
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) >= self.HEADER.size:
+            self._open(path)
+        else:
+            self._map(self._create(path, _slots(capacity, max_load)))
+
+    def _create(self, path, slots):
+        with open(path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, slots, 0, 0))
+            f.truncate(self.HEADER.size + 8 * slots)
+        return open(path, "r+b")
+
+    def _map(self, f):
+        self._file = f
+        self._mm = mmap.mmap(f.fileno(), 0)
+        magic, slots, count, clean = self.HEADER.unpack_from(self._mm)
+        if magic != self.MAGIC or len(self._mm) != self.HEADER.size + 8 * slots:
+            self._mm.close()
+            f.close()
+            raise ValueError("%s is not a fingerprint table" % self.path)
+        # the table is being modified, a crash leaves the count stale
+        self.HEADER.pack_into(self._mm, 0, magic, slots, count, 0)
+        self._set_table(memoryview(self._mm)[self.HEADER.size:].cast("Q"))
+        return count, clean
+
+    def _open(self, path):
+        count, clean = self._map(open(path, "r+b"))
+        self._count = count if clean else sum(1 for fp in self._table if fp)
+        self.logger.info("%s reopened with %d urls%s" % (path, self._count, "" if clean else ", recounted"))
+
+    def _write_header(self, clean):
+        self.HEADER.pack_into(self._mm, 0, self.MAGIC, len(self._table), self._count, clean)
+
+    def _unmap(self):
+        self._table.release()
+        self._buf.release()
+        self._mm.close()
+        self._file.close()
+
+    def _grow(self):
+        tmp = self.path + ".grow"
+        f = self._create(tmp, 2 * len(self._table))
+        mm = mmap.mmap(f.fileno(), 0)
+        new = memoryview(mm)[self.HEADER.size:].cast("Q")
+        self._rehash(self._table, new)
+        new.release()
+        mm.close()
+        f.close()
+        self._unmap()
+        os.replace(tmp, self.path)
+        self._map(open(self.path, "r+b"))
+        self.logger.info("%s grown to %d slots, %d urls" % (self.path, len(self._table), self._count))
+
+    def flush(self):
+        self._write_header(0)
+        self._mm.flush()
+
+    def close(self):
+        if self._mm is None:
+            return
+        self._write_header(1)
+        self._mm.flush()
+        self._unmap()
+        self._mm = None
+
+
+class SharedFingerprintSet(FingerprintSet):
+    """
+    FingerprintSet in a segment of shared memory, for the worker processes forked by a sharded crawl. Fingerprints are
+    written with aligned 8-byte stores, without any lock : two processes racing for the same empty slot may lose one
+    of the fingerprints, i.e. a url may be crawled twice, the table is never corrupted.
+
+    The table cannot grow, once a probe exceeds max_probe slots the url is reported as new without being stored.
+
+    Key members :
+
+        cross_process : True, the url was added by the process which found it, the owner of the host trusts it
+        close() : unmap the segment in this process
+        unlink() : destroy the segment, called once by the creator
+        len(store) : urls added by this process
+    """
+
+    logger = Log.LogAdapter(_logger, "SharedFingerprintSet")
+
+    cross_process = True
+
+    def __init__(self, capacity=1 << 21, max_load=0.7, name=None, max_probe=128):
+        """
+        :param capacity: int, urls held by the table
+        :param max_load: float, see FingerprintSet, sets the size of the table
+        :param name: str, name of an existing segment to attach to, a new segment is created when None
+        :param max_probe: int, slots probed before giving up on a crowded table
+        """
+        self.max_load = max_load
+        self.max_probe = max_probe
+        self._count = 0
+        self._overflows = 0
+        if name is None:
+            slots = _slots(capacity, max_load)
+            self._shm = shared_memory.SharedMemory(create=True, size=8 * slots)
+            self._shm.buf[:8 * slots] = bytes(8 * slots)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            slots = 1 << ((self._shm.size // 8).bit_length() - 1)
+        self.name = self._shm.name
+        self._set_table(self._shm.buf[:8 * slots].cast("Q"))
+        self._limit = len(self._table)
+
+    def contains_fingerprint(self, fp):
+        table, mask = self._table, self._mask
+        i = fp & mask
+        for _ in range(self.max_probe):
+            slot = table[i]
+            if slot == fp:
+                return True
+            if slot == 0:
+                return False
+            i = (i + 1) & mask
+        return False
+
+    def add_fingerprint(self, fp):
+        table, mask = self._table, self._mask
+        i = fp & mask
+        for _ in range(self.max_probe):
+            slot = table[i]
+            if slot == fp:
+                return False
+            if slot == 0:
+                table[i] = fp
+                self._count += 1
+                return True
+            i = (i + 1) & mask
+        self._overflows += 1
+        if self._overflows == 1:
+            self.logger.warning("shared table %s is full, urls are not deduplicated anymore" % self.name)
+        return True
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._table.release()
+        self._buf.release()
+        self._shm.close()
+        self._shm = None
+
+    def unlink(self):
+        if self._shm is not None:
+            self._shm.unlink()
+            return
+        shm = shared_memory.SharedMemory(name=self.name)
+        shm.close()
+        shm.unlink()
+
+
+def create_dedup_store(name="seen", kind=None):
+    """
+    :param name: str, name of the file of the mmap store under settings.DEDUP_DIR
+    :param kind: str, "set", "table", "bloom" or "mmap", defaults to settings.DEDUP_STORE
+    :return: UrlSet, FingerprintSet, ScalableBloomFilter or MmapFingerprintSet
+    """
+    kind = kind or settings.DEDUP_STORE
+    if kind == "set":
+        return UrlSet()
+    if kind == "table":
+        return FingerprintSet(capacity=settings.DEDUP_CAPACITY)
+    if kind == "bloom":
+        return ScalableBloomFilter(capacity=settings.DEDUP_CAPACITY, error_rate=settings.DEDUP_ERROR_RATE)
+    if kind == "mmap":
+        return MmapFingerprintSet(os.path.join(settings.DEDUP_DIR, name + ".fp"), capacity=settings.DEDUP_CAPACITY)
+    raise ValueError("unknown dedup store %s" % kind)
+
+
+# SimpleEventLoop -> store shared by the spiders of the loop
+_loop_stores = weakref.WeakKeyDictionary()
+
+
+def loop_store(loop, name="seen"):
+    """
+    :param loop: SimpleEventLoop
+    :param name: str, see create_dedup_store, used when the store of the loop is created
+    :return: the store of the urls seen by every spider of the loop, created on first use
+    """
+    if loop is None:
+        return create_dedup_store(name)
+    store = _loop_stores.get(loop)
+    if store is None:
+        store = _loop_stores[loop] = create_dedup_store(name)
+    return store
+
+
+def set_loop_store(loop, store):
+    """
+    :param loop: SimpleEventLoop
+    :param store: the store the spiders of the loop will share, e.g. a SharedFingerprintSet
+    :return: None
+    """
+    _loop_stores[loop] = store
+
+
+def close_loop_store(loop):
+    """
+    Flush and release the store of a loop once the crawl is over, e.g. the file of an mmap store is marked clean
+
+    :param loop: SimpleEventLoop
+    :return: None
+    """
+    store = _loop_stores.pop(loop, None)
+    if store is not None and hasattr(store, "close"):
+        store.close()
@@ -0,0 +1,126 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Crawl strategies of the frontier : the order in which HostScheduler (see core/spiders/scheduler.py) hands crawling
+# jobs (url, max_redirect, depth) over, within the limits of per host politeness :
+#
+#     1. RoundRobinStrategy : eligible hosts are served in turn, jobs of a host first in first out
+#     2. BreadthFirstStrategy : shallowest jobs first, over all the eligible hosts, the default
+#     3. DepthFirstStrategy : deepest and latest jobs first, jobs deeper than max_depth are not admitted
+#     4. BestFirstStrategy : media links first, then pages matching the target url pattern, then the others, shallowest
+#        first within each band
+#
+# The scheduler keeps the jobs of a host in a heap keyed by priority(item) and the eligible hosts in a heap keyed by
+# the priority of their best job, both O(log n). A better job put to an eligible host pushes a new entry of the host,
+# the former one is skipped when it is popped.
+#
+# reference:
+#     1. C. Olston, M. Najork, Web Crawling, Foundations and Trends in Information Retrieval, 2010, section 4
+
+from config import settings
+
+
+class RoundRobinStrategy:
+    """
+    Order of the jobs of a crawl, lower priorities are served first
+
+    Key members :
+
+        priority(item) : Number or tuple, priority of a job
+        admit(item) : bool, the job is worth crawling
+        lifo : bool, jobs of the same priority are served last in first out
+        round_robin : bool, eligible hosts are served in turn, their priorities are not compared
+    """
+
+    name = "round_robin"
+    lifo = False
+    round_robin = True
+
+    def priority(self, item):
+        return 0
+
+    def admit(self, item):
+        return True
+
+
+class BreadthFirstStrategy(RoundRobinStrategy):
+
+    name = "bfs"
+    round_robin = False
+
+    def priority(self, item):
+        return item[2]
+
+
+class DepthFirstStrategy(RoundRobinStrategy):
+
+    name = "dfs"
+    lifo = True
+    round_robin = False
+
+    def __init__(self, max_depth=None):
+        """
+        :param max_depth: int, jobs deeper are dropped, None means no limit
+        """
+        self.max_depth = max_depth
+
+    def priority(self, item):
+        return -item[2]
+
+    def admit(self, item):
+        return self.max_depth is None or item[2] <= self.max_depth
+
+
+class BestFirstStrategy(RoundRobinStrategy):
+
+    name = "best_first"
+    round_robin = False
+
+    def __init__(self, media_types=(), target=None):
+        """
+        :param media_types: Iterable<str>, extensions of the media links served first, e.g. ".jpg"
+        :param target: Pattern, compiled regex of the urls looked for, served right after media links
+        """
+        self.media_types = tuple(ext.lower() for ext in media_types)
+        self.target = target
+
+    def score(self, url):
+        """
+        :param url: str, canonical url
+        :return: int, 0 for media links, 1 for target urls, 2 otherwise
+        """
+        path = url.partition("?")[0].lower()
+        if self.media_types and path.endswith(self.media_types):
+            return 0
+        if self.target is not None and self.target.search(url) is not None:
+            return 1
+        return 2
+
+    def priority(self, item):
+        return self.score(item[0]), item[2]
+
+
+STRATEGIES = {
+    "round_robin": RoundRobinStrategy,
+    "bfs": BreadthFirstStrategy,
+    "dfs": DepthFirstStrategy,
+    "best_first": BestFirstStrategy,
+}
+
+
+def create_strategy(name=None):
+    """
+    :param name: str, one of STRATEGIES, settings.CRAWL_STRATEGY by default
+    :return: RoundRobinStrategy, configured by settings.MAX_DEPTH for "dfs", settings.CRAWL_MEDIA_TYPES and
+    settings.TARGET_URL_REGEX (set from the target_url of spider.conf) for "best_first"
+    """
+    name = name or settings.CRAWL_STRATEGY
+    if name not in STRATEGIES:
+        raise ValueError("unknown crawl strategy %s, expected one of %s" % (name, ", ".join(sorted(STRATEGIES))))
+    if name == "dfs":
+        return DepthFirstStrategy(max_depth=getattr(settings, "MAX_DEPTH", None))
+    if name == "best_first":
+        return BestFirstStrategy(media_types=settings.CRAWL_MEDIA_TYPES,
+                                 target=getattr(settings, "TARGET_URL_REGEX", None))
+    return STRATEGIES[name]()
@@ -0,0 +1,209 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Retries of failed crawling jobs :
+#
+#     1. failures are classified (connection refused or reset, timeout, DNS, protocol, 5xx, 429), programming errors and
+#        other statuses are not retried
+#     2. retried jobs are put back to the scheduler after an exponential backoff with full jitter, the spider task is
+#        free meanwhile (see HostScheduler.put_later), Retry-After is honoured as a lower bound
+#     3. a circuit breaker per host opens after consecutive failures : jobs of the host are held back for a cooldown,
+#        then a single probe is let through (half-open), its success closes the breaker, its failure doubles the cooldown
+#
+# reference:
+#     1. https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+#     2. https://martinfowler.com/bliki/CircuitBreaker.html
+
+import ssl
+import time
+import random
+import socket
+
+import logging
+import utils.Log as Log
+_logger = logging.getLogger("base_spider")
+
+from core.downloader.http_parser import HTTPParseError
+
+
+def classify(error=None, status=None):
+    """
+    :param error: Exception, failure of the request
+    :param status: int, status code of the response
+    :return: str, category of a transient failure worth a retry, None otherwise
+    """
+    if error is not None:
+        if isinstance(error, ConnectionRefusedError):
+            return "refused"
+        if isinstance(error, TimeoutError):
+            return "timeout"
+        if isinstance(error, socket.gaierror):
+            return "dns"
+        if isinstance(error, ssl.SSLCertVerificationError):
+            return None
+        if isinstance(error, (ConnectionError, ssl.SSLError)):
+            return "reset"
+        if isinstance(error, HTTPParseError):
+            return "protocol"
+        if isinstance(error, OSError):
+            return "network"
+        return None
+    if status is not None:
+        if status == 429:
+            return "throttled"
+        if status == 408:
+            return "timeout"
+        if 500 <= status < 600 and status != 501:
+            return "server_error"
+    return None
+
+
+class RetryPolicy:
+    """
+    Backoff of the retries of the urls of a crawl
+
+    Key members :
+
+        next_delay(url, category, retry_after) : seconds to wait before the next attempt, None when the url exhausted
+        its retries
+        forget(url) : the url succeeded
+        stats : Map<str, int>, retries and give-ups, failures per category
+    """
+
+    logger = Log.LogAdapter(_logger, "RetryPolicy")
+
+    def __init__(self, max_retries=3, base_delay=1., max_delay=60., rand=random.random):
+        """
+        :param max_retries: int, retries of a url after its first attempt
+        :param base_delay: Number, seconds of the first backoff
+        :param max_delay: Number, upper bound of a backoff
+        :param rand: Func() -> float in [0, 1), source of the jitter
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rand = rand
+        # url -> retries done
+        self._attempts = {}
+        self.stats = {"retried": 0, "gave_up": 0, "failures": {}}
+
+    def next_delay(self, url, category, retry_after=None):
+        """
+        :param url: str, url of the failed job
+        :param category: str, see classify
+        :param retry_after: Number, seconds asked by the host
+        :return: Number or None
+        """
+        failures = self.stats["failures"]
+        failures[category] = failures.get(category, 0) + 1
+        attempt = self._attempts.get(url, 0)
+        if attempt >= self.max_retries:
+            self._attempts.pop(url, None)
+            self.stats["gave_up"] += 1
+            self.logger.info("giving %s up after %d retries (%s)" % (url, attempt, category))
+            return None
+        self._attempts[url] = attempt + 1
+        self.stats["retried"] += 1
+        # full jitter : retries of a burst of failures spread over the whole backoff
+        delay = self._rand() * min(self.max_delay, self.base_delay * 2 ** attempt)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def forget(self, url):
+        self._attempts.pop(url, None)
+
+
+class BreakerState:
+
+    def __init__(self, cooldown):
+        self.state = "closed"
+        self.failures = 0
+        self.open_until = 0.
+        self.cooldown = cooldown
+
+
+class CircuitBreaker:
+    """
+    Circuit breakers of the hosts of a crawl
+
+    Key members :
+
+        on_failure(host) : account a failure, returns the time until which the host is held back when the breaker opens
+        on_success(host) : close the breaker of the host
+        is_half_open(host) : the cooldown is over, a single probe is allowed
+        state(host) : "closed", "open" or "half-open"
+        stats : Map<str, int>, breakers opened and closed
+    """
+
+    logger = Log.LogAdapter(_logger, "CircuitBreaker")
+
+    def __init__(self, threshold=5, cooldown=30., max_cooldown=600., clock=None):
+        """
+        :param threshold: int, consecutive failures opening the breaker
+        :param cooldown: Number, seconds the host is held back the first time
+        :param max_cooldown: Number, upper bound of the cooldown, doubled by every failed probe
+        :param clock: Func() -> Number, e.g. loop.time
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._clock = clock or time.monotonic
+        # host -> BreakerState
+        self._hosts = {}
+        self.stats = {"opened": 0, "closed": 0}
+
+    def _get(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = BreakerState(self.cooldown)
+        return state
+
+    def state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            return "closed"
+        if state.state == "open" and self._clock() >= state.open_until:
+            state.state = "half-open"
+        return state.state
+
+    def is_half_open(self, host):
+        return self.state(host) == "half-open"
+
+    def _open(self, host, state, reason):
+        state.state = "open"
+        state.open_until = self._clock() + state.cooldown
+        self.stats["opened"] += 1
+        self.logger.info("breaker of %s opened for %.1fs (%s)" % (host, state.cooldown, reason))
+        return state.open_until
+
+    def on_failure(self, host):
+        """
+        :param host: str, hostname
+        :return: Number, loop time until which the host is held back when the breaker opens, None otherwise
+        """
+        state = self._get(host)
+        current = self.state(host)
+        if current == "half-open":
+            # the probe failed
+            state.cooldown = min(self.max_cooldown, state.cooldown * 2)
+            return self._open(host, state, "probe failed")
+        if current == "open":
+            # a request sent before the breaker opened
+            return None
+        state.failures += 1
+        if state.failures >= self.threshold:
+            return self._open(host, state, "%d consecutive failures" % state.failures)
+        return None
+
+    def on_success(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            return
+        if state.state != "closed":
+            self.stats["closed"] += 1
+            self.logger.info("breaker of %s closed" % host)
+        state.state = "closed"
+        state.failures = 0
+        state.cooldown = self.cooldown
@@ -0,0 +1,517 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Host aware scheduling of crawling jobs : a drop-in replacement of Queue which keeps the jobs of each host in a heap
+# ordered by a crawl strategy (see core/spiders/frontier.py) and only hands a job over when its host is allowed another
+# request,
+#
+#     1. interval : seconds between two requests started to the same host (settings.CRAWL_INTERVAL)
+#     2. max_per_host : jobs of a host being processed at the same time (settings.HOST_MAX_CONNECTIONS)
+#
+# Eligible hosts are served by the priority of their best job, round robin among equals (or always with
+# RoundRobinStrategy), so that a worker never idles behind a throttled host while jobs of other hosts are waiting, and
+# a host with a large backlog does not starve the others.
+#
+# With an AIMDController (see core/spiders/congestion.py) the concurrency of a host follows its adaptive window, capped
+# by max_per_host, outcomes of the requests are reported with observe().
+#
+# With a CircuitBreaker and a RetryPolicy (see core/spiders/retry.py) failing hosts are held back for a cooldown and
+# failed jobs are put back after a backoff with retry(), without holding a spider task.
+
+import heapq
+from collections import deque
+
+import logging
+import utils.Log as Log
+_logger = logging.getLogger("base_spider")
+
+from core.downloader.handlers.async_socket_http11 import Future, QueueFull, QueueEmpty
+from core.spiders.canonical import host_of
+from core.spiders.congestion import AIMDController
+from core.spiders.retry import classify, RetryPolicy, CircuitBreaker
+from core.spiders.frontier import RoundRobinStrategy, create_strategy
+from config import settings
+
+
+class HostState:
+    """
+    Jobs and politeness state of a host
+
+    Key members :
+
+        jobs : heap of (priority, order, enqueued at, job), see HostScheduler._enqueue
+        active : int, jobs handed over and not done yet
+        next_start : Number, loop time before which no job of the host is handed over
+        stats : Map<str, Number>, counters of queued and dispatched jobs, total and maximum of the waiting time, number
+        of times the host was delayed by its interval or its concurrency cap, paused by a Retry-After or held back by its
+        circuit breaker
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.jobs = []
+        self.active = 0
+        self.next_start = 0.
+        # the host is in the ready heap or the delayed heap of the scheduler
+        self.scheduled = False
+        # (priority, seq) of its live entry in the ready heap, older entries are skipped
+        self.ready_key = None
+        self.stats = {"queued": 0, "dispatched": 0, "wait": 0., "max_wait": 0., "delayed": 0, "capped": 0,
+                      "paused": 0, "broken": 0}
+
+    def head(self, lifo=False):
+        """
+        :param lifo: bool, the order of the job is part of its key, latest jobs first over all the hosts
+        :return: key of the next job of the host
+        """
+        return self.jobs[0][:2] if lifo else self.jobs[0][0]
+
+
+class HostScheduler:
+    """
+    A jobs queue whose get() respects per host politeness, with the interface of Queue
+
+    Key members :
+      put_nowait(item), put(item) : enqueue a job (url, max_redirect, depth), jobs not admitted by the strategy are
+      dropped
+      offer(item) : enqueue a job, when the frontier is full the job waits in arrival order until a job is dispatched
+      get_nowait(), get() : dequeue the best job of the best eligible host, `get` is a coroutine waiting until a host is
+      eligible, raise QueueEmpty for `get_nowait`
+      task_done(item) : the job is processed, its host may be served again
+      observe(url, latency, status, error, retry_after) : outcome of the request of a job, feeds the controller and the
+      breaker
+      retry(item, status, error, retry_after) : put a failed job back after a backoff, False when it is not retried
+      connections(item) : requests the job being processed may run at the same time to its host, e.g. the ranges of a
+      segmented download
+      put_later(item, delay) : enqueue a job once the delay elapsed, join() waits for it
+      join() : a coroutine waiting until every job put has been processed
+      is_idle() : no job is waiting or being processed
+      host_stats(host), fairness() : per host metrics, see HostState.stats and Jain's fairness index
+    """
+
+    logger = Log.LogAdapter(_logger, "HostScheduler")
+
+    def __init__(self, maxsize=0, *, loop=None, interval=0, max_per_host=0, controller=None, max_pause=300,
+                 breaker=None, retry_policy=None, strategy=None):
+        """
+        :param maxsize: int, maximum of waiting jobs over all hosts, 0 means no limit, jobs offered beyond it wait in an
+        overflow FIFO
+        :param loop: SimpleEventLoop
+        :param interval: Number, minimum of seconds between two jobs of the same host, <= 0 means no interval
+        :param max_per_host: int, maximum of jobs of a host processed at the same time, <= 0 means no limit
+        :param controller: AIMDController, adaptive windows of the hosts, None keeps max_per_host only
+        :param max_pause: Number, upper bound of the pause requested by a Retry-After
+        :param breaker: CircuitBreaker, holds failing hosts back, None never holds a host back
+        :param retry_policy: RetryPolicy, backoff of the failed jobs, None never retries
+        :param strategy: RoundRobinStrategy or a subclass, order of the jobs, round robin and first in first out by
+        default
+        """
+        self._maxsize = maxsize
+        self._loop = loop
+        self.interval = max(0, interval or 0)
+        self.max_per_host = max(0, max_per_host or 0)
+        self.controller = controller
+        self.max_pause = max_pause
+        self.breaker = breaker
+        self.retry_policy = retry_policy
+        self.strategy = strategy or RoundRobinStrategy()
+        self.rejected = 0
+        # host -> HostState
+        self._hosts = {}
+        # heap of (priority, seq, host) of hosts having jobs and allowed to start one now, equal priorities are served
+        # in the order the hosts got ready, i.e. round robin
+        self._ready = []
+        # heap of (next_start, seq, host) of hosts waiting for their interval
+        self._delayed = []
+        self._seq = 0
+        self._timer = None
+        self._timer_at = None
+        self._size = 0
+        self._getters = deque()
+        self._putters = deque()
+        self._joiners = []
+        self._unfinished_tasks = 0
+        # timers of the jobs put with put_later
+        self._later = set()
+        # jobs offered while the frontier was full, moved in as jobs are dispatched
+        self._overflow = deque()
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def qsize(self):
+        return self._size
+
+    def empty(self):
+        return self._size == 0
+
+    def full(self):
+        return 0 < self._maxsize <= self._size
+
+    def is_idle(self):
+        return self._unfinished_tasks == 0
+
+    @staticmethod
+    def host_of(item):
+        return host_of(item[0])
+
+    # scheduling
+
+    def _wakeup_next(self, waiters):
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_ret(None)
+                break
+
+    def _cap(self, state):
+        cap = self.max_per_host
+        if self.controller is not None:
+            window = self.controller.limit(state.host)
+            cap = min(cap, window) if cap > 0 else window
+        if self.breaker is not None and self.breaker.is_half_open(state.host):
+            # a single probe after the cooldown
+            cap = 1
+        return cap
+
+    def _schedule(self, state):
+        """
+        Put a host back in the ready ring or the delayed heap when it may start a job, capped hosts are scheduled again
+        by task_done
+        """
+        if state.scheduled or not state.jobs:
+            return
+        if 0 < self._cap(state) <= state.active:
+            state.stats["capped"] += 1
+            return
+        state.scheduled = True
+        if state.next_start <= self._loop.time():
+            self._push_ready(state)
+        else:
+            state.stats["delayed"] += 1
+            self._seq += 1
+            heapq.heappush(self._delayed, (state.next_start, self._seq, state))
+            self._arm_timer()
+
+    def _push_ready(self, state):
+        self._seq += 1
+        priority = 0 if self.strategy.round_robin else state.head(self.strategy.lifo)
+        state.ready_key = (priority, self._seq)
+        heapq.heappush(self._ready, (priority, self._seq, state))
+        self._wakeup_next(self._getters)
+
+    def _arm_timer(self):
+        if not self._delayed:
+            return
+        deadline = self._delayed[0][0]
+        if self._timer is not None:
+            if self._timer_at <= deadline:
+                return
+            self._timer.cancel()
+        self._timer_at = deadline
+        self._timer = self._loop.call_later(max(0, deadline - self._loop.time()), self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._promote()
+        self._arm_timer()
+
+    def _promote(self):
+        now = self._loop.time()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, state = heapq.heappop(self._delayed)
+            self._push_ready(state)
+
+    # Queue interface
+
+    def _enqueue(self, item):
+        host = self.host_of(item)
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = HostState(host)
+        self._seq += 1
+        # seq breaks ties, first in first out, or last in first out for depth first crawls
+        order = -self._seq if self.strategy.lifo else self._seq
+        heapq.heappush(state.jobs, (self.strategy.priority(item), order, self._loop.time(), item))
+        state.stats["queued"] += 1
+        self._size += 1
+        if state.ready_key is not None and not self.strategy.round_robin and \
+                state.head(self.strategy.lifo) < state.ready_key[0]:
+            # a better job moves the ready host up, its former entry gets stale
+            self._push_ready(state)
+        else:
+            self._schedule(state)
+
+    def put_nowait(self, item):
+        if self.full():
+            raise QueueFull()
+        if not self.strategy.admit(item):
+            self.rejected += 1
+            return
+        self._unfinished_tasks += 1
+        self._enqueue(item)
+
+    def offer(self, item):
+        """
+        :param item: Tuple, the job, it is never lost : a full frontier keeps it aside until there is room, join() waits
+        for it
+        :return: None
+        """
+        if not self.full():
+            self.put_nowait(item)
+            return
+        if not self.strategy.admit(item):
+            self.rejected += 1
+            return
+        self._unfinished_tasks += 1
+        self._overflow.append(item)
+
+    def _refill(self):
+        while self._overflow and not self.full():
+            self._enqueue(self._overflow.popleft())
+
+    def put_later(self, item, delay):
+        """
+        :param item: Tuple, the job
+        :param delay: Number, seconds before the job is enqueued, maxsize is not enforced for it
+        :return: None
+        """
+        # counted at once so that join() does not return while the job is pending
+        self._unfinished_tasks += 1
+
+        def _put():
+            self._later.discard(handle)
+            self._enqueue(item)
+
+        handle = self._loop.call_later(max(0, delay), _put)
+        self._later.add(handle)
+
+    def put(self, item):
+        while self.full():
+            putter = Future(loop=self._loop)
+            self._putters.append(putter)
+            yield from putter
+        self.put_nowait(item)
+
+    def get_nowait(self):
+        self._promote()
+        now = self._loop.time()
+        while self._ready:
+            priority, seq, state = heapq.heappop(self._ready)
+            if state.ready_key != (priority, seq):
+                continue
+            state.ready_key = None
+            state.scheduled = False
+            if state.next_start > now or 0 < self._cap(state) <= state.active:
+                # paused by a Retry-After or window shrunk since the host got ready
+                self._schedule(state)
+                continue
+            return self._dispatch(state, now)
+        raise QueueEmpty()
+
+    def _dispatch(self, state, now):
+        _, _, enqueued_at, item = heapq.heappop(state.jobs)
+        state.active += 1
+        state.next_start = now + self.interval
+        wait = now - enqueued_at
+        state.stats["dispatched"] += 1
+        state.stats["wait"] += wait
+        state.stats["max_wait"] = max(state.stats["max_wait"], wait)
+        self._size -= 1
+        self._schedule(state)
+        self._refill()
+        self._wakeup_next(self._putters)
+        return item
+
+    def get(self):
+        while True:
+            try:
+                return self.get_nowait()
+            except QueueEmpty:
+                pass
+            getter = Future(loop=self._loop)
+            self._getters.append(getter)
+            yield from getter
+
+    def task_done(self, item=None):
+        """
+        :param item: Tuple, the job returned by get, None only frees the join() counter (the host slot stays taken)
+        """
+        if self._unfinished_tasks <= 0:
+            raise ValueError('task_done() called too many times')
+        if item is not None:
+            state = self._hosts.get(self.host_of(item))
+            if state is not None and state.active > 0:
+                state.active -= 1
+                self._schedule(state)
+        self._unfinished_tasks -= 1
+        if self._unfinished_tasks == 0:
+            joiners, self._joiners = self._joiners, []
+            for joiner in joiners:
+                joiner.set_ret(None)
+
+    def connections(self, item):
+        """
+        :param item: Tuple, a job returned by get and not done yet
+        :return: int, share of the cap of its host left to the job, at least 1, 0 means no limit
+        """
+        state = self._hosts.get(self.host_of(item))
+        if state is None:
+            return self.max_per_host
+        cap = self._cap(state)
+        if cap <= 0:
+            return 0
+        # the job holds one of the active slots already
+        return max(1, cap - state.active + 1)
+
+    def join(self):
+        if self._unfinished_tasks > 0:
+            joiner = Future(loop=self._loop)
+            self._joiners.append(joiner)
+            yield from joiner
+
+    def observe(self, url, latency, status=None, error=None, retry_after=None):
+        """
+        :param url: str, url of the job returned by get
+        :param latency: Number, seconds spent on the request
+        :param status: int, status code of the response, None when the request failed
+        :param error: Exception, failure of the request
+        :param retry_after: Number, seconds the host asked us to wait (Retry-After)
+        :return: None
+        """
+        host = self.host_of((url,))
+        state = self._hosts.get(host)
+        if self.controller is not None:
+            if error is not None:
+                self.controller.on_error(host, latency, error)
+            elif status is not None:
+                self.controller.on_response(host, latency, status)
+        category = classify(error, status)
+        if category is None and error is None and self.retry_policy is not None:
+            self.retry_policy.forget(url)
+        open_until = None
+        if self.breaker is not None:
+            if category is None:
+                # the host answered, even a 404 tells it is alive
+                if error is None:
+                    self.breaker.on_success(host)
+            elif category != "throttled":
+                # throttling is left to the controller and Retry-After
+                open_until = self.breaker.on_failure(host)
+        if state is None:
+            return
+        if retry_after is not None and retry_after > 0:
+            pause = min(retry_after, self.max_pause)
+            state.next_start = max(state.next_start, self._loop.time() + pause)
+            state.stats["paused"] += 1
+            self.logger.info("%s asked to retry after %ss, paused for %.1fs" % (host, retry_after, pause))
+        if open_until is not None:
+            state.next_start = max(state.next_start, open_until)
+            state.stats["broken"] += 1
+        # the window may have grown
+        self._schedule(state)
+
+    def retry(self, item, status=None, error=None, retry_after=None):
+        """
+        :param item: Tuple, the job returned by get, it is put back after a backoff
+        :param status: int, status code of the response
+        :param error: Exception, failure of the request
+        :param retry_after: Number, seconds the host asked us to wait
+        :return: bool, the job will be retried, the caller still calls task_done(item)
+        """
+        if self.retry_policy is None:
+            return False
+        category = classify(error, status)
+        if category is None:
+            return False
+        delay = self.retry_policy.next_delay(item[0], category, retry_after)
+        if delay is None:
+            return False
+        self.logger.debug("retrying %s in %.2fs (%s)" % (item[0], delay, category))
+        self.put_later(item, delay)
+        return True
+
+    # metrics
+
+    def host_stats(self, host):
+        state = self._hosts.get(host)
+        return dict(state.stats, pending=len(state.jobs), active=state.active) if state is not None else None
+
+    def fairness(self):
+        """
+        :return: float, Jain's fairness index of the jobs dispatched per host, 1. when every host got the same share
+        """
+        counts = [state.stats["dispatched"] for state in self._hosts.values() if state.stats["dispatched"] > 0]
+        if not counts:
+            return 1.
+        return sum(counts) ** 2 / (len(counts) * sum(c * c for c in counts))
+
+    def report(self):
+        """
+        :return: str, one line per host, busiest hosts first
+        """
+        lines = ["%d hosts, fairness %.3f, strategy %s" % (len(self._hosts), self.fairness(), self.strategy.name)]
+        if self.rejected:
+            lines.append("rejected %d jobs beyond the strategy limits" % self.rejected)
+        if self._overflow:
+            lines.append("%d jobs waiting for room in the frontier" % len(self._overflow))
+        if self.retry_policy is not None:
+            stats = self.retry_policy.stats
+            lines.append("retried %d, gave up %d, failures %s" % (
+                stats["retried"], stats["gave_up"],
+                ", ".join("%s %d" % item for item in sorted(stats["failures"].items())) or "none"))
+        if self.breaker is not None:
+            lines.append("breakers opened %d, closed %d" % (self.breaker.stats["opened"], self.breaker.stats["closed"]))
+        for state in sorted(self._hosts.values(), key=lambda s: -s.stats["dispatched"]):
+            stats = state.stats
+            line = ("%s : dispatched %d/%d, mean wait %.3fs, max wait %.3fs, delayed %d, capped %d, paused %d, "
+                    "broken %d") % (
+                state.host, stats["dispatched"], stats["queued"],
+                stats["wait"] / stats["dispatched"] if stats["dispatched"] else 0., stats["max_wait"],
+                stats["delayed"], stats["capped"], stats["paused"], stats["broken"])
+            if self.breaker is not None and self.breaker.state(state.host) != "closed":
+                line += ", breaker %s" % self.breaker.state(state.host)
+            window = self.controller.host_stats(state.host) if self.controller is not None else None
+            if window is not None:
+                line += ", window %.1f, latency %.3fs, timeouts %d, throttled %d, errors %d" % (
+                    window["window"], window["latency"] or 0., window["timeouts"], window["throttled"],
+                    window["errors"])
+            lines.append(line)
+        return "\n".join(lines)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for handle in self._later:
+            handle.cancel()
+        self._later.clear()
+
+
+def create_queue(loop, maxsize=None):
+    """
+    :param loop: SimpleEventLoop
+    :param maxsize: int, maximum of jobs in the frontier, settings.FRONTIER_MAXSIZE by default
+    :return: HostScheduler, configured by settings.CRAWL_INTERVAL, settings.HOST_MAX_CONNECTIONS, the AIMD, retry and
+    breaker settings, ordered by settings.CRAWL_STRATEGY
+    """
+    controller = None
+    if settings.ADAPTIVE_CONCURRENCY:
+        controller = AIMDController(initial_window=settings.AIMD_INITIAL_WINDOW,
+                                    max_window=settings.HOST_MAX_CONNECTIONS or 64,
+                                    decrease=settings.AIMD_DECREASE, latency_factor=settings.AIMD_LATENCY_FACTOR,
+                                    clock=loop.time)
+    maxsize = settings.FRONTIER_MAXSIZE if maxsize is None else maxsize
+    return HostScheduler(maxsize=maxsize, loop=loop, interval=settings.CRAWL_INTERVAL,
+                         max_per_host=settings.HOST_MAX_CONNECTIONS, controller=controller,
+                         max_pause=settings.RETRY_AFTER_MAX,
+                         breaker=CircuitBreaker(threshold=settings.BREAKER_THRESHOLD,
+                                                cooldown=settings.BREAKER_COOLDOWN,
+                                                max_cooldown=settings.BREAKER_MAX_COOLDOWN,
+                                                clock=loop.time) if settings.BREAKER_THRESHOLD > 0 else None,
+                         retry_policy=RetryPolicy(max_retries=settings.RETRY_MAX,
+                                                  base_delay=settings.RETRY_BASE_DELAY,
+                                                  max_delay=settings.RETRY_MAX_DELAY) if settings.RETRY_MAX > 0 else None,
+                         strategy=create_strategy())
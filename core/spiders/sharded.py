@@ -0,0 +1,303 @@
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+#
+# Multi-process sharded crawling : every worker process runs its own SimpleEventLoop and spiders, urls are assigned to
+# workers by a hash of their host. Links of foreign hosts are handed over through pipes watched by the loops.
+#
+# Termination is detected by the parent process with message counting : a worker reports ("idle", sent, received)
+# whenever its queue is drained and ("active",) when a routed link wakes it up. The crawl is over once every worker is
+# idle and every routed link has been received.
+
+import os
+import json
+import zlib
+import select
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import deque
+
+import logging
+import utils.Log as Log
+_logger = logging.getLogger("base_spider")
+
+from core.downloader.handlers.async_socket_http11 import Future, Task, SimpleEventLoop, urlparse
+from core.spiders.scheduler import create_queue
+from core.spiders.dedup import SharedFingerprintSet, loop_store, set_loop_store, close_loop_store
+from config import settings
+
+
+def shard_of(url, n_shards):
+    """
+    :param url: str, parsed url
+    :param n_shards: int, number of workers
+    :return: int, the worker owning the host of the url. crc32 is used because `hash` is salted per process
+    """
+    parsed = urlparse(url)
+    host = "%s:%s" % ((parsed.hostname or "").lower(), parsed.port or "")
+    return zlib.crc32(host.encode("utf-8")) % n_shards
+
+
+class ShardRouter:
+    """
+    Exchange of cross-shard crawling jobs for one worker process
+
+    Each worker owns an inbox pipe, peers write newline delimited json messages into it. Messages are kept under
+    PIPE_BUF so that writes of concurrent peers never interleave.
+
+    Key members :
+
+        owns(url) : whether the url belongs to this worker
+        dispatch(data) : send a crawling job to the worker owning its host
+        report_idle() : tell the parent process that the local queue is drained
+        wait_activity() : a coroutine resolved when a routed job arrives or the parent asks to stop
+    """
+
+    logger = Log.LogAdapter(_logger, "ShardRouter")
+
+    def __init__(self, shard_id, n_shards, inbox_fd, outbox_fds, ctrl, loop=None):
+        """
+        :param shard_id: int, index of this worker
+        :param n_shards: int, number of workers
+        :param inbox_fd: int, read end of the pipe of this worker
+        :param outbox_fds: Map<int, int>, write ends of the pipes of peers
+        :param ctrl: multiprocessing.connection.Connection, control channel to the parent process
+        :param loop: SimpleEventLoop
+        """
+        self.shard_id = shard_id
+        self.n_shards = n_shards
+        self._inbox = inbox_fd
+        self._outbox = outbox_fds
+        self._pending = dict((peer, deque()) for peer in outbox_fds)
+        self._ctrl = ctrl
+        self._loop = loop
+        self._rbuf = b""
+        self._idle = False
+        self._activity = None
+        self._on_received = None
+        self.stopped = False
+        self.sent = 0
+        self.received = 0
+
+    def start(self, on_received):
+        """
+        :param on_received: Func(data : Tuple), called for every crawling job routed to this worker
+        :return: None
+        """
+        self._on_received = on_received
+        os.set_blocking(self._inbox, False)
+        for fd in self._outbox.values():
+            os.set_blocking(fd, False)
+        self._loop.add_reader(self._inbox, self._on_inbox)
+        self._loop.add_reader(self._ctrl.fileno(), self._on_ctrl)
+
+    def close(self):
+        for fd in [self._inbox] + list(self._outbox.values()):
+            self._loop.remove_fd(fd)
+            os.close(fd)
+        self._loop.remove_fd(self._ctrl.fileno())
+
+    def owns(self, url):
+        return shard_of(url, self.n_shards) == self.shard_id
+
+    def dispatch(self, data):
+        """
+        :param data: Tuple(str, int, int), url, max_redirect and depth of a crawling job
+        :return: None
+        """
+        msg = json.dumps(list(data)).encode("utf-8") + b"\n"
+        if len(msg) > select.PIPE_BUF:
+            self.logger.warning("url %s is too long to be routed, dropped" % data[0])
+            return
+        peer = shard_of(data[0], self.n_shards)
+        self._pending[peer].append(msg)
+        self.sent += 1
+        if len(self._pending[peer]) == 1:
+            self._flush(peer)
+
+    def _flush(self, peer):
+        fd = self._outbox[peer]
+        pending = self._pending[peer]
+        while pending:
+            try:
+                # writes under PIPE_BUF are atomic : either the whole message is written or EAGAIN is raised
+                os.write(fd, pending[0])
+            except BlockingIOError:
+                self._loop.add_writer(fd, lambda: self._flush(peer))
+                return
+            pending.popleft()
+        self._loop.remove_writer(fd)
+
+    def _on_inbox(self):
+        try:
+            data = os.read(self._inbox, 65536)
+        except BlockingIOError:
+            return
+        if not data:
+            self._loop.remove_fd(self._inbox)
+            return
+        lines = (self._rbuf + data).split(b"\n")
+        self._rbuf = lines.pop()
+        if lines and self._idle:
+            self._idle = False
+            self._ctrl.send(("active",))
+        for line in lines:
+            self.received += 1
+            self._on_received(tuple(json.loads(line.decode("utf-8"))))
+        self._wake()
+
+    def _on_ctrl(self):
+        try:
+            msg = self._ctrl.recv()
+        except EOFError:
+            msg = "stop"
+        if msg == "stop":
+            self.stopped = True
+            self._loop.remove_fd(self._ctrl.fileno())
+            self._wake()
+
+    def _wake(self):
+        if self._activity is not None and not self._activity.done():
+            self._activity.set_ret(None)
+
+    def report_idle(self):
+        self._idle = True
+        self._ctrl.send(("idle", self.sent, self.received))
+
+    def wait_activity(self):
+        self._activity = Future(loop=self._loop)
+        yield from self._activity
+
+
+def _worker_main(shard_id, n_shards, pipes, ctrl, seeds, make_spiders, concurrency, shared_store=None):
+    """
+    Entry of a worker process, see run_sharded
+    """
+    logger = Log.LogAdapter(_logger, "shard %d" % shard_id)
+    inbox_fd = pipes[shard_id][0]
+    outbox_fds = {}
+    for peer, (r, w) in enumerate(pipes):
+        if peer != shard_id:
+            os.close(r)
+            outbox_fds[peer] = w
+        else:
+            os.close(w)
+
+    loop = SimpleEventLoop()
+    loop.set_timeout(settings.TIME_OUT)
+    q = create_queue(loop)
+    if shared_store is not None:
+        # inherited through fork, the mapping of the segment is shared with the other workers
+        set_loop_store(loop, shared_store)
+    else:
+        loop_store(loop, name="seen-shard%d" % shard_id)
+    router = ShardRouter(shard_id, n_shards, inbox_fd, outbox_fds, ctrl, loop=loop)
+    spiders = make_spiders(seeds, loop, q)
+    for spider in spiders:
+        spider.router = router
+    router.start(spiders[0].accept_routed)
+
+    def routine():
+        tasks = [Task(spiders[i % len(spiders)]._run(), loop=loop) for i in range(max(concurrency, len(spiders)))]
+        while not router.stopped:
+            yield from q.join()
+            if not q.is_idle():
+                continue
+            router.report_idle()
+            if q.is_idle() and not router.stopped:
+                yield from router.wait_activity()
+        for t in tasks:
+            t.cancel()
+
+    logger.info("start crawling %d seeds" % len(seeds))
+    try:
+        loop.run_until_complete(routine())
+    finally:
+        logger.info("routed links sent %d, received %d" % (router.sent, router.received))
+        logger.info("hosts scheduling : %s" % q.report())
+        q.close()
+        close_loop_store(loop)
+        router.close()
+        ctrl.close()
+
+
+def run_sharded(n_workers, seeds, make_spiders, concurrency=1):
+    """
+    Fork n_workers processes, each one crawling the hosts it owns on its own SimpleEventLoop
+
+    :param n_workers: int, number of worker processes
+    :param seeds: List<str>, root urls, dispatched to the workers owning their hosts
+    :param make_spiders: Func(seeds : List<str>, loop : SimpleEventLoop, queue : HostScheduler) -> List<BaseAsyncSpider>,
+        executed inside the worker, must return at least one spider even when the worker has no seed
+    :param concurrency: int, number of crawling tasks per worker
+    :return: None
+    """
+    logger = Log.LogAdapter(_logger, "run_sharded")
+    ctx = multiprocessing.get_context("fork")
+
+    seeds_by_shard = [[] for _ in range(n_workers)]
+    for url in seeds:
+        seeds_by_shard[shard_of(url, n_workers)].append(url)
+
+    shared_store = None
+    if settings.DEDUP_SHARED and n_workers > 1:
+        shared_store = SharedFingerprintSet(capacity=settings.DEDUP_SHARED_CAPACITY)
+        logger.info("urls deduplicated across workers in shared memory %s, %d MB" % (
+            shared_store.name, shared_store.nbytes() // 2 ** 20))
+
+    pipes = [os.pipe() for _ in range(n_workers)]
+    conns = []
+    procs = []
+    for shard_id in range(n_workers):
+        parent_conn, child_conn = ctx.Pipe()
+        proc = ctx.Process(target=_worker_main, name="shard-%d" % shard_id,
+                           args=(shard_id, n_workers, pipes, child_conn, seeds_by_shard[shard_id],
+                                 make_spiders, concurrency, shared_store))
+        proc.start()
+        child_conn.close()
+        conns.append(parent_conn)
+        procs.append(proc)
+    for r, w in pipes:
+        os.close(r)
+        os.close(w)
+
+    # shard_id -> latest ("idle", sent, received) or ("active",)
+    status = {}
+    alive = dict((conn, shard_id) for shard_id, conn in enumerate(conns))
+    stopping = False
+
+    def stop_all():
+        for conn in alive:
+            try:
+                conn.send("stop")
+            except (BrokenPipeError, OSError):
+                pass
+
+    while alive:
+        for conn in wait(list(alive)):
+            shard_id = alive[conn]
+            try:
+                status[shard_id] = conn.recv()
+            except EOFError:
+                del alive[conn]
+                if not stopping:
+                    # a dead worker cannot receive its links anymore, stop the others
+                    logger.error("shard %d exited before the crawl is over" % shard_id)
+                    stopping = True
+                    stop_all()
+
+        if stopping or len(status) < n_workers:
+            continue
+        if all(st[0] == "idle" for st in status.values()):
+            sent = sum(st[1] for st in status.values())
+            received = sum(st[2] for st in status.values())
+            if sent == received:
+                logger.info("all shards are idle, %d links routed" % sent)
+                stopping = True
+                stop_all()
+
+    for proc in procs:
+        proc.join()
+    if shared_store is not None:
+        shared_store.close()
+        shared_store.unlink()
@@ -39,8 +39,13 @@ from lxml import etree
 
 
 ## customer libraries
-from core.downloader.handlers.async_socket_http11 import Task, SimpleEventLoop, Queue
+from core.downloader.handlers.async_socket_http11 import Task, SimpleEventLoop
 from core.spiders.base_spider import BaseAsyncSpider
+from core.spiders.sharded import run_sharded
+from core.spiders.scheduler import create_queue
+from core.spiders.dedup import close_loop_store
+from core.spiders.canonical import resolve, resolve_all
+from core.spiders.frontier import STRATEGIES
 
 import utils.Log as Log
 _logger = logging.getLogger("spiders")
@@ -100,58 +105,59 @@ class MyAsyncSpider(BaseAsyncSpider):
         to be used.
         """
         # import pdb; pdb.set_trace()
-        parser = etree.HTMLParser()
-        body = response.body.decode(response.headers.get_content_charset() or "utf-8")
-        tree = etree.parse(StringIO(body), parser=parser)
-        if DEBUG_ETREE:
-            if etree.tostring(tree) is None:
-                raise Exception("Bad Values!")
-
-        urls = []
         hostname = self.cur_addr.hostname
+        media_rules = []
+        link_rules = []
+        if hostname == "konachan.net":
+            media_rules.extend(self.Rules_for_images_media_type)
+            link_rules.extend(self.Rules_linked_websites)
+        link_rules.extend(self.Rules_your_general_rule)
 
-        # process relative path
-        def _process_extracted_path(path):
-            parsed = urlparse(path)
-            hostname = self.cur_addr.hostname
-            scheme = self.cur_addr.scheme
-            if parsed.hostname is not None and parsed.hostname is not "":
-                hostname = parsed.hostname
-            if parsed.scheme is not None and parsed.scheme is not "":
-                scheme = parsed.scheme
+        # lxml parsing is CPU bound, run it on the loop executor so that sockets keep being served meanwhile
+        urls = yield from self._loop.run_in_executor(None, extract_links, response.body,
+                                                     response.headers.get_content_charset() or "utf-8",
+                                                     self.cur_addr.geturl(), media_rules, link_rules)
 
-            kw = dict(parse_qsl(parsed.query))
-            parsed_path = parsed.path if len(kw) == 0 else "{}?{}".format(parsed.path, urlencode(kw))
+        # @todo TODO dump the parsed urls to files
 
-            url = "%s://%s/%s" % (scheme, hostname, parsed_path[1:])
-            return url
+        return urls
 
-        if hostname == "konachan.net":
-            for rule in self.Rules_for_images_media_type:
-                try:
-                    for path in tree.xpath(rule):
-                        url = _process_extracted_path(path)
-                        yield url
-                        urls.append(url)
-                except Exception as e:
-                    print(e)
-
-            for rule in self.Rules_linked_websites:
-                for path in tree.xpath(rule):
-                    # the value will be sent to outer layer
-                    url = _process_extracted_path(path)
-                    yield url
-                    urls.append(url)
-
-        for rule in self.Rules_your_general_rule:
-            for path in tree.xpath(rule):
-                url = _process_extracted_path(path)
-                yield url
-                urls.append(url)
 
-        # @todo TODO dump the parsed urls to files
+def extract_links(content, charset, base_url, media_rules, link_rules):
+    """
+    Executed by the loop executor, hence arguments are plain picklable values
+
+    :param content: bytes, HTML document
+    :param charset: str, document charset
+    :param base_url: str, url of the document, used to resolve relative paths
+    :param media_rules: List<str>, xpath rules of media links, failures are reported and skipped
+    :param link_rules: List<str>, xpath rules of linked pages
+    :return: List<str>, extracted urls in canonical form, see core/spiders/canonical.py
+    """
+    parser = etree.HTMLParser()
+    body = content.decode(charset)
+    tree = etree.parse(StringIO(body), parser=parser)
+    if DEBUG_ETREE:
+        if etree.tostring(tree) is None:
+            raise Exception("Bad Values!")
 
-        return urls
+    paths = []
+    for rule in media_rules:
+        try:
+            paths.extend(tree.xpath(rule))
+        except Exception as e:
+            print(e)
+
+    for rule in link_rules:
+        paths.extend(tree.xpath(rule))
+
+    # relative paths are resolved against <base href> when the document declares one
+    base = tree.xpath("//base/@href")
+    if base:
+        base_url = resolve(base_url, base[0]) or base_url
+    urls = resolve_all(base_url, paths)
+
+    return urls
 
 
 def fetch_imgs_from_root(root_url):
@@ -166,13 +172,14 @@ def fetch_imgs_from_root(root_url):
     spider = MyAsyncSpider(root_url=root_url, max_redirect=3, max_depth=10, loop=loop)
 
     def routine(concurrency):
-        tasks = [Task(spider._run()) for _ in range(concurrency)]
+        tasks = [Task(spider._run(), loop=loop) for _ in range(concurrency)]
 
         yield from spider._q.join()
         for t in tasks:
             t.cancel()
 
     loop.run_until_complete(routine(1000))
+    close_loop_store(loop)
 
 
 def fetch_imgs_from_urls(urls):
@@ -183,7 +190,7 @@ def fetch_imgs_from_urls(urls):
     Log.InitLogFrmConfig(settings.LOGGING)
     loop = SimpleEventLoop()
     loop.set_timeout(settings.TIME_OUT)
-    q = Queue(maxsize=10000)
+    q = create_queue(loop)
 
     def routine(urls):
         tasks = []
@@ -193,7 +200,7 @@ def fetch_imgs_from_urls(urls):
             # configure attributes parsed from spider.conf
 
 
-            task = Task(spider._run())
+            task = Task(spider._run(), loop=loop)
             tasks.append(task)
 
         yield from q.join()
@@ -201,6 +208,25 @@ def fetch_imgs_from_urls(urls):
             t.cancel()
 
     loop.run_until_complete(routine(urls))
+    _logger.info("hosts scheduling : %s" % q.report())
+    q.close()
+    close_loop_store(loop)
+
+
+def fetch_imgs_from_urls_sharded(urls, n_workers):
+    """
+    :param urls: List<str>, a list of parsed urls
+    :param n_workers: int, number of worker processes, each one running its own event loop on the hosts it owns
+    :return: None, produced data and files are processed internally by base crawlers defined in core/spiders/base_spider.py
+    """
+    Log.InitLogFrmConfig(settings.LOGGING)
+
+    def make_spiders(seeds, loop, queue):
+        # a worker without seeds still needs a spider to crawl the links routed to it
+        return [MyAsyncSpider(root_url=url, max_redirect=3, max_depth=settings.MAX_DEPTH, loop=loop, queue=queue)
+                for url in (seeds or [None])]
+
+    run_sharded(n_workers, urls, make_spiders, concurrency=max(1, len(urls)))
 
 
 def shell(raw_args):
@@ -231,7 +257,11 @@ def shell(raw_args):
             max_depth = conf_obj['spider'].get('max_depth', None)
             crawl_interval = conf_obj['spider'].get('crawl_interval', None)
             crawl_timeout = conf_obj['spider'].get('crawl_timeout', None)
+            connect_timeout = conf_obj['spider'].get('connect_timeout', None)
+            first_byte_timeout = conf_obj['spider'].get('first_byte_timeout', None)
             target_url = conf_obj['spider'].get('target_url', None)
+            crawl_strategy = conf_obj['spider'].get('crawl_strategy', None)
+            thread_count = conf_obj['spider'].get('thread_count', None)
 
             def is_valid_fn(fn):
                 if fn is not None and fn is not "":
@@ -309,17 +339,43 @@ def shell(raw_args):
             else:
                 setattr(settings, "crawl_interval".upper(), -1) # no throttling strategy configured
 
+            # total deadline of a page, the connect and first byte deadlines are bounded by it
             crawl_timeout = parse_number(crawl_timeout)
-            if crawl_interval is not None:
+            if crawl_timeout is not None:
                 settings.TIME_OUT = crawl_timeout
 
+            if connect_timeout is not None:
+                connect_timeout = parse_number(connect_timeout)
+                if connect_timeout is not None:
+                    settings.CONNECT_TIMEOUT = connect_timeout
+
+            if first_byte_timeout is not None:
+                first_byte_timeout = parse_number(first_byte_timeout)
+                if first_byte_timeout is not None:
+                    settings.FIRST_BYTE_TIMEOUT = first_byte_timeout
+
             if target_url is not None and target_url is not "":
                 # is a valid regex
                 import re
                 target_url_regex = re.compile(target_url, re.IGNORECASE)
                 setattr(settings, "target_url_regex".upper(), target_url_regex)
 
-            fetch_imgs_from_urls(urls)
+            if crawl_strategy is not None and crawl_strategy != "":
+                if crawl_strategy in STRATEGIES:
+                    settings.CRAWL_STRATEGY = crawl_strategy
+                else:
+                    logging.error("%s is not a crawl strategy, expected one of %s" % (
+                        crawl_strategy, ", ".join(sorted(STRATEGIES))))
+
+            if thread_count is not None:
+                thread_count = parse_number(thread_count)
+                if thread_count is not None and thread_count > 0:
+                    setattr(settings, "thread_count".upper(), thread_count)
+
+            if settings.THREAD_COUNT > 1:
+                fetch_imgs_from_urls_sharded(urls, settings.THREAD_COUNT)
+            else:
+                fetch_imgs_from_urls(urls)
         # older configuration file format, see spider.conf.bak
         elif conf_obj.get('ROOT_URL', None) is not None:
             root_url = conf_obj['ROOT_URL'].get("ROOT_URL".lower(), None)
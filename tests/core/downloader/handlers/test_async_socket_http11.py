@@ -2,7 +2,8 @@
 # Copyright (c) 2017, Lei Wang
 # All rights reserved.
 # Author yiak.wy@gmail.com
-from core.downloader.handlers.async_socket_http11 import async_download, SimpleEventLoop
+from core.downloader.handlers.async_socket_http11 import async_download, SimpleEventLoop, Task, Future, Response, \
+    wait_for, async_urlopen
 import utils.Log as Log
 from config import settings
 
@@ -15,5 +16,208 @@ def test_download_with_asyn_urlopen():
     # assert the existence fo the file
 
 
+def test_sleep_does_not_block_loop():
+    loop = SimpleEventLoop()
+    waken = []
+
+    def sleeper(name, delay):
+        yield from loop.sleep(delay)
+        waken.append(name)
+
+    def routine():
+        Task(sleeper("slow", 0.05), loop=loop)
+        Task(sleeper("fast", 0.01), loop=loop)
+        yield from loop.sleep(0.1)
+
+    start = loop.time()
+    loop.run_until_complete(routine())
+    # both sleepers overlap instead of running one after another
+    assert waken == ["fast", "slow"]
+    assert loop.time() - start < 0.15
+
+
+def test_set_ret_schedules_callbacks_on_ready_queue():
+    loop = SimpleEventLoop()
+    fut = Future(loop=loop)
+    resumed = []
+
+    def waiter():
+        ret = yield from fut
+        resumed.append(ret)
+
+    def routine():
+        Task(waiter(), loop=loop)
+        yield from loop.sleep(0)
+        fut.set_ret(42)
+        # the waiter is resumed by the loop, not inside set_ret
+        assert resumed == []
+        yield from loop.sleep(0.01)
+
+    loop.run_until_complete(routine())
+    assert resumed == [42]
+
+
+def test_fd_stays_registered_across_reads():
+    import socket
+    loop = SimpleEventLoop()
+    rsock, wsock = socket.socketpair()
+    rsock.setblocking(False)
+    chunks = []
+
+    def reader():
+        for i in range(3):
+            fut = Future(loop=loop)
+            loop.add_reader(rsock.fileno(), lambda: fut.done() or fut.set_ret(rsock.recv(16)))
+            wsock.send(b"chunk-%d" % i)
+            chunks.append((yield from fut))
+            loop.remove_reader(rsock.fileno())
+        loop.remove_fd(rsock.fileno())
+
+    loop.run_until_complete(reader())
+    rsock.close()
+    wsock.close()
+    assert chunks == [b"chunk-0", b"chunk-1", b"chunk-2"]
+    assert loop.selector_stats["register"] == 1
+    assert loop.selector_stats["unregister"] == 1
+    assert loop.selector_stats["modify"] == 0
+
+
+def test_run_in_executor_keeps_loop_responsive():
+    import time
+    loop = SimpleEventLoop()
+    ticks = []
+    results = []
+
+    def ticker():
+        for _ in range(5):
+            yield from loop.sleep(0.01)
+            ticks.append(loop.time())
+
+    def routine():
+        Task(ticker(), loop=loop)
+        results.append((yield from loop.run_in_executor(None, time.sleep, 0.1)))
+        try:
+            yield from loop.run_in_executor(None, int, "not a number")
+        except ValueError as e:
+            results.append(e)
+
+    loop.run_until_complete(routine())
+    loop.close()
+    # the ticker kept running while the blocking call was executed on the pool
+    assert len(ticks) == 5
+    assert results[0] is None
+    assert isinstance(results[1], ValueError)
+
+
+def test_response_reads_into_pooled_buffers():
+    import os
+    import socket
+    import threading
+    loop = SimpleEventLoop()
+    rsock, wsock = socket.socketpair()
+    rsock.setblocking(False)
+    body = os.urandom(1024 * 1024)
+    message = b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+    writer = threading.Thread(target=wsock.sendall, args=(message,))
+    writer.start()
+
+    response = Response('GET', "http://localhost/", rsock, loop=loop)
+    loop.run_until_complete(response.read())
+    writer.join()
+    assert response.body == body
+    assert response.is_reusable()
+    # every read went through the same recycled buffer
+    assert loop.buffer_pool.stats["allocated"] == 1
+    assert loop.buffer_pool.stats["reused"] > 0
+    response.close()
+    wsock.close()
+
+
+def test_wait_for_throws_timeout_into_the_waiting_coroutine():
+    loop = SimpleEventLoop()
+    shared = Future(loop=loop)
+    events = []
+
+    def stuck():
+        try:
+            yield from shared
+        finally:
+            events.append("cleaned up")
+
+    def routine():
+        start = loop.time()
+        try:
+            yield from wait_for(stuck(), 0.05, loop, "stuck")
+        except TimeoutError as e:
+            events.append(str(e))
+        assert loop.time() - start >= 0.04
+        assert (yield from wait_for(loop.sleep(0.01, result=42), 1, loop)) == 42
+
+    loop.run_until_complete(routine())
+    loop.close()
+    assert events == ["cleaned up", "stuck"]
+    # the future may be shared with other coroutines, it is left alone
+    assert not shared.done()
+
+
+def test_stalled_hosts_hit_their_deadlines():
+    import socket
+    import threading
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+    closed = []
+
+    def handle(conn, partial):
+        conn.recv(4096)
+        if partial:
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 1000\r\n\r\nhalf")
+        # stall until the client gives up
+        closed.append(conn.recv(4096) == b"")
+        conn.close()
+
+    def serve():
+        for partial in (False, True):
+            conn, _ = listener.accept()
+            threading.Thread(target=handle, args=(conn, partial), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    url = "http://127.0.0.1:%d/" % listener.getsockname()[1]
+    saved = settings.HTTP_CACHE, settings.FIRST_BYTE_TIMEOUT
+    settings.HTTP_CACHE, settings.FIRST_BYTE_TIMEOUT = False, 0.1
+    loop = SimpleEventLoop()
+    errors = []
+
+    def routine():
+        start = loop.time()
+        # no response head within the first byte deadline
+        response = yield from async_urlopen(url, timeout=5, loop=loop)
+        try:
+            yield from response.read()
+        except TimeoutError as e:
+            errors.append((e, loop.time() - start))
+        # the head arrives but the body stalls until the total deadline
+        start = loop.time()
+        response = yield from async_urlopen(url, timeout=0.3, loop=loop)
+        try:
+            yield from response.read()
+        except TimeoutError as e:
+            errors.append((e, loop.time() - start))
+
+    try:
+        loop.run_until_complete(routine())
+    finally:
+        settings.HTTP_CACHE, settings.FIRST_BYTE_TIMEOUT = saved
+        loop.close()
+    assert len(errors) == 2
+    assert 0.09 <= errors[0][1] < 1
+    assert 0.29 <= errors[1][1] < 1
+    listener.close()
+    import time
+    time.sleep(0.1)
+    # the sockets were closed, the remote saw EOF
+    assert closed == [True, True]
+
+
 if __name__ == "__main__":
     test_download_with_asyn_urlopen()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+import os
+import gzip
+import socket
+import ssl
+import shutil
+import tempfile
+import threading
+import subprocess
+
+import pytest
+
+h2 = pytest.importorskip("h2.connection")
+import h2.config
+import h2.events
+
+from core.downloader.handlers.async_socket_http11 import Task, SimpleEventLoop, async_urlopen, Response
+from core.downloader.handlers.async_socket_http2 import HTTP2Response, HTTP2Session
+from core.downloader.http_parser import HTTPParseError
+from config import settings
+
+
+def make_certificate(dirname):
+    cert = os.path.join(dirname, "cert.pem")
+    key = os.path.join(dirname, "key.pem")
+    subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+                           "-days", "1", "-subj", "/CN=localhost",
+                           "-addext", "subjectAltName=DNS:localhost"], stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+def start_server(cert, key, connections):
+    """
+    HTTP/2 server answering /page/<n> with a gzip encoded body, /corrupt/<n> with a body which is not gzip encoded and
+    /status/<n> with a malformed :status, one thread per connection
+
+    :param connections: List, appended with the peer address of every accepted connection
+    :return: int, port
+    """
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    ctx.set_alpn_protocols(["h2"])
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+
+    def handle(conn):
+        tls_conn = ctx.wrap_socket(conn, server_side=True)
+        h2_conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False,
+                                                                              validate_outbound_headers=False))
+        h2_conn.initiate_connection()
+        tls_conn.sendall(h2_conn.data_to_send())
+        while True:
+            data = tls_conn.recv(65536)
+            if not data:
+                break
+            for event in h2_conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    path = dict(event.headers)[b":path"]
+                    body = gzip.compress(b"page " + path * 1000)
+                    status = "200"
+                    if path.startswith(b"/corrupt/"):
+                        body = b"not gzip " * 100
+                    elif path.startswith(b"/status/"):
+                        status = "2xx"
+                    h2_conn.send_headers(event.stream_id, [(":status", status), ("content-encoding", "gzip"),
+                                                           ("content-length", str(len(body)))])
+                    h2_conn.send_data(event.stream_id, body, end_stream=True)
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    tls_conn.close()
+                    return
+            tls_conn.sendall(h2_conn.data_to_send())
+        tls_conn.close()
+
+    def serve():
+        while True:
+            conn, addr = listener.accept()
+            connections.append(addr)
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def start_http11_server(cert, key, connections):
+    """
+    TLS server whose ALPN only selects http/1.1, answering /page/<n> on keep-alive connections
+
+    :param connections: List, appended with the peer address of every accepted connection
+    :return: int, port
+    """
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    ctx.set_alpn_protocols(["http/1.1"])
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+
+    def handle(conn):
+        tls_conn = ctx.wrap_socket(conn, server_side=True)
+        req = b""
+        while True:
+            data = tls_conn.recv(65536)
+            if not data:
+                break
+            req += data
+            while b"\r\n\r\n" in req:
+                head, req = req.split(b"\r\n\r\n", 1)
+                body = b"page " + head.split(b" ")[1]
+                tls_conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+        tls_conn.close()
+
+    def serve():
+        while True:
+            conn, addr = listener.accept()
+            connections.append(addr)
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def test_requests_are_multiplexed_over_one_connection():
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl command line tool is missing")
+    saved = settings.CERT_FILE, settings.HTTP2
+    with tempfile.TemporaryDirectory() as dirname:
+        cert, key = make_certificate(dirname)
+        connections = []
+        port = start_server(cert, key, connections)
+        settings.CERT_FILE, settings.HTTP2 = cert, True
+        loop = SimpleEventLoop()
+        bodies = {}
+
+        def fetch(n):
+            url = "https://localhost:%d/page/%d" % (port, n)
+            response = yield from async_urlopen(url, loop=loop)
+            try:
+                assert isinstance(response, HTTP2Response)
+                yield from response.read()
+                assert response.status == 200
+                bodies[n] = response.body
+            finally:
+                response.release()
+
+        def routine():
+            tasks = [Task(fetch(n), loop=loop) for n in range(50)]
+            for task in tasks:
+                yield from task
+            key = ("https", "localhost", port)
+            # a single session is shared by the requests of the host, not parked as a keep-alive socket
+            assert isinstance(loop.connection_pool.get_shared(key), HTTP2Session)
+            assert loop.connection_pool.protocol(key) == "h2"
+
+        try:
+            loop.run_until_complete(routine())
+        finally:
+            loop.close()
+            settings.CERT_FILE, settings.HTTP2 = saved
+
+    assert sorted(bodies) == list(range(50))
+    for n, body in bodies.items():
+        assert body == b"page " + b"/page/%d" % n * 1000
+    assert len(connections) == 1
+
+
+def test_http11_is_used_when_alpn_does_not_select_h2():
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl command line tool is missing")
+    saved = settings.CERT_FILE, settings.HTTP2, settings.HTTP_CACHE
+    with tempfile.TemporaryDirectory() as dirname:
+        cert, key = make_certificate(dirname)
+        connections = []
+        port = start_http11_server(cert, key, connections)
+        settings.CERT_FILE, settings.HTTP2, settings.HTTP_CACHE = cert, True, False
+        loop = SimpleEventLoop()
+        bodies = {}
+
+        def fetch(n):
+            url = "https://localhost:%d/page/%d" % (port, n)
+            response = yield from async_urlopen(url, loop=loop)
+            try:
+                assert type(response) is Response
+                yield from response.read()
+                bodies[n] = response.body
+            finally:
+                response.release()
+
+        def routine():
+            # the first request probes the host, the others wait for its answer
+            tasks = [Task(fetch(n), loop=loop) for n in range(5)]
+            for task in tasks:
+                yield from task
+            key = ("https", "localhost", port)
+            assert loop.connection_pool.protocol(key) == "http/1.1"
+            assert loop.connection_pool.get_shared(key) is None
+            # later requests reuse the kept alive connections
+            yield from fetch(5)
+
+        try:
+            loop.run_until_complete(routine())
+        finally:
+            loop.close()
+            settings.CERT_FILE, settings.HTTP2, settings.HTTP_CACHE = saved
+
+    assert bodies == {n: b"page /page/%d" % n for n in range(6)}
+    assert len(connections) <= 5
+
+
+def test_malformed_responses_fail_their_stream_only():
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl command line tool is missing")
+    saved = settings.CERT_FILE, settings.HTTP2, settings.HTTP_CACHE
+    with tempfile.TemporaryDirectory() as dirname:
+        cert, key = make_certificate(dirname)
+        connections = []
+        port = start_server(cert, key, connections)
+        settings.CERT_FILE, settings.HTTP2, settings.HTTP_CACHE = cert, True, False
+        loop = SimpleEventLoop()
+        bodies = {}
+        errors = {}
+
+        def fetch(path):
+            url = "https://localhost:%d%s" % (port, path)
+            response = yield from async_urlopen(url, loop=loop)
+            try:
+                yield from response.read()
+                bodies[path] = response.body
+            except HTTPParseError as e:
+                errors[path] = e
+            finally:
+                response.release()
+
+        def routine():
+            paths = ["/page/%d" % n for n in range(10)] + ["/corrupt/1", "/status/1"]
+            tasks = [Task(fetch(path), loop=loop) for path in paths]
+            for task in tasks:
+                yield from task
+            # the session survived the malformed streams
+            assert loop.connection_pool.get_shared(("https", "localhost", port)).is_usable()
+            yield from fetch("/page/10")
+
+        try:
+            loop.run_until_complete(routine())
+        finally:
+            loop.close()
+            settings.CERT_FILE, settings.HTTP2, settings.HTTP_CACHE = saved
+
+    assert sorted(errors) == ["/corrupt/1", "/status/1"]
+    assert "gzip" in str(errors["/corrupt/1"])
+    assert ":status" in str(errors["/status/1"])
+    assert sorted(bodies) == sorted("/page/%d" % n for n in range(11))
+    for path, body in bodies.items():
+        assert body == b"page " + path.encode() * 1000
+    assert len(connections) == 1
+
+
+if __name__ == "__main__":
+    test_requests_are_multiplexed_over_one_connection()
+    test_http11_is_used_when_alpn_does_not_select_h2()
+    test_malformed_responses_fail_their_stream_only()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+import os
+import socket
+import tempfile
+import threading
+
+from core.downloader.handlers.async_socket_http11 import SimpleEventLoop, async_urlopen
+from core.downloader.cache import HTTPCache, CacheEntry, freshness_lifetime, parse_cache_control
+from config import settings
+
+PAGES = {
+    # always revalidated
+    "/etag": ("no-cache", b"<html>etag</html>"),
+    # fresh for an hour
+    "/fresh": ("max-age=3600", b"<html>fresh</html>"),
+    # never stored
+    "/private": ("no-store", b"<html>private</html>"),
+}
+
+
+def start_server(requests):
+    """
+    :param requests: List, appended with (path, If-None-Match) of every request
+    :return: int, port
+    """
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+
+    def handle(conn):
+        buf = b""
+        while True:
+            while b"\r\n\r\n" not in buf:
+                data = conn.recv(4096)
+                if not data:
+                    conn.close()
+                    return
+                buf += data
+            head, buf = buf.split(b"\r\n\r\n", 1)
+            lines = head.decode().split("\r\n")
+            path = lines[0].split(" ")[1]
+            fields = dict(line.lower().split(": ", 1) for line in lines[1:])
+            requests.append((path, fields.get("if-none-match")))
+            cache_control, body = PAGES[path]
+            etag = '"%s"' % path
+            if fields.get("if-none-match") == etag:
+                conn.sendall(b"HTTP/1.1 304 Not Modified\r\nETag: %s\r\n\r\n" % etag.encode())
+            else:
+                conn.sendall(b"HTTP/1.1 200 OK\r\nETag: %s\r\nCache-Control: %s\r\nContent-Length: %d\r\n\r\n%s" % (
+                    etag.encode(), cache_control.encode(), len(body), body))
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def test_freshness():
+    entry = CacheEntry("http://x/", 200, [("Cache-Control", "public, max-age=60")], b"", stored_at=1000.)
+    assert entry.lifetime == 60
+    assert entry.is_fresh(1059.) and not entry.is_fresh(1060.)
+    entry = CacheEntry("http://x/", 200, [("Date", "Sun, 18 Oct 2026 00:00:00 GMT"),
+                                         ("Last-Modified", "Sun, 08 Oct 2026 00:00:00 GMT")], b"", stored_at=0.)
+    # 10% of the time since the last modification
+    assert entry.lifetime == 86400
+    assert parse_cache_control('no-cache, max-age="5"') == {"no-cache": None, "max-age": "5"}
+    assert freshness_lifetime(entry.headers) == 86400
+
+
+def test_conditional_revalidation_and_freshness():
+    requests = []
+    port = start_server(requests)
+    saved = settings.HTTP_CACHE, settings.HTTP_CACHE_DIR
+    with tempfile.TemporaryDirectory() as dirname:
+        settings.HTTP_CACHE, settings.HTTP_CACHE_DIR = True, dirname
+        try:
+            for run in range(2):
+                # a new loop per run, as a daily recrawl would do
+                loop = SimpleEventLoop()
+                results = {}
+
+                def routine():
+                    for path in PAGES:
+                        response = yield from async_urlopen("http://127.0.0.1:%d%s" % (port, path), loop=loop)
+                        body = yield from response.read()
+                        results[path] = (response.status, body, getattr(response, "from_cache", False))
+                        response.release()
+
+                loop.run_until_complete(routine())
+                stats = loop.http_cache.stats
+                loop.close()
+                for path, (_, body) in PAGES.items():
+                    assert results[path][:2] == (200, body)
+        finally:
+            settings.HTTP_CACHE, settings.HTTP_CACHE_DIR = saved
+
+    assert requests == [("/etag", None), ("/fresh", None), ("/private", None),
+                        ("/etag", '"/etag"'), ("/private", None)]
+    assert results["/etag"][2] and results["/fresh"][2] and not results["/private"][2]
+    assert stats["revalidated"] == 1 and stats["fresh"] == 1
+
+
+def test_lru_eviction():
+    loop = SimpleEventLoop()
+    with tempfile.TemporaryDirectory() as dirname:
+        cache = HTTPCache(dirname, loop, max_size=3000)
+
+        def routine():
+            for n in range(5):
+                entry = CacheEntry("http://x/%d" % n, 200, [("ETag", '"%d"' % n)], b"x" * 1000, stored_at=0.)
+                yield from cache._save(entry)
+                # keep the first entry in use
+                assert (yield from cache.lookup("http://x/0")) is not None
+
+        unlinked = []
+        unlink = os.unlink
+
+        def recording_unlink(path, *args, **kwargs):
+            unlinked.append(threading.current_thread())
+            return unlink(path, *args, **kwargs)
+
+        os.unlink = recording_unlink
+        try:
+            loop.run_until_complete(routine())
+        finally:
+            os.unlink = unlink
+        assert cache.size <= 3000 and cache.stats["evicted"] == 3
+        # files of the evicted entries are removed off the loop thread
+        assert len(unlinked) == 3 and threading.main_thread() not in unlinked
+        assert sum(len(files) for _, _, files in os.walk(dirname)) == 2
+        # survivors are found again by a new cache on the same directory
+        loop.close()
+        # a loop runs a single routine to completion
+        loop = SimpleEventLoop()
+        reopened = HTTPCache(dirname, loop, max_size=3000)
+        # the directory is scanned on first use, in the file executor
+        assert len(reopened._index) == 0
+        loop.run_until_complete(reopened.load())
+        assert len(reopened._index) == 2 and reopened.size == cache.size
+    loop.close()
+
+
+if __name__ == "__main__":
+    test_freshness()
+    test_conditional_revalidation_and_freshness()
+    test_lru_eviction()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+import gzip
+import zlib
+
+import pytest
+
+from core.downloader.http_parser import ResponseParser, HTTPParseError
+from core.downloader.encoding import make_decoder, accept_encoding, TransferStats, DecodingError, DECODERS
+
+HTML = b"<html><body>" + b"<a href='/page'>page</a>" * 2000 + b"</body></html>"
+
+
+def feed_in_pieces(parser, message, size=100):
+    for i in range(0, len(message), size):
+        parser.feed(message[i:i + size])
+
+
+def test_gzip_body_is_decoded_incrementally():
+    body = gzip.compress(HTML)
+    message = b"HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+    parser = ResponseParser()
+    feed_in_pieces(parser, message)
+    assert parser.complete
+    assert bytes(parser.body) == HTML
+    assert parser.body_size == len(body) and parser.decoded_size == len(HTML)
+
+
+def test_chunked_raw_deflate_body():
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    body = compressor.compress(HTML) + compressor.flush()
+    message = b"HTTP/1.1 200 OK\r\nContent-Encoding: deflate\r\nTransfer-Encoding: chunked\r\n\r\n"
+    for i in range(0, len(body), 7):
+        piece = body[i:i + 7]
+        message += b"%x\r\n%s\r\n" % (len(piece), piece)
+    message += b"0\r\n\r\n"
+    parser = ResponseParser()
+    feed_in_pieces(parser, message, size=3)
+    assert parser.complete
+    assert bytes(parser.body) == HTML
+
+
+def test_codings_and_stats():
+    assert make_decoder(None) is None
+    assert make_decoder("identity") is None
+    assert "gzip" in accept_encoding()
+    try:
+        ResponseParser().feed(b"HTTP/1.1 200 OK\r\nContent-Encoding: compress\r\nContent-Length: 1\r\n\r\nx")
+        assert False, "unsupported coding accepted"
+    except HTTPParseError:
+        pass
+
+    stats = TransferStats()
+    stats.record(25, 100)
+    assert stats.savings() == 0.75
+
+
+class CorruptDecoder:
+
+    def decompress(self, data):
+        raise DecodingError("corrupt stream")
+
+    def flush(self):
+        return b""
+
+
+def test_decoder_errors_are_parse_errors():
+    message = b"HTTP/1.1 200 OK\r\nContent-Encoding: corrupt\r\nContent-Length: 4\r\n\r\nxxxx"
+    DECODERS["corrupt"] = CorruptDecoder
+    try:
+        with pytest.raises(HTTPParseError):
+            ResponseParser().feed(message)
+    finally:
+        del DECODERS["corrupt"]
+
+
+def test_corrupt_brotli_body_is_a_parse_error():
+    pytest.importorskip("brotli")
+    message = b"HTTP/1.1 200 OK\r\nContent-Encoding: br\r\nContent-Length: 8\r\n\r\n\xff\xff\xff\xff\xff\xff\xff\xff"
+    with pytest.raises(HTTPParseError):
+        ResponseParser().feed(message)
+
+
+if __name__ == "__main__":
+    test_gzip_body_is_decoded_incrementally()
+    test_chunked_raw_deflate_body()
+    test_codings_and_stats()
+    test_decoder_errors_are_parse_errors()
+    test_corrupt_brotli_body_is_a_parse_error()
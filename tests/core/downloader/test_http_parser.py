@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+from core.downloader.http_parser import ResponseParser, HTTPParseError
+
+
+def feed_bytewise(parser, message):
+    consumed = 0
+    for i in range(len(message)):
+        consumed += parser.feed(message[i:i + 1])
+    return consumed
+
+
+def test_content_length_framing_across_reads():
+    message = b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=gbk\r\nContent-Length: 5\r\n\r\nhello"
+    parser = ResponseParser()
+    assert feed_bytewise(parser, message) == len(message)
+    assert parser.complete and parser.keep_alive
+    assert parser.status == 200 and parser.reason == "OK"
+    assert parser.headers.get_content_charset() == "gbk"
+    assert bytes(parser.body) == b"hello"
+
+
+def test_chunked_framing_with_extensions_and_trailers():
+    message = (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+               b"5;name=value\r\nhello\r\n7\r\n 0\r\n\r\n!\r\n0\r\nExpires: never\r\n\r\n")
+    parser = ResponseParser()
+    # the first read ends with the former end sign inside the payload, it must not end the message
+    head = message.index(b"!")
+    assert parser.feed(message[:head]) == head
+    assert parser.headers_complete and not parser.complete
+    rest = message[head:] + b"HTTP/1.1 200 OK\r\n"
+    # bytes of the next message are left to the caller
+    assert parser.feed(rest) == len(message) - head
+    assert parser.complete
+    assert bytes(parser.body) == b"hello 0\r\n\r\n!"
+
+
+def test_close_delimited_body():
+    parser = ResponseParser()
+    parser.feed(b"HTTP/1.0 200 OK\r\n\r\nsome")
+    parser.feed(b" data")
+    assert not parser.complete and not parser.keep_alive
+    parser.feed_eof()
+    assert parser.complete
+    assert bytes(parser.body) == b"some data"
+
+
+def test_bodyless_and_interim_responses():
+    parser = ResponseParser()
+    parser.feed(b"HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 304 Not Modified\r\nConnection: close\r\n\r\n")
+    assert parser.status == 304 and parser.complete and not parser.keep_alive
+
+    parser = ResponseParser(method="HEAD")
+    parser.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n")
+    assert parser.complete and parser.body_size == 0
+
+
+def test_streaming_body_and_errors():
+    pieces = []
+    parser = ResponseParser(on_body=lambda view: pieces.append(bytes(view)))
+    parser.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 6\r\n\r\nabc")
+    parser.feed(memoryview(b"def"))
+    assert pieces == [b"abc", b"def"] and len(parser.body) == 0
+
+    for message in (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n", b"garbage\r\n\r\n"):
+        try:
+            ResponseParser().feed(message)
+            assert False, "malformed message accepted"
+        except HTTPParseError:
+            pass
+
+
+if __name__ == "__main__":
+    test_content_length_framing_across_reads()
+    test_chunked_framing_with_extensions_and_trailers()
+    test_close_delimited_body()
+    test_bodyless_and_interim_responses()
+    test_streaming_body_and_errors()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+import io
+import os
+import socket
+import tempfile
+import threading
+
+from PIL import Image
+
+from config import settings
+from core.downloader.handlers.async_socket_http11 import SimpleEventLoop, async_download
+from core.downloader.media import sniff_image, write_all
+
+PNG = b"\x89PNG\r\n\x1a\n" + os.urandom(3 * 1024 * 1024)
+
+
+def start_server(files):
+    """
+    :param files: Map<str, bytes>, path -> body served with chunked coding
+    :return: int, port
+    """
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+
+    def handle(conn):
+        req = b""
+        while b"\r\n\r\n" not in req:
+            req += conn.recv(4096)
+        body = files[req.split(b" ")[1].decode()]
+        conn.sendall(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+        for i in range(0, len(body), 100000):
+            piece = body[i:i + 100000]
+            conn.sendall(b"%x\r\n%s\r\n" % (len(piece), piece))
+        conn.sendall(b"0\r\n\r\n")
+        conn.close()
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def test_sniff_image():
+    assert sniff_image(b"\xff\xd8\xff\xe0\x00\x10JFIF") == "jpeg"
+    assert sniff_image(PNG[:16]) == "png"
+    assert sniff_image(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "webp"
+    assert sniff_image(b"<html><body>") is None
+
+
+def test_streaming_download_is_atomic_and_validated():
+    port = start_server({"/cat.png": PNG, "/fake.png": b"<html>not found</html>"})
+    loop = SimpleEventLoop()
+    results = []
+
+    def routine(dirname):
+        for name in ("cat.png", "fake.png"):
+            url = "http://127.0.0.1:%d/%s" % (port, name)
+            results.append((yield from async_download(url, loop=loop, dirname=dirname, stream=True)))
+
+    with tempfile.TemporaryDirectory() as dirname:
+        loop.run_until_complete(routine(dirname))
+        loop.close()
+        assert results == ["cat.png", None]
+        # the original bytes are kept, temporary files are gone
+        assert os.listdir(dirname) == ["cat.png"]
+        with open(os.path.join(dirname, "cat.png"), "rb") as f:
+            assert f.read() == PNG
+
+
+def test_image_is_saved_by_a_process_executor():
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buf, format="PNG")
+    port = start_server({"/red.png": buf.getvalue()})
+    saved = settings.EXECUTOR_TYPE, settings.HTTP_CACHE
+    settings.EXECUTOR_TYPE, settings.HTTP_CACHE = "process", False
+    loop = SimpleEventLoop()
+    results = []
+
+    def routine(dirname):
+        url = "http://127.0.0.1:%d/red.png" % port
+        results.append((yield from async_download(url, loop=loop, dirname=dirname, stream=False)))
+
+    try:
+        with tempfile.TemporaryDirectory() as dirname:
+            loop.run_until_complete(routine(dirname))
+            # the body is pickled to the worker process
+            assert results == ["red.png"]
+            with Image.open(os.path.join(dirname, "red.png")) as im:
+                assert im.size == (8, 8)
+    finally:
+        settings.EXECUTOR_TYPE, settings.HTTP_CACHE = saved
+        loop.close()
+
+
+def test_short_writes_are_completed():
+    real_write, real_pwrite = os.write, os.pwrite
+    # at most 1000 bytes per call, as a raw write may do
+    os.write = lambda fd, data: real_write(fd, data[:1000])
+    os.pwrite = lambda fd, data, offset: real_pwrite(fd, data[:1000], offset)
+    try:
+        with tempfile.TemporaryFile() as f:
+            assert write_all(f.fileno(), PNG[:5000]) == 5000
+            write_all(f.fileno(), PNG[:2500], offset=10000)
+            f.seek(0)
+            data = f.read()
+    finally:
+        os.write, os.pwrite = real_write, real_pwrite
+    assert data[:5000] == PNG[:5000]
+    assert data[10000:] == PNG[:2500]
+
+
+if __name__ == "__main__":
+    test_sniff_image()
+    test_streaming_download_is_atomic_and_validated()
+    test_image_is_saved_by_a_process_executor()
+    test_short_writes_are_completed()
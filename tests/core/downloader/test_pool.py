@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+import socket
+import threading
+
+from core.downloader.handlers.async_socket_http11 import SimpleEventLoop, Task, async_urlopen
+
+BODY = b"<html></html>"
+
+
+def start_server(keep_alive=True, trailing=b""):
+    """
+    :param trailing: bytes, sent after every message, past its Content-Length
+    :return: Tuple(int, List<int>), port of a local HTTP/1.1 server and the number of requests of every connection
+    """
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(64)
+    connections = []
+
+    def handle(conn, n):
+        buf = b""
+        while True:
+            while b"\r\n\r\n" not in buf:
+                data = conn.recv(4096)
+                if not data:
+                    conn.close()
+                    return
+                buf += data
+            _, buf = buf.split(b"\r\n\r\n", 1)
+            connections[n] += 1
+            header = b"Connection: keep-alive" if keep_alive else b"Connection: close"
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n%s\r\n\r\n%s%s" % (
+                len(BODY), header, BODY, trailing))
+            if not keep_alive:
+                conn.close()
+                return
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            connections.append(0)
+            threading.Thread(target=handle, args=(conn, len(connections) - 1), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1], connections
+
+
+def fetch_all(url, n, concurrency):
+    loop = SimpleEventLoop()
+    bodies = []
+
+    def worker(k):
+        for _ in range(k):
+            response = yield from async_urlopen(url, loop=loop)
+            yield from response.read()
+            bodies.append(response.body)
+            response.release()
+
+    def routine():
+        tasks = [Task(worker(n // concurrency), loop=loop) for _ in range(concurrency)]
+        for t in tasks:
+            yield from t
+
+    loop.run_until_complete(routine())
+    stats = dict(loop.connection_pool.stats)
+    loop.close()
+    return bodies, stats
+
+
+def test_keep_alive_connections_are_reused():
+    port, connections = start_server()
+    bodies, stats = fetch_all("http://127.0.0.1:%d/page?n=1" % port, 20, 2)
+    assert bodies == [BODY] * 20
+    # one connection per worker, every other request goes through a pooled socket
+    assert len(connections) == 2
+    assert sum(connections) == 20
+    assert stats["created"] == 2 and stats["reused"] == 18
+
+
+def test_connections_closed_by_the_remote_are_not_pooled():
+    port, connections = start_server(keep_alive=False)
+    bodies, stats = fetch_all("http://127.0.0.1:%d/" % port, 4, 1)
+    assert bodies == [BODY] * 4
+    assert len(connections) == 4
+    assert stats["reused"] == 0
+
+
+def test_connections_sending_past_the_message_are_not_pooled():
+    port, connections = start_server(trailing=b"HTTP/1.1 200 OK\r\n")
+    bodies, stats = fetch_all("http://127.0.0.1:%d/" % port, 3, 1)
+    assert bodies == [BODY] * 3
+    # the next response would start in the middle of the extra bytes
+    assert len(connections) == 3
+    assert stats["reused"] == 0
+
+
+def test_closing_a_released_response_keeps_the_pooled_socket():
+    port, connections = start_server()
+    url = "http://127.0.0.1:%d/" % port
+    loop = SimpleEventLoop()
+    bodies = []
+
+    def routine():
+        for _ in range(2):
+            response = yield from async_urlopen(url, loop=loop)
+            try:
+                yield from response.read()
+                bodies.append(response.body)
+                response.release()
+            finally:
+                # e.g. the cleanup of a caller, the socket is parked in the pool already
+                response.close()
+                response.release()
+
+    loop.run_until_complete(routine())
+    stats = dict(loop.connection_pool.stats)
+    loop.close()
+    assert bodies == [BODY] * 2
+    assert len(connections) == 1
+    assert stats["reused"] == 1
+
+
+def test_max_per_host_and_idle_timeout():
+    loop = SimpleEventLoop()
+    pool = loop.connection_pool
+    pool.max_per_host = 1
+    pool.idle_timeout = 0.05
+    key = ("http", "127.0.0.1", 80)
+    order = []
+    pair = socket.socketpair()
+    for s in pair:
+        s.setblocking(False)
+
+    def first():
+        sock = yield from pool.acquire(key)
+        assert sock is None
+        order.append("first")
+        yield from loop.sleep(0.01)
+        pool.release(key, pair[0])
+
+    def second():
+        sock = yield from pool.acquire(key)
+        # the slot freed by the first task comes with its idle socket
+        assert sock is pair[0]
+        order.append("second")
+        pool.release(key, sock)
+
+    def routine():
+        tasks = [Task(first(), loop=loop), Task(second(), loop=loop)]
+        for t in tasks:
+            yield from t
+        assert pool.idle_count() == 1
+        yield from loop.sleep(0.1)
+
+    loop.run_until_complete(routine())
+    assert order == ["first", "second"]
+    # swept by the idle timer
+    assert pool.idle_count() == 0
+    loop.close()
+    pair[1].close()
+
+
+if __name__ == "__main__":
+    test_keep_alive_connections_are_reused()
+    test_connections_closed_by_the_remote_are_not_pooled()
+    test_connections_sending_past_the_message_are_not_pooled()
+    test_closing_a_released_response_keeps_the_pooled_socket()
+    test_max_per_host_and_idle_timeout()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+import socket
+
+from core.downloader.handlers.async_socket_http11 import SimpleEventLoop
+
+
+def test_resolver_caches_answers_and_failures():
+    loop = SimpleEventLoop()
+    failures = []
+
+    def routine():
+        first = yield from loop.getaddrinfo("localhost", 80)
+        second = yield from loop.getaddrinfo("localhost", 80)
+        assert first == second
+        for _ in range(2):
+            try:
+                yield from loop.getaddrinfo("no-such-host.invalid", 80)
+            except socket.gaierror as e:
+                failures.append(e)
+
+    loop.run_until_complete(routine())
+    loop.close()
+    assert len(failures) == 2
+    assert loop.resolver.hits == 2
+    assert loop.resolver.misses == 2
+
+
+def test_invalid_hosts_are_negative_answers():
+    loop = SimpleEventLoop()
+    # not a valid IDNA name, getaddrinfo raises UnicodeError
+    host = "a" * 64 + ".example.com"
+    failures = []
+
+    def routine():
+        loop.resolver.prefetch([(host, 80)])
+        while (host, 80, 0, socket.SOCK_STREAM) not in loop.resolver._cache:
+            yield from loop.sleep(0.01)
+        assert not loop.resolver._pending
+        for _ in range(2):
+            try:
+                yield from loop.getaddrinfo(host, 80)
+            except socket.gaierror as e:
+                failures.append(e)
+
+    # the prefetch task must not take the loop down
+    loop.run_until_complete(routine())
+    loop.close()
+    assert len(failures) == 2
+    assert loop.resolver.hits == 2
+    assert loop.resolver.misses == 1
+
+
+if __name__ == "__main__":
+    test_resolver_caches_answers_and_failures()
+    test_invalid_hosts_are_negative_answers()
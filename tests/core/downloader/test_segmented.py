@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+
+from core.downloader.handlers.async_socket_http11 import SimpleEventLoop, async_download
+from core.downloader.segmented import parse_content_range
+from config import settings
+
+SEGMENT = 65536
+PNG = b"\x89PNG\r\n\x1a\n" + os.urandom(10 * SEGMENT - 8 + 123)
+
+
+def start_server(state):
+    """
+    :param state: Map, "ranges" is appended with every requested range, requests for the offsets in "broken" are cut,
+    "peak" (when present) is the maximum of ranges served at the same time
+    :return: int, port
+    """
+    lock = threading.Lock()
+    active = [0]
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+
+    def handle(conn):
+        buf = b""
+        while True:
+            while b"\r\n\r\n" not in buf:
+                data = conn.recv(4096)
+                if not data:
+                    conn.close()
+                    return
+                buf += data
+            head, buf = buf.split(b"\r\n\r\n", 1)
+            m = re.search(rb"Range: bytes=(\d+)-(\d+)", head)
+            if m is None:
+                conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(PNG), PNG))
+                continue
+            first, last = int(m.group(1)), min(int(m.group(2)), len(PNG) - 1)
+            state["ranges"].append(first)
+            if "peak" in state:
+                with lock:
+                    active[0] += 1
+                    state["peak"] = max(state["peak"], active[0])
+                # long enough for the other workers to overlap
+                time.sleep(0.02)
+                with lock:
+                    active[0] -= 1
+            body = PNG[first:last + 1]
+            conn.sendall(b"HTTP/1.1 206 Partial Content\r\nETag: \"v1\"\r\nContent-Range: bytes %d-%d/%d\r\n"
+                         b"Content-Length: %d\r\n\r\n" % (first, last, len(PNG), len(body)))
+            if first in state["broken"]:
+                conn.sendall(body[:100])
+                conn.close()
+                return
+            conn.sendall(body)
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def download(url, dirname, max_connections=None):
+    loop = SimpleEventLoop()
+    results = []
+
+    def routine():
+        results.append((yield from async_download(url, loop=loop, dirname=dirname, stream=True,
+                                                  max_connections=max_connections)))
+
+    loop.run_until_complete(routine())
+    loop.close()
+    return results[0]
+
+
+def test_parse_content_range():
+    assert parse_content_range("bytes 0-99/1000") == (0, 99, 1000)
+    assert parse_content_range("bytes 100-199/*") == (100, 199, None)
+    assert parse_content_range("items 1-2/3") is None
+
+
+def test_segmented_download_resumes():
+    state = {"ranges": [], "broken": {3 * SEGMENT}}
+    port = start_server(state)
+    url = "http://127.0.0.1:%d/wallpaper.png" % port
+    saved = settings.DOWNLOAD_SEGMENT_SIZE
+    settings.DOWNLOAD_SEGMENT_SIZE = SEGMENT
+    try:
+        with tempfile.TemporaryDirectory() as dirname:
+            # a segment keeps failing : the download gives up, completed segments are recorded
+            assert download(url, dirname) is None
+            assert not os.path.exists(os.path.join(dirname, "wallpaper.png"))
+            assert os.path.exists(os.path.join(dirname, ".wallpaper.png.progress"))
+            fetched = set(state["ranges"])
+
+            state["ranges"], state["broken"] = [], set()
+            assert download(url, dirname) == "wallpaper.png"
+            # only the missing segments are requested again
+            assert 3 * SEGMENT in state["ranges"]
+            assert not (set(state["ranges"]) & fetched - {3 * SEGMENT})
+            assert sorted(os.listdir(dirname)) == ["wallpaper.png"]
+            with open(os.path.join(dirname, "wallpaper.png"), "rb") as f:
+                assert f.read() == PNG
+    finally:
+        settings.DOWNLOAD_SEGMENT_SIZE = saved
+
+
+def test_segments_are_capped_by_the_host_connections():
+    state = {"ranges": [], "broken": set(), "peak": 0}
+    port = start_server(state)
+    url = "http://127.0.0.1:%d/wallpaper.png" % port
+    saved = settings.DOWNLOAD_SEGMENT_SIZE, settings.DOWNLOAD_SEGMENTS, settings.HOST_MAX_CONNECTIONS
+    settings.DOWNLOAD_SEGMENT_SIZE, settings.DOWNLOAD_SEGMENTS = SEGMENT, 8
+    try:
+        with tempfile.TemporaryDirectory() as dirname:
+            settings.HOST_MAX_CONNECTIONS = 2
+            assert download(url, dirname) == "wallpaper.png"
+            assert state["peak"] == 2
+
+            # the share of the window of the host in the scheduler
+            os.unlink(os.path.join(dirname, "wallpaper.png"))
+            state["peak"] = 0
+            settings.HOST_MAX_CONNECTIONS = 0
+            assert download(url, dirname, max_connections=1) == "wallpaper.png"
+            assert state["peak"] == 1
+            with open(os.path.join(dirname, "wallpaper.png"), "rb") as f:
+                assert f.read() == PNG
+    finally:
+        settings.DOWNLOAD_SEGMENT_SIZE, settings.DOWNLOAD_SEGMENTS, settings.HOST_MAX_CONNECTIONS = saved
+
+
+if __name__ == "__main__":
+    test_parse_content_range()
+    test_segmented_download_resumes()
+    test_segments_are_capped_by_the_host_connections()
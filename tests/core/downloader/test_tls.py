@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+import os
+import ssl
+import time
+import socket
+import shutil
+import tempfile
+import threading
+import subprocess
+
+import pytest
+
+from core.downloader import tls
+from core.downloader.handlers.async_socket_http11 import SimpleEventLoop, Task, async_urlopen
+from config import settings
+
+BODY = b"<html></html>"
+
+
+def test_ssl_context_is_shared_and_negotiates_modern_tls():
+    ctx = tls.get_ssl_context(verify=False)
+    assert tls.get_ssl_context(verify=False) is ctx
+    assert tls.get_ssl_context(verify=True) is not ctx
+    assert ctx.minimum_version == ssl.TLSVersion.TLSv1_2
+
+
+def make_certificate(dirname):
+    cert = os.path.join(dirname, "cert.pem")
+    key = os.path.join(dirname, "key.pem")
+    subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+                           "-days", "1", "-subj", "/CN=localhost",
+                           "-addext", "subjectAltName=DNS:localhost"], stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+def start_server(cert, key, delay=0., silent=False):
+    """
+    TLS server answering one request per connection, one thread per connection
+
+    :param delay: Number, seconds waited before the handshake is answered
+    :param silent: bool, accept connections and never answer the handshake
+    :return: int, port
+    """
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+    accepted = []
+
+    def handle(conn):
+        if silent:
+            # keep the connection open until the client gives up
+            accepted.append(conn)
+            return
+        time.sleep(delay)
+        try:
+            tls_conn = ctx.wrap_socket(conn, server_side=True)
+        except (ssl.SSLError, OSError):
+            conn.close()
+            return
+        req = b""
+        while b"\r\n\r\n" not in req:
+            data = tls_conn.recv(65536)
+            if not data:
+                break
+            req += data
+        tls_conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(BODY), BODY))
+        tls_conn.close()
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def configure(cert):
+    saved = settings.CERT_FILE, settings.SSL_VERIFY, settings.HTTP2, settings.HTTP_CACHE, settings.CONNECT_TIMEOUT
+    settings.CERT_FILE, settings.SSL_VERIFY, settings.HTTP2, settings.HTTP_CACHE = cert, True, False, False
+    return saved
+
+
+def restore(saved):
+    settings.CERT_FILE, settings.SSL_VERIFY, settings.HTTP2, settings.HTTP_CACHE, settings.CONNECT_TIMEOUT = saved
+
+
+def fetch(url, loop, reused):
+    response = yield from async_urlopen(url, loop=loop)
+    try:
+        reused.append(response.sock.session_reused)
+        yield from response.read()
+        assert response.body == BODY
+    finally:
+        # the server closes the connection, the TLS 1.3 ticket is saved when the socket is closed
+        response.release()
+
+
+def test_handshake_runs_on_the_loop():
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl command line tool is missing")
+    with tempfile.TemporaryDirectory() as dirname:
+        cert, key = make_certificate(dirname)
+        port = start_server(cert, key, delay=0.2)
+        saved = configure(cert)
+        loop = SimpleEventLoop()
+        reused = []
+        ticks = []
+
+        def ticker(done):
+            while not done:
+                ticks.append(loop.time())
+                yield from loop.sleep(0.01)
+
+        def routine():
+            done = []
+            task = Task(ticker(done), loop=loop)
+            yield from fetch("https://localhost:%d/" % port, loop, reused)
+            done.append(True)
+            yield from task
+
+        try:
+            loop.run_until_complete(routine())
+        finally:
+            loop.close()
+            restore(saved)
+
+    # the loop kept running while the server held its answer to the handshake back
+    assert len(ticks) >= 10
+    assert len(reused) == 1
+
+
+def test_handshake_is_bounded_by_the_connect_timeout():
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl command line tool is missing")
+    with tempfile.TemporaryDirectory() as dirname:
+        cert, key = make_certificate(dirname)
+        port = start_server(cert, key, silent=True)
+        saved = configure(cert)
+        settings.CONNECT_TIMEOUT = 0.2
+        loop = SimpleEventLoop()
+        errors = []
+
+        def routine():
+            start = loop.time()
+            try:
+                yield from async_urlopen("https://localhost:%d/" % port, loop=loop)
+            except TimeoutError as e:
+                errors.append((e, loop.time() - start))
+
+        try:
+            loop.run_until_complete(routine())
+        finally:
+            loop.close()
+            restore(saved)
+
+    assert len(errors) == 1
+    assert errors[0][1] < 2
+
+
+def test_reconnects_resume_the_tls_session():
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl command line tool is missing")
+    with tempfile.TemporaryDirectory() as dirname:
+        cert, key = make_certificate(dirname)
+        port = start_server(cert, key)
+        saved = configure(cert)
+        loop = SimpleEventLoop()
+        reused = []
+        handshakes, resumed = tls.sessions.handshakes, tls.sessions.resumed
+
+        def routine():
+            # one request per connection, the second handshake offers the session of the first one
+            for _ in range(2):
+                yield from fetch("https://localhost:%d/" % port, loop, reused)
+
+        try:
+            loop.run_until_complete(routine())
+        finally:
+            loop.close()
+            restore(saved)
+
+    assert reused == [False, True]
+    assert tls.sessions.handshakes - handshakes == 2
+    assert tls.sessions.resumed - resumed == 1
+
+
+if __name__ == "__main__":
+    test_ssl_context_is_shared_and_negotiates_modern_tls()
+    test_handshake_runs_on_the_loop()
+    test_handshake_is_bounded_by_the_connect_timeout()
+    test_reconnects_resume_the_tls_session()
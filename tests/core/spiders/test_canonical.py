@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+from core.downloader.handlers.async_socket_http11 import SimpleEventLoop
+from core.spiders.base_spider import BaseAsyncSpider
+from core.spiders.scheduler import create_queue
+from core.spiders.dedup import close_loop_store
+from core.spiders.canonical import canonicalize, resolve_all, resolve, fingerprint, url_fingerprint, host_of
+
+
+def test_equivalent_urls_share_one_form():
+    assert canonicalize("HTTP://Example.COM:80") == "http://example.com/"
+    assert canonicalize("https://a.com:443/a/./b/../c?b=2&a=1&b=1#top") == "https://a.com/a/c?a=1&b=2&b=1"
+    assert canonicalize("http://a.com/%7euser/%2f%e2 x?q=100%&utm_source=feed") == \
+        "http://a.com/~user/%2F%E2%20x?q=100%25"
+    assert canonicalize("http://bücher.de./") == "http://xn--bcher-kva.de/"
+    assert canonicalize("http://a.com:8080/") == "http://a.com:8080/"
+    assert canonicalize("http://a.com/?") == "http://a.com/"
+    for url in ("mailto:a@a.com", "javascript:void(0)", "http://a.com:port/", "http:///path"):
+        assert canonicalize(url) is None
+    # idempotent
+    url = canonicalize("http://A.com/x/../%7Ey?b&a=")
+    assert canonicalize(url) == url
+
+
+def test_links_are_resolved_against_the_page():
+    links = ["../up", "sib", "./sib", "/abs", "//b.com/x", "?q=2", "#frag", "javascript:void(0)", "HTTPS://C.com", ""]
+    assert resolve_all("http://a.com:8080/dir/page.html?x=1", links) == [
+        "http://a.com:8080/up", "http://a.com:8080/dir/sib", "http://a.com:8080/abs", "http://b.com/x",
+        "http://a.com:8080/dir/page.html?q=2", "https://c.com/"]
+    assert resolve("https://a.com/a/b", "/login?next=%2Fa") == "https://a.com/login?next=%2Fa"
+    assert resolve("https://a.com/a/b", None) is None
+
+
+def test_fingerprints_are_stable_across_forms():
+    assert url_fingerprint("http://A.com:80/#x") == url_fingerprint("http://a.com") == fingerprint("http://a.com/")
+    assert url_fingerprint("http://a.com/?a=1&b=2") == url_fingerprint("http://a.com/?b=2&a=1")
+    assert url_fingerprint("http://a.com/a") != url_fingerprint("http://a.com/b")
+    assert url_fingerprint("ftp://a.com/") is None
+    assert host_of("http://user@A.com:81/x") == "a.com"
+    assert host_of("http://[::1]:8080/") == "::1"
+
+
+def test_spider_seeds_take_the_canonical_form():
+    loop = SimpleEventLoop()
+    q = create_queue(loop)
+    spider = BaseAsyncSpider("HTTP://A.com:80/index.html#top", 3, 1, loop=loop, queue=q)
+    assert spider.root_url == "http://a.com/index.html"
+    assert q.get_nowait()[0] == "http://a.com/index.html"
+    q.close()
+    close_loop_store(loop)
+    loop.close()
+
+
+if __name__ == "__main__":
+    test_equivalent_urls_share_one_form()
+    test_links_are_resolved_against_the_page()
+    test_fingerprints_are_stable_across_forms()
+    test_spider_seeds_take_the_canonical_form()
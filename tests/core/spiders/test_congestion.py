@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+from core.spiders.congestion import AIMDController, parse_retry_after
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+def test_window_grows_while_latency_is_steady():
+    controller = AIMDController(initial_window=2, max_window=16, clock=Clock())
+    for _ in range(100):
+        controller.on_response("cdn.com", 0.05, 200)
+    # about +1 per window of responses
+    assert controller.limit("cdn.com") >= 10
+    for _ in range(1000):
+        controller.on_response("cdn.com", 0.05, 200)
+    assert controller.limit("cdn.com") == 16
+
+
+def test_window_holds_when_latency_rises_and_halves_on_congestion():
+    clock = Clock()
+    controller = AIMDController(initial_window=8, clock=clock)
+    controller.on_response("origin.com", 0.1, 200)
+    window = controller.host_stats("origin.com")["window"]
+    for _ in range(20):
+        controller.on_response("origin.com", 1.0, 200)
+    # the moving average went far above the best latency : the host is saturated
+    assert controller.host_stats("origin.com")["window"] < window + 1
+
+    window = controller.host_stats("origin.com")["window"]
+    controller.on_response("origin.com", None, 503)
+    controller.on_error("origin.com", 1.0, TimeoutError())
+    # failures within the same latency period are one congestion event
+    assert controller.host_stats("origin.com")["window"] == window / 2
+    clock.now += 10
+    controller.on_error("origin.com", 1.0, ConnectionResetError())
+    stats = controller.host_stats("origin.com")
+    assert stats["window"] == window / 4
+    assert (stats["throttled"], stats["timeouts"], stats["errors"]) == (1, 1, 1)
+    for _ in range(10):
+        clock.now += 10
+        controller.on_error("origin.com", 1.0, TimeoutError())
+    assert controller.limit("origin.com") == 1
+
+
+def test_server_errors_shrink_the_window():
+    clock = Clock()
+    controller = AIMDController(initial_window=16, clock=clock)
+    controller.on_response("origin.com", 0.1, 200)
+    window = controller.host_stats("origin.com")["window"]
+    for _ in range(3):
+        clock.now += 10
+        controller.on_response("origin.com", 0.1, 502)
+    stats = controller.host_stats("origin.com")
+    assert stats["window"] == window / 8
+    assert (stats["throttled"], stats["errors"], stats["decreases"]) == (0, 3, 3)
+    # client errors are answers of a healthy host
+    controller.on_response("origin.com", 0.1, 404)
+    assert controller.host_stats("origin.com")["window"] > window / 8
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("120") == 120
+    assert parse_retry_after("Sun, 18 Oct 2026 00:01:00 GMT", now=1792281600.) == 60
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+if __name__ == "__main__":
+    test_window_grows_while_latency_is_steady()
+    test_window_holds_when_latency_rises_and_halves_on_congestion()
+    test_server_errors_shrink_the_window()
+    test_parse_retry_after()
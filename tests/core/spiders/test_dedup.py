@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+import os
+import shutil
+import tempfile
+import socket
+import threading
+import multiprocessing
+from collections import Counter
+
+from config import settings
+from core.downloader.handlers.async_socket_http11 import SimpleEventLoop, Task
+from core.spiders.base_spider import BaseAsyncSpider
+from core.spiders.scheduler import create_queue
+from core.spiders.dedup import fingerprint, FingerprintSet, ScalableBloomFilter, MmapFingerprintSet, \
+    SharedFingerprintSet, UrlSet, close_loop_store
+
+
+def urls(n, host="a.com"):
+    return ["http://%s/page/%d" % (host, i) for i in range(n)]
+
+
+def test_fingerprint_table_grows_and_stays_exact():
+    store = FingerprintSet(capacity=16)
+    assert all(store.add(url) for url in urls(5000))
+    assert not store.add("http://a.com/page/42")
+    assert len(store) == 5000
+    assert all(url in store for url in urls(5000))
+    assert not any(url in store for url in urls(5000, host="b.com"))
+    # 8 bytes per slot, at most twice as many slots as urls past max_load
+    assert store.nbytes() <= 8 * 5000 / store.max_load * 2
+    assert fingerprint("http://a.com/") == fingerprint("http://a.com/")
+
+
+def test_scalable_bloom_filter_bounds_false_positives():
+    store = ScalableBloomFilter(capacity=1000, error_rate=0.01)
+    store.update(urls(20000))
+    assert len(store._filters) > 1
+    assert all(url in store for url in urls(20000))
+    false_positives = sum(url in store for url in urls(20000, host="b.com"))
+    assert false_positives / 20000 < 0.01
+    assert store.nbytes() < FingerprintSet(capacity=20000).nbytes()
+
+
+def test_mmap_table_survives_restarts():
+    dirname = tempfile.mkdtemp()
+    path = os.path.join(dirname, "seen.fp")
+    try:
+        store = MmapFingerprintSet(path, capacity=16)
+        store.update(urls(1000))
+        store.close()
+
+        store = MmapFingerprintSet(path)
+        assert len(store) == 1000
+        assert "http://a.com/page/999" in store
+        assert store.add("http://b.com/")
+        # not closed : the count is rebuilt from the table
+        store.flush()
+        del store
+        store = MmapFingerprintSet(path)
+        assert len(store) == 1001
+        assert "http://b.com/" in store
+        store.close()
+        assert os.listdir(dirname) == ["seen.fp"]
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_spiders_of_a_loop_share_their_store():
+    loop = SimpleEventLoop()
+    q = create_queue(loop)
+    first = BaseAsyncSpider("http://a.com/", 3, 1, loop=loop, queue=q)
+    second = BaseAsyncSpider("http://b.com/", 3, 1, loop=loop, queue=q)
+    assert first.seen_urls is second.seen_urls
+    first.seen_urls.add("http://c.com/")
+    assert "http://c.com/" in second.seen_urls
+    q.close()
+    close_loop_store(loop)
+    loop.close()
+
+
+def _add_urls(store, host):
+    store.update(urls(1000, host=host))
+
+
+def test_shared_table_is_seen_by_every_process():
+    store = SharedFingerprintSet(capacity=10000)
+    ctx = multiprocessing.get_context("fork")
+    try:
+        workers = [ctx.Process(target=_add_urls, args=(store, host)) for host in ("a.com", "b.com")]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        # added by the workers, without any message
+        assert all(url in store for url in urls(1000, host="a.com") + urls(1000, host="b.com"))
+        assert "http://c.com/" not in store
+        assert not store.add("http://a.com/page/1")
+    finally:
+        store.close()
+        store.unlink()
+
+
+def test_full_shared_table_degrades_to_no_dedup():
+    store = SharedFingerprintSet(capacity=16, max_probe=8)
+    try:
+        assert all(store.add(url) for url in urls(1000))
+        assert store._overflows > 0
+    finally:
+        store.close()
+        store.unlink()
+
+
+def start_pages(hits):
+    """
+    :param hits: Counter, requests served per port
+    :return: List<str>, urls of two pages on two ports, each one linking to the other
+    """
+    listeners = []
+    for _ in range(2):
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(8)
+        listeners.append(listener)
+    urls = ["http://127.0.0.1:%d/" % listener.getsockname()[1] for listener in listeners]
+
+    def serve(listener, body):
+        while True:
+            conn, _ = listener.accept()
+            req = b""
+            while b"\r\n\r\n" not in req:
+                req += conn.recv(4096)
+            hits[listener.getsockname()[1]] += 1
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body))
+            conn.close()
+
+    for listener, other in zip(listeners, reversed(urls)):
+        threading.Thread(target=serve, args=(listener, other.encode()), daemon=True).start()
+    return urls
+
+
+class LinkSpider(BaseAsyncSpider):
+
+    def parse_links(self, response):
+        yield from self._loop.sleep(0)
+        return [response.body.decode()]
+
+
+def test_seeds_linking_to_each_other_are_crawled_once():
+    hits = Counter()
+    seeds = start_pages(hits)
+    saved = settings.HTTP_CACHE
+    settings.HTTP_CACHE = False
+    loop = SimpleEventLoop()
+    q = create_queue(loop)
+    spiders = [LinkSpider(url, 3, 3, loop=loop, queue=q) for url in seeds + seeds]
+
+    def routine():
+        tasks = [Task(spider._run(), loop=loop) for spider in spiders]
+        yield from q.join()
+        for task in tasks:
+            task.cancel()
+
+    try:
+        loop.run_until_complete(routine())
+    finally:
+        settings.HTTP_CACHE = saved
+        q.close()
+        close_loop_store(loop)
+        loop.close()
+    assert sorted(hits.values()) == [1, 1]
+    store = UrlSet()
+    assert store.add(seeds[0]) and not store.add(seeds[0])
+
+
+if __name__ == "__main__":
+    test_fingerprint_table_grows_and_stays_exact()
+    test_scalable_bloom_filter_bounds_false_positives()
+    test_mmap_table_survives_restarts()
+    test_spiders_of_a_loop_share_their_store()
+    test_shared_table_is_seen_by_every_process()
+    test_full_shared_table_degrades_to_no_dedup()
+    test_seeds_linking_to_each_other_are_crawled_once()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+import socket
+
+from core.downloader.handlers.async_socket_http11 import SimpleEventLoop, QueueEmpty
+from core.downloader.http_parser import HTTPParseError
+from core.spiders.retry import classify, RetryPolicy, CircuitBreaker
+from core.spiders.scheduler import HostScheduler
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+def test_classify():
+    assert classify(ConnectionRefusedError()) == "refused"
+    assert classify(ConnectionResetError()) == "reset"
+    assert classify(socket.timeout()) == "timeout"
+    assert classify(socket.gaierror()) == "dns"
+    assert classify(HTTPParseError("truncated")) == "protocol"
+    assert classify(status=429) == "throttled"
+    assert classify(status=503) == "server_error"
+    for status in (200, 301, 404, 501):
+        assert classify(status=status) is None
+    # bugs are not retried
+    assert classify(KeyError("x")) is None
+
+
+def test_backoff_is_jittered_and_bounded():
+    policy = RetryPolicy(max_retries=5, base_delay=1., max_delay=6., rand=lambda: 1.)
+    delays = [policy.next_delay("http://a.com/", "reset") for _ in range(6)]
+    assert delays == [1., 2., 4., 6., 6., None]
+    assert policy.stats["retried"] == 5 and policy.stats["gave_up"] == 1
+    assert policy.stats["failures"]["reset"] == 6
+
+    policy = RetryPolicy(max_retries=3, base_delay=1., rand=lambda: 0.)
+    assert policy.next_delay("http://b.com/", "throttled", retry_after=10) == 10
+    policy.forget("http://b.com/")
+    assert policy._attempts == {}
+
+
+def test_breaker_opens_probes_and_closes():
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=3, cooldown=10., max_cooldown=15., clock=clock)
+    assert breaker.on_failure("down.com") is None
+    assert breaker.on_failure("down.com") is None
+    assert breaker.on_failure("down.com") == 10.
+    assert breaker.state("down.com") == "open"
+    clock.now = 10.
+    assert breaker.is_half_open("down.com")
+    # the probe failed : the cooldown doubles, up to max_cooldown
+    assert breaker.on_failure("down.com") == 25.
+    clock.now = 25.
+    breaker.on_success("down.com")
+    assert breaker.state("down.com") == "closed"
+    assert breaker.stats == {"opened": 2, "closed": 1}
+
+
+def test_scheduler_retries_later_and_holds_broken_hosts():
+    loop = SimpleEventLoop()
+    q = HostScheduler(loop=loop, breaker=CircuitBreaker(threshold=1, cooldown=0.05, clock=loop.time),
+                      retry_policy=RetryPolicy(max_retries=1, base_delay=0.01, rand=lambda: 1.))
+    q.put_nowait(("http://down.com/0", 3, 0))
+    q.put_nowait(("http://down.com/1", 3, 0))
+    item = q.get_nowait()
+    q.observe(item[0], 0.01, error=ConnectionRefusedError())
+    assert q.retry(item, error=ConnectionRefusedError())
+    q.task_done(item)
+    # the job is pending, the breaker holds the host back
+    assert not q.is_idle()
+    try:
+        q.get_nowait()
+        assert False, "breaker ignored"
+    except QueueEmpty:
+        pass
+
+    def routine():
+        start = loop.time()
+        items = []
+        for _ in range(2):
+            item = yield from q.get()
+            # half-open : a single probe at a time
+            try:
+                q.get_nowait()
+                assert False, "more than one probe"
+            except QueueEmpty:
+                pass
+            q.observe(item[0], 0.01, status=200)
+            q.task_done(item)
+            items.append(item[0])
+        assert loop.time() - start >= 0.04
+        assert sorted(items) == ["http://down.com/0", "http://down.com/1"]
+        yield from q.join()
+
+    loop.run_until_complete(routine())
+    assert q.breaker.state("down.com") == "closed"
+    assert q.host_stats("down.com")["broken"] == 1
+    # the success reset the retries of the url, a second failure in a row exhausts them
+    assert q.retry(("http://down.com/0", 3, 0), status=503)
+    assert not q.retry(("http://down.com/0", 3, 0), status=503)
+    q.close()
+    loop.close()
+
+
+if __name__ == "__main__":
+    test_classify()
+    test_backoff_is_jittered_and_bounded()
+    test_breaker_opens_probes_and_closes()
+    test_scheduler_retries_later_and_holds_broken_hosts()
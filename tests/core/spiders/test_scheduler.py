@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+import re
+
+from core.downloader.handlers.async_socket_http11 import SimpleEventLoop, Task, QueueEmpty
+from core.spiders.scheduler import HostScheduler
+from core.spiders.congestion import AIMDController
+from core.spiders.frontier import BreadthFirstStrategy, DepthFirstStrategy, BestFirstStrategy
+from core.spiders.base_spider import BaseAsyncSpider
+from core.spiders.dedup import close_loop_store
+
+
+def run_workers(q, n_workers, duration):
+    """
+    :return: List<Tuple(str, float, float)>, host, start and end of every job
+    """
+    loop = q._loop
+    log = []
+
+    def worker():
+        while True:
+            item = yield from q.get()
+            start = loop.time()
+            yield from loop.sleep(duration)
+            log.append((q.host_of(item), start, loop.time()))
+            q.task_done(item)
+
+    def routine():
+        tasks = [Task(worker(), loop=loop) for _ in range(n_workers)]
+        yield from q.join()
+        for t in tasks:
+            t.cancel()
+
+    loop.run_until_complete(routine())
+    return log
+
+
+def test_interval_and_cap_per_host():
+    loop = SimpleEventLoop()
+    q = HostScheduler(loop=loop, interval=0.05, max_per_host=1)
+    for n in range(4):
+        q.put_nowait(("http://slow.com/%d" % n, 3, 0))
+    for host in ("a.com", "b.com", "c.com"):
+        for n in range(4):
+            q.put_nowait(("http://%s/%d" % (host, n), 3, 0))
+    log = run_workers(q, n_workers=8, duration=0.01)
+    loop.close()
+
+    assert len(log) == 16
+    for host in ("slow.com", "a.com", "b.com", "c.com"):
+        jobs = sorted((start, end) for h, start, end in log if h == host)
+        for (start, end), (next_start, _) in zip(jobs, jobs[1:]):
+            # one job of the host at a time, started at least the interval apart
+            assert next_start >= end - 1e-3
+            assert next_start - start >= 0.05 - 1e-3
+    # hosts progress together instead of one after the other
+    firsts = sorted(min(start for h, start, _ in log if h == host) for host in ("slow.com", "a.com", "b.com", "c.com"))
+    assert firsts[-1] - firsts[0] < 0.05
+    assert q.fairness() == 1.
+    assert q.host_stats("a.com")["dispatched"] == 4
+
+
+def test_round_robin_without_politeness():
+    loop = SimpleEventLoop()
+    q = HostScheduler(loop=loop)
+    for n in range(6):
+        q.put_nowait(("http://big.com/%d" % n, 3, 0))
+    q.put_nowait(("http://small.com/0", 3, 0))
+    order = [q.host_of(q.get_nowait()) for _ in range(3)]
+    # the backlog of big.com does not delay small.com
+    assert order == ["big.com", "small.com", "big.com"]
+    loop.close()
+
+
+def test_adaptive_window_and_retry_after():
+    loop = SimpleEventLoop()
+    q = HostScheduler(loop=loop, max_per_host=8, controller=AIMDController(initial_window=2, clock=loop.time))
+    for n in range(6):
+        q.put_nowait(("http://host.com/%d" % n, 3, 0))
+    first = [q.get_nowait(), q.get_nowait()]
+    try:
+        q.get_nowait()
+        assert False, "window exceeded"
+    except QueueEmpty:
+        pass
+    # a 429 with Retry-After : the window shrinks and the host is paused even once a slot is free
+    q.observe(first[0][0], 0.1, status=429, retry_after=0.05)
+    q.task_done(first[0])
+    q.task_done(first[1])
+    try:
+        q.get_nowait()
+        assert False, "Retry-After ignored"
+    except QueueEmpty:
+        pass
+    assert q.host_stats("host.com")["paused"] == 1
+
+    def routine():
+        start = loop.time()
+        item = yield from q.get()
+        assert loop.time() - start >= 0.04
+        q.task_done(item)
+
+    loop.run_until_complete(routine())
+    loop.close()
+
+
+def drain(q):
+    items = []
+    while True:
+        try:
+            item = q.get_nowait()
+        except QueueEmpty:
+            return items
+        items.append(item)
+        q.task_done(item)
+
+
+def test_strategies_order_the_jobs():
+    jobs = [("http://a.com/deep", 3, 3), ("http://a.com/top", 3, 1), ("http://b.com/mid", 3, 2),
+            ("http://b.com/cat.jpg", 3, 3), ("http://c.com/post.html", 3, 2), ("http://a.com/top2", 3, 1)]
+
+    def order(strategy):
+        loop = SimpleEventLoop()
+        q = HostScheduler(loop=loop, strategy=strategy)
+        for job in jobs:
+            q.put_nowait(job)
+        urls = [item[0] for item in drain(q)]
+        loop.close()
+        return urls, q
+
+    urls, _ = order(BreadthFirstStrategy())
+    assert urls == ["http://a.com/top", "http://a.com/top2", "http://b.com/mid", "http://c.com/post.html",
+                    "http://a.com/deep", "http://b.com/cat.jpg"]
+    urls, q = order(DepthFirstStrategy(max_depth=2))
+    # deepest first, latest first among equals, depth 3 not admitted
+    assert urls == ["http://c.com/post.html", "http://b.com/mid", "http://a.com/top2", "http://a.com/top"]
+    assert q.rejected == 2
+    urls, _ = order(BestFirstStrategy(media_types=[".jpg"], target=re.compile(r"\.html$")))
+    assert urls[:2] == ["http://b.com/cat.jpg", "http://c.com/post.html"]
+    assert urls[2:4] == ["http://a.com/top", "http://a.com/top2"]
+
+
+def test_spider_crawls_jobs_at_their_depth():
+    loop = SimpleEventLoop()
+    q = HostScheduler(loop=loop)
+    crawled = []
+
+    class RecordingSpider(BaseAsyncSpider):
+        def crawl(self, url, max_redirect, depth):
+            crawled.append((url, depth))
+            yield from loop.sleep(0)
+
+    spider = RecordingSpider(None, 3, 5, loop=loop, queue=q)
+    q.put_nowait(("http://a.com/", 3, 2))
+
+    def routine():
+        task = Task(spider._run(), loop=loop)
+        yield from q.join()
+        task.cancel()
+
+    loop.run_until_complete(routine())
+    assert crawled == [("http://a.com/", 2)]
+    close_loop_store(loop)
+    loop.close()
+
+
+def test_full_frontier_keeps_the_jobs_aside():
+    loop = SimpleEventLoop()
+    q = HostScheduler(maxsize=2, loop=loop, strategy=BreadthFirstStrategy())
+    spider = BaseAsyncSpider(None, 3, 5, loop=loop, queue=q)
+    for n in range(5):
+        # put_nowait would raise QueueFull from the third job on
+        spider._schedule(("http://a.com/%d" % n, 3, 1))
+    assert q.qsize() == 2
+    assert not q.is_idle()
+    assert [item[0] for item in drain(q)] == ["http://a.com/%d" % n for n in range(5)]
+    assert q.is_idle()
+    close_loop_store(loop)
+    loop.close()
+
+
+def test_connections_left_to_a_job():
+    loop = SimpleEventLoop()
+    q = HostScheduler(loop=loop, max_per_host=8, controller=AIMDController(initial_window=3, clock=loop.time))
+    for n in range(3):
+        q.put_nowait(("http://a.com/%d" % n, 3, 1))
+    first = q.get_nowait()
+    # the whole window of the host
+    assert q.connections(first) == 3
+    q.get_nowait()
+    assert q.connections(first) == 2
+    # no limit
+    q = HostScheduler(loop=loop)
+    q.put_nowait(("http://a.com/", 3, 1))
+    assert q.connections(q.get_nowait()) == 0
+    loop.close()
+
+
+if __name__ == "__main__":
+    test_interval_and_cap_per_host()
+    test_round_robin_without_politeness()
+    test_adaptive_window_and_retry_after()
+    test_strategies_order_the_jobs()
+    test_spider_crawls_jobs_at_their_depth()
+    test_full_frontier_keeps_the_jobs_aside()
+    test_connections_left_to_a_job()
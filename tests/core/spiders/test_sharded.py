@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lei Wang
+# All rights reserved.
+# Author yiak.wy@gmail.com
+import os
+import select
+import socket
+import tempfile
+import threading
+from collections import Counter
+
+from core.downloader.handlers.async_socket_http11 import SimpleEventLoop
+from core.spiders.sharded import shard_of, ShardRouter, run_sharded
+from core.spiders.base_spider import BaseAsyncSpider
+from config import settings
+
+PAGES = 3
+
+
+def test_shard_of_depends_on_host_only():
+    n_shards = 4
+    shard = shard_of("http://konachan.net/post?page=1", n_shards)
+    assert shard_of("http://KONACHAN.net/post?page=2", n_shards) == shard
+    assert shard_of("http://konachan.net/image/a.jpg", n_shards) == shard
+    assert 0 <= shard < n_shards
+
+
+def test_router_drops_messages_over_pipe_buf():
+    loop = SimpleEventLoop()
+    inbox, peer = os.pipe(), os.pipe()
+    router = ShardRouter(0, 2, inbox[0], {1: peer[1]}, None, loop=loop)
+    url = next("http://host%d.com/" % n for n in range(100) if shard_of("http://host%d.com/" % n, 2) == 1)
+    assert not router.owns(url)
+    router.dispatch((url, 3, 1))
+    # a longer message could interleave with the writes of another peer
+    router.dispatch((url + "a" * select.PIPE_BUF, 3, 1))
+    assert router.sent == 1
+    assert os.read(peer[0], 65536) == b'["%s", 3, 1]\n' % url.encode()
+    loop.close()
+    for fd in inbox + peer:
+        os.close(fd)
+
+
+def start_site(hits, ports):
+    """
+    Server answering /<n> with the absolute links of every page of every site in `ports`, one per line
+
+    :param hits: Counter, incremented with the url of every request
+    :param ports: List<int>, ports of the sites, appended with the port of this one
+    :return: int, port
+    """
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+    port = listener.getsockname()[1]
+    ports.append(port)
+
+    def handle(conn):
+        buf = b""
+        while True:
+            while b"\r\n\r\n" not in buf:
+                data = conn.recv(4096)
+                if not data:
+                    conn.close()
+                    return
+                buf += data
+            head, buf = buf.split(b"\r\n\r\n", 1)
+            path = head.split(b" ")[1].decode()
+            hits["http://127.0.0.1:%d%s" % (port, path)] += 1
+            body = "\n".join("http://127.0.0.1:%d/%d" % (p, n) for p in ports for n in range(PAGES)).encode()
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return port
+
+
+class RecordingSpider(BaseAsyncSpider):
+    """
+    Writes the shard which crawled a page, pages run in the worker processes
+    """
+
+    def __init__(self, root_url, record, loop=None, queue=None):
+        super().__init__(root_url, 3, 3, loop=loop, queue=queue)
+        self.record = record
+
+    def parse_links(self, response):
+        yield from self._loop.sleep(0)
+        with open(self.record, "a") as f:
+            f.write("%d %s\n" % (self.router.shard_id, response.url))
+        return response.body.decode().split("\n")
+
+
+def test_run_sharded_crawls_links_once_on_their_shard():
+    hits = Counter()
+    ports = []
+    # sites of both shards, shard_of hashes the port too
+    while len(ports) < 3 or len(set(shard_of("http://127.0.0.1:%d/" % p, 2) for p in ports)) < 2:
+        start_site(hits, ports)
+    seed = "http://127.0.0.1:%d/0" % ports[0]
+    saved = settings.HTTP_CACHE
+    settings.HTTP_CACHE = False
+    try:
+        with tempfile.TemporaryDirectory() as dirname:
+            record = os.path.join(dirname, "crawled")
+
+            def make_spiders(seeds, loop, q):
+                return [RecordingSpider(url, record, loop=loop, queue=q) for url in seeds] or \
+                       [RecordingSpider(None, record, loop=loop, queue=q)]
+
+            # run_sharded returns once every worker exited
+            crawl = threading.Thread(target=run_sharded, args=(2, [seed], make_spiders), kwargs={"concurrency": 2},
+                                     daemon=True)
+            crawl.start()
+            crawl.join(60)
+            assert not crawl.is_alive()
+            with open(record) as f:
+                crawled = [line.split() for line in f.read().splitlines()]
+    finally:
+        settings.HTTP_CACHE = saved
+
+    urls = ["http://127.0.0.1:%d/%d" % (p, n) for p in ports for n in range(PAGES)]
+    assert sorted(hits) == sorted(urls)
+    assert set(hits.values()) == {1}
+    assert sorted(url for _, url in crawled) == sorted(urls)
+    for shard_id, url in crawled:
+        assert shard_of(url, 2) == int(shard_id)
+
+
+if __name__ == "__main__":
+    test_shard_of_depends_on_host_only()
+    test_router_drops_messages_over_pipe_buf()
+    test_run_sharded_crawls_links_once_on_their_shard()